@@ -0,0 +1,4 @@
+When authCacheTimeout is set, the repository caches the roles granted to each
+set of credentials across requests, in memcached if memCache is set and in
+the server process otherwise. Changes to users, roles, role filters and
+entitlements made through the repository invalidate the cache.
@@ -0,0 +1,4 @@
+Clients, proxies and servers which all speak repository protocol version 74
+exchange calls in a compact length-prefixed binary encoding instead of
+XML-RPC, which is much cheaper to produce and parse for large responses such
+as getNewTroveList. Older peers keep using XML-RPC.
@@ -0,0 +1,3 @@
+Checking who owns the files an update is about to create now looks up all
+of a trove's paths in the local database with one query, instead of one
+query per file that is in the way.
@@ -0,0 +1,4 @@
+Applying a changeset to the local database now stages the files, file tags,
+dependencies and trove info of all of its troves in temporary tables and
+merges them with a few statements at the end, instead of several statements
+for every trove.
@@ -0,0 +1,5 @@
+The changeset cache of proxies and repositories, and the file contents
+cache of proxies, can now be limited to a number of bytes with the new
+changesetCacheSize configuration option. Least recently used entries are
+evicted in the background using a persistent index kept in the cache
+directory.
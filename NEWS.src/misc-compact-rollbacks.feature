@@ -0,0 +1,5 @@
+The new compactRollbacks option keeps the file contents saved in rollbacks in
+a compressed store shared by all rollbacks, where identical contents are only
+stored once. Full rollback changesets are rebuilt from it only when a
+rollback is applied, and contents are removed once no rollback refers to
+them.
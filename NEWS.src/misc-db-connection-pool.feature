@@ -0,0 +1,6 @@
+Repository servers can keep their database connections open between
+requests. Set repositoryDBPoolSize to the number of idle connections each
+process keeps; reused connections skip the schema version check and keep
+their temporary tables. Connections idle for a while are checked before
+they are reused. Administrators can read the pool statistics with the new
+getDatabasePoolStats call.
@@ -0,0 +1,5 @@
+The local database now uses a larger page cache and memory maps up to
+dbMmapSize of the database file. Setting dbJournalMode to wal switches it to
+write-ahead logging, so queries are no longer blocked while the database is
+updated; dbSynchronous sets how often it is synced in that mode, and updates
+are always synced to disk when they are committed.
@@ -0,0 +1,6 @@
+Updating a trove no longer rechecks every dependency on it. Only troves which
+require something the old version provided and the new one does not, or which
+are themselves removed, are checked again.
+What installed troves provide is also kept in memory between dependency
+checks and updated as troves are added and erased, so requirements which
+are already satisfied are not checked against the database again.
@@ -0,0 +1,4 @@
+Changeset fingerprints now change whenever a trove's instance or trove info
+rows change, so cached changesets are not served after mirrored trove info
+updates or hidden troves being presented. Fingerprints remembered in
+memcache are dropped after calls which can change them.
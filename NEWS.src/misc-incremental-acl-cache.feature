@@ -0,0 +1,4 @@
+Adding, changing and removing an ACL only rewrites the rows of the
+UserGroupInstancesCache and LatestCache tables whose access actually
+changes. rebuild-cache-tables has a new --online mode which rebuilds those
+tables in small resumable transactions while the repository stays in use.
@@ -0,0 +1,5 @@
+Added a changeset container version with a trailing offset index. Contents
+of changesets written in this format can be read in any order without
+rescanning the changeset. "conary changeset", downloadUpdate() and local
+rollbacks write it; changesets sent to repositories keep the old format,
+and commitChangeSetFile() converts indexed files before sending them.
@@ -0,0 +1,4 @@
+Troves loaded from the local database with their file objects now keep the
+files frozen and only thaw them when they are used, and files of the same
+trove share version objects and directory names. This lowers the memory
+needed by verify and by local changes on systems with many files.
@@ -0,0 +1,3 @@
+The in-process cache used by repositories and proxies when memCache is not
+set is now a least recently used cache bounded by the new memCacheLocalSize
+option, and it counts hits, misses and evictions.
@@ -0,0 +1,5 @@
+Mirroring now fetches the lists of new troves and new trove info a page at
+a time using the getNewTroveListPage and getNewTroveInfoPage calls (protocol
+version 75), which resume from the last trove returned instead of
+re-scanning and de-duplicating everything changed since the mirror mark.
+Older servers are still mirrored with the unpaged calls.
@@ -0,0 +1,5 @@
+File contents requested from several repositories at once are now
+downloaded concurrently, and large requests can be split into several
+concurrent downloads. The new downloadStreamsPerHost option limits how many
+run at once against one repository or proxy, and downloadStreamSize sets
+how much data each stream should carry.
@@ -0,0 +1,4 @@
+The new restoreThreads configuration option lets updates uncompress and
+write regular files from a changeset in several threads. Files are still
+renamed into place and journaled one at a time in the usual order, so
+rollbacks are unaffected.
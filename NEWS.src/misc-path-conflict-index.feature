@@ -0,0 +1,4 @@
+Path conflict checks during updates now only look up the paths being
+installed, using a new index of the files present on the system, instead of
+joining every file in the database. The index is added to existing
+databases the first time they are opened for writing.
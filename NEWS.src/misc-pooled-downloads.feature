@@ -0,0 +1,4 @@
+Threaded updates can download changesets for several job sets at once. The
+new downloadThreads, downloadPrefetch and downloadPrefetchSize configuration
+options control the number of download threads and how far ahead of the
+job set being applied they may run.
@@ -0,0 +1,5 @@
+When several clients ask a proxy for the same changeset at once, only the
+first request fetches it from upstream. The others answer as soon as the
+changeset header is in the cache and stream the rest from the partially
+written cache file, instead of waiting for the download to finish or
+fetching it again. This now also applies to threads within one process.
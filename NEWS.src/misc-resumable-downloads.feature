@@ -0,0 +1,7 @@
+Interrupted changeset downloads are resumed. "conary update" keeps partial
+downloads in the downloads directory next to the database. Running the same
+update again continues them where they stopped, and the directory is
+cleared once an update succeeds. ConaryClient.downloadUpdate() checkpoints
+into its destination directory instead, and also reuses the changesets which
+were already complete. Every checkpointed changeset is checked for
+truncation and garbage before it is used.
@@ -0,0 +1,3 @@
+When the new streamCommitContents repository option is enabled, file
+contents are written to the contents store while a changeset is still being
+uploaded for commit, so the commit only has to add the troves.
@@ -0,0 +1,5 @@
+The new syncUpdates option makes updates safe against crashes and power
+failures. The operation journal is synced before files it protects are
+replaced or removed, in batches of files rather than one file at a time, and
+the files of each job are synced with one syncfs() per filesystem before
+the database records the job.
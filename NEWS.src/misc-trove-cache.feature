@@ -0,0 +1,5 @@
+The repository can keep troves it has read in an in-process cache that is
+shared by all requests. Set troveCacheSize to its size budget to enable it.
+A cached trove is used only while its instance and trove info rows are
+unchanged. Removing a trove, setting its trove info or signing it drops its
+cached copies.
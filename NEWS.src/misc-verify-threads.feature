@@ -0,0 +1,4 @@
+"conary verify" can checksum files in several threads (the new verifyThreads
+option) and, with verifyHashCache set, remembers the checksums it computed
+in a cache next to the database, so files whose inode, size, mtime and ctime
+have not changed are not read again unless --hash is given.
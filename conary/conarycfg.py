@@ -520,6 +520,14 @@ class CfgCapsuleSync(CfgEnum):
         return CfgEnum.parseString(self, val)
 
 
+class CfgDbJournalMode(CfgEnum):
+    validValues = [ 'delete', 'truncate', 'persist', 'wal' ]
+
+
+class CfgDbSynchronous(CfgEnum):
+    validValues = [ 'normal', 'full', 'extra' ]
+
+
 def _getDefaultPublicKeyrings():
     publicKeyrings = []
     # If we are root, don't use the keyring in $HOME, since a process started
@@ -572,7 +580,18 @@ class ConaryContext(ConfigSection):
     configComponent       =  (CfgBool, True)
     contact               =  None
     context               =  None
+    dbCacheSize           =  (CfgBytes('M'), 32000000, "Size of the page "
+            "cache used for the local database, in megabytes")
+    dbJournalMode         =  (CfgDbJournalMode, 'delete', "Journal mode of "
+            "the local database. With wal, queries are not blocked while "
+            "the database is updated, but users who cannot write to the "
+            "database directory can only read it while it is open elsewhere")
+    dbMmapSize            =  (CfgBytes('M'), 256000000, "Amount of the local "
+            "database which is memory mapped, in megabytes")
     dbPath                =  '/var/lib/conarydb'
+    dbSynchronous         =  (CfgDbSynchronous, 'normal', "How often the "
+            "local database is synced to disk when dbJournalMode is wal. "
+            "Updates are always synced when they are committed")
     debugExceptions       =  (CfgBool, False)
     debugRecipeExceptions =  (CfgBool, False)
     defaultMacros         =  (CfgPathList, ('/etc/conary/macros',
@@ -590,6 +609,10 @@ class ConaryContext(ConfigSection):
     fullVersions          =  CfgBool
     fullFlavors           =  CfgBool
     localRollbacks        =  CfgBool
+    compactRollbacks      =  (CfgBool, False, "Keep the file contents of "
+            "rollbacks in a compressed store shared by all of them, instead "
+            "of in each rollback. Rollbacks stored this way cannot be "
+            "applied by older versions of Conary")
     keepRequired          =  CfgBool
     ignoreDependencies    =  (CfgDependencyClassList,
                               [ deps.AbiDependency, deps.RpmLibDependencies])
@@ -627,6 +650,12 @@ class ConaryContext(ConfigSection):
     downloadRetryTrim     =  (CfgBytes('k'), 1000000,
             "If a download is reattempted, trim this many kilobytes off the "
             "end of what was previously downloaded. 0 disables this feature.")
+    downloadStreamsPerHost = (CfgInt, 1, "Maximum number of file contents "
+            "downloads to run at once from any one repository or proxy")
+    downloadStreamSize    =  (CfgBytes('M'), 50000000,
+            "File contents requests to one repository larger than this many "
+            "megabytes are split into several concurrent downloads, up to "
+            "downloadStreamsPerHost of them")
     # The first keyring in the list is writable, and is used for storing the
     # keys that are not present on the system-wide keyring. Always expect
     # Conary to write to the first keyring.
@@ -655,6 +684,19 @@ class ConaryContext(ConfigSection):
     sourceSearchDir       =  (CfgPath, '.')
     threaded              =  (CfgBool, True)
     downloadFirst         =  (CfgBool, False)
+    downloadThreads       =  (CfgInt, 1, "Number of threads downloading "
+            "changesets during threaded updates")
+    downloadPrefetch      =  (CfgInt, 5, "Number of job sets which may be "
+            "downloaded ahead of the one being applied")
+    downloadPrefetchSize  =  (CfgBytes('M'), 0, "Limit on the size of "
+            "changesets downloaded ahead of the one being applied when "
+            "downloadThreads is more than 1. 0 disables the limit.")
+    restoreThreads        =  (CfgInt, 1, "Number of threads uncompressing "
+            "and writing file contents while an update is applied")
+    syncUpdates           =  (CfgBool, False, "Sync the operation journal "
+            "and the files of each job to disk in groups while an update is "
+            "applied, so it can be reverted after a crash or power failure "
+            "as well as after an error")
     tmpDir                =  (CfgPath, _getDefaultTempDir())
     trustThreshold        =  (CfgInt, 0)
     trustedCerts          =  (CfgPathList, (),
@@ -670,6 +712,11 @@ class ConaryContext(ConfigSection):
     verifyDirsNoNewFiles  =  (CfgPathList, ('/proc', '/sys', '/home', '/dev',
                                             '/mnt', '/tmp', '/var',
                                             '/media', '/initrd' ))
+    verifyHashCache       =  (CfgBool, False, "Remember file checksums "
+            "computed by verify, and reuse them while the file's inode, "
+            "size, mtime and ctime are unchanged, unless --hash is given")
+    verifyThreads         =  (CfgInt, 1, "Number of threads computing file "
+            "checksums for verify")
     windowsBuildService   = CfgString
 
     systemIdScript        = CfgPath
@@ -25,7 +25,7 @@ from conary.lib import log, util, openpgpkey, api
 from conary.lib import cfgtypes
 from conary.local import database
 from conary.repository.netclient import NetworkRepositoryClient
-from conary.repository import searchsource
+from conary.repository import filecontainer, searchsource
 from conary.repository import resolvemethod
 
 # mixins for ConaryClient
@@ -86,8 +86,11 @@ class ConaryClient(ClientClone, ClientBranch, ClientUpdate, ClientNewTrove,
         self.repos = None
 
         self.cfg = cfg
+        tuning = dict(journalMode=cfg.dbJournalMode,
+                      synchronous=cfg.dbSynchronous,
+                      cacheSize=cfg.dbCacheSize, mmapSize=cfg.dbMmapSize)
         self.db = database.Database(cfg.root, cfg.dbPath, cfg.modelPath,
-                                    modelFile=modelFile)
+                                    modelFile=modelFile, tuning=tuning)
         if repos:
             self.repos = repos
         else:
@@ -344,9 +347,13 @@ class ConaryClient(ClientClone, ClientBranch, ClientUpdate, ClientNewTrove,
                 recurse = recurse, skipNotByDefault = skipNotByDefault,
                 excludeList = excludeList, callback = callback)
 
+        # the file is read by clients rather than sent to a repository, so
+        # it gets an offset index; commitChangeSetFile() converts it back
+        csVersion = filecontainer.FILE_CONTAINER_VERSION_OFFSET_IDX
         self.repos.createChangeSetFile(fullCsList, path, recurse = False,
                                        primaryTroveList = primaryList,
-                                       callback = callback)
+                                       callback = callback,
+                                       changesetVersion = csVersion)
 
     def checkWriteableRoot(self):
         """
@@ -589,10 +589,14 @@ def _getNewInfo(src, cfg, mark):
     mark = str(long(mark)) # xmlrpc chokes on longs
     infoTypes = [trove._TROVEINFO_TAG_SIGS, trove._TROVEINFO_TAG_METADATA]
     try:
-        infoList = src.getNewTroveInfo(cfg.host, mark, infoTypes, labels)
+        infoList = list(src.iterNewTroveInfo(cfg.host, mark, infoTypes,
+                                             labels))
     except errors.InvalidServerVersion:
-        # otherwise we mirror just the sigs...
-        infoList = _getNewSigs(src, cfg, mark)
+        try:
+            infoList = src.getNewTroveInfo(cfg.host, mark, infoTypes, labels)
+        except errors.InvalidServerVersion:
+            # otherwise we mirror just the sigs...
+            infoList = _getNewSigs(src, cfg, mark)
     return infoList
 
 
@@ -787,6 +791,20 @@ def buildBundles(sourceRepos, target, troveList, absolute=False,
             splitNodes)
     return bundles
 
+# get the next batch of troves changed at or after mark; whole marks only,
+# so that the next batch can start after the highest mark of this one
+def _getNewTroves(src, cfg, mark, batchSize=1000):
+    try:
+        troveIter = src.iterNewTroveList(cfg.host, str(mark))
+    except errors.InvalidServerVersion:
+        return src.getNewTroveList(cfg.host, str(mark))
+    troveList = []
+    for item in troveIter:
+        if len(troveList) >= batchSize and item[0] != troveList[-1][0]:
+            break
+        troveList.append(item)
+    return troveList
+
 # return the new list of troves to process after filtering and sanity checks
 def getTroveList(src, cfg, mark):
     # FIXME: getNewTroveList should accept and only return troves on
@@ -794,7 +812,7 @@ def getTroveList(src, cfg, mark):
     log.debug("looking for new troves")
     # make sure we always treat the mark as an integer
     troveList = [(long(m), (n,v,f), t) for m, (n,v,f), t in
-                  src.getNewTroveList(cfg.host, str(mark))]
+                  _getNewTroves(src, cfg, mark)]
     if not len(troveList):
         # this should be the end - no more troves to look at
         log.debug("no new troves found")
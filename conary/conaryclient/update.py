@@ -35,7 +35,7 @@ from conary.lib import log, util, api
 from conary.lib import cfgtypes
 from conary.local import capsules
 from conary.local import database
-from conary.repository import changeset, trovesource, searchsource
+from conary.repository import changeset, filecontainer, trovesource, searchsource
 from conary.repository.errors import TroveMissing, OpenError
 from conary import trove, versions
 
@@ -2971,6 +2971,8 @@ conary erase '%s=%s[%s]'
             commitFlags.replaceModifiedConfigFiles = replaceModifiedConfigFiles
             commitFlags.justDatabase = justDatabase
             commitFlags.localRollbacks = localRollbacks
+            commitFlags.compactRollbacks = self.cfg.compactRollbacks
+            commitFlags.syncUpdates = self.cfg.syncUpdates
             commitFlags.test = test
             commitFlags.keepJournal = keepJournal
             commitFlags.skipCapsuleOps = skipCapsuleOps
@@ -3492,17 +3494,35 @@ conary erase '%s=%s[%s]'
                               + '\n    '.join('%s=%s[%s]' % ((x[0],) + x[1])
                                               for x in sorted(extraTroves)))
 
-    def _createCs(self, repos, db, jobSet, uJob):
+    def _createCs(self, repos, db, jobSet, uJob, sourceLock = None,
+                  checkpointDir = None):
         baseCs = changeset.ReadOnlyChangeSet()
 
-        cs, remainder = uJob.getTroveSource().createChangeSet(jobSet,
-                                    recurse = False, withFiles = True,
-                                    withFileContents = True,
-                                    useDatabase = False)
+        # when several threads download changesets, the update job's trove
+        # source is shared between them and has to be used one at a time,
+        # pointed at the database of the thread using it
+        if sourceLock is not None:
+            sourceLock.acquire()
+        try:
+            if sourceLock is not None:
+                uJob.troveSource.db = db
+            cs, remainder = uJob.getTroveSource().createChangeSet(jobSet,
+                                        recurse = False, withFiles = True,
+                                        withFileContents = True,
+                                        useDatabase = False)
+        finally:
+            if sourceLock is not None:
+                sourceLock.release()
         baseCs.merge(cs)
         if remainder:
+            if checkpointDir is None:
+                checkpointDir = self._getCheckpointDir(db)
+            kwargs = {}
+            if checkpointDir:
+                kwargs['checkpointDir'] = checkpointDir
             newCs = repos.createChangeSet(remainder, recurse = False,
-                                          callback = self.updateCallback)
+                                          callback = self.updateCallback,
+                                          **kwargs)
             baseCs.merge(newCs)
 
         self._replaceIncomplete(baseCs, db, db, repos)
@@ -3519,6 +3539,7 @@ conary erase '%s=%s[%s]'
         justDatabase = kwargs['commitFlags'].justDatabase
         noScripts = kwargs['commitFlags'].noScripts
         kwargs.setdefault('removeHints', {})
+        kwargs.setdefault('restoreThreads', self.cfg.restoreThreads)
         # Run pre scripts, if we have the per-job information
         if (uJob.hasJobPreScriptsOrder() and 
             (tagScript or not noScripts)):
@@ -3583,6 +3604,79 @@ conary erase '%s=%s[%s]'
 
         # returning terminates the thread
 
+    def _createAllCsPooled(self, q, allJobs, uJob, cfg, stopSelf):
+        # Same contract as _createAllCs, but the changesets are downloaded
+        # by a pool of cfg.downloadThreads workers, each with its own
+        # database and repository objects. Workers run at most
+        # cfg.downloadPrefetch job sets (and cfg.downloadPrefetchSize bytes)
+        # ahead of the applier, and this thread hands the results to the
+        # applier strictly in job order.
+        import Queue
+        from threading import Thread
+
+        self.updateCallback.setAbortEvent(stopSelf)
+        state = _PrefetchState(len(allJobs), cfg.downloadPrefetch,
+                               cfg.downloadPrefetchSize)
+        for i in range(min(cfg.downloadThreads, len(allJobs))):
+            worker = Thread(None, self._prefetchChangeSets,
+                            args = (state, allJobs, uJob, cfg, stopSelf))
+            # workers stuck in a download must not keep the process alive
+            worker.setDaemon(True)
+            worker.start()
+
+        try:
+            for i in range(len(allJobs)):
+                result = state.take(i, stopSelf)
+                if result is None:
+                    return
+
+                while True:
+                    # block for no more than 5 seconds so we can
+                    # check to see if we should abort
+                    try:
+                        q.put(result, True, 5)
+                        break
+                    except Queue.Full:
+                        if stopSelf.isSet():
+                            return
+
+                if result[0]:
+                    # the applier raises the exception; nothing after it
+                    # will be applied
+                    return
+        finally:
+            state.stop()
+
+        self.updateCallback.setAbortEvent(None)
+        q.put(None)
+
+    def _prefetchChangeSets(self, state, allJobs, uJob, cfg, stopSelf):
+        # Worker for _createAllCsPooled. The database and repository
+        # objects are opened lazily so errors doing so are reported through
+        # the job they prevented from being downloaded. As in _createAllCs,
+        # the database is left open since the update job's trove source
+        # may still reference it.
+        db = None
+        while True:
+            i = state.claim(stopSelf)
+            if i is None:
+                return
+
+            self.updateCallback.setChangesetHunk(i + 1, len(allJobs))
+            try:
+                if db is None:
+                    # see _createAllCs for the timeout
+                    db = database.Database(cfg.root, cfg.dbPath,
+                                           timeout = 300000)
+                    repos = self.createRepos(db, cfg)
+                newCs = self._createCs(repos, db, allJobs[i], uJob,
+                                       sourceLock = state.sourceLock)
+            except:
+                state.put(i, (True, sys.exc_info()), 0)
+                return
+
+            state.put(i, (False, newCs), _getChangeSetSize(newCs))
+
     @api.publicApi
     def getDownloadSizes(self, uJob):
         """
@@ -3605,6 +3699,51 @@ conary erase '%s=%s[%s]'
 
         return sizes
 
+    @staticmethod
+    def _getCheckpointDir(db):
+        """
+        Return the directory next to C{db} which interrupted changeset
+        downloads are kept in, so the next attempt at the update resumes
+        them, or None if there is no such directory we can write to.
+        """
+        path = getattr(db, 'downloadCheckpointPath', None)
+        if not path:
+            return None
+        try:
+            util.mkdirChain(path)
+        except OSError:
+            return None
+        if not os.access(path, os.W_OK):
+            return None
+        return path
+
+    @staticmethod
+    def _haveDownloadedCs(path, job):
+        """
+        Return True if C{path} is an intact changeset for C{job}, left by
+        an earlier call to downloadUpdate.
+        """
+        def _key(jobs):
+            # relative and absolute changesets are equally good
+            keys = set()
+            for name, old, new, absolute in jobs:
+                if new[0] is None:
+                    keys.add((name, old, False))
+                else:
+                    keys.add((name, new, True))
+            return keys
+
+        if not os.path.exists(path):
+            return False
+        try:
+            fc = filecontainer.FileContainer(
+                    util.ExtendedFile(path, 'r', buffering = False))
+            fc.verify()
+            cs = changeset.ChangeSetFromFile(path)
+        except (IOError, filecontainer.BadContainer):
+            return False
+        return _key(cs.getJobSet()) == _key(job)
+
     @api.publicApi
     def downloadUpdate(self, uJob, destDir):
         """
@@ -3613,19 +3752,29 @@ conary erase '%s=%s[%s]'
         @param uJob: The update job.
         @type uJob: L{database.UpdateJob}
         @param destDir: Directory where the changesets will be stored.
+        Changesets already downloaded there for the same jobs are reused,
+        and interrupted downloads are resumed.
         @type destDir: path
         """
         allJobs = uJob.getJobs()
         csFiles = []
         for i, job in enumerate(allJobs):
             self.updateCallback.setChangesetHunk(i + 1, len(allJobs))
-            # Create the relative changeset
-            newCs = self._createCs(self.repos, self.db, job, uJob)
-
-            # Dump the changeset to disk
             path = os.path.join(destDir, "%04d.ccs" % i)
-            newCs.writeToFile(path)
             csFiles.append(path)
+            if self._haveDownloadedCs(path, job):
+                continue
+
+            # Create the relative changeset
+            newCs = self._createCs(self.repos, self.db, job, uJob,
+                                   checkpointDir = destDir)
+
+            # Dump the changeset to disk; only complete files get the final
+            # name, so a later run can tell which ones it can reuse. These
+            # are only read here, so they get an offset index
+            newCs.writeToFile(path + '.tmp', versionOverride =
+                              filecontainer.FILE_CONTAINER_VERSION_OFFSET_IDX)
+            os.rename(path + '.tmp', path)
 
         uJob.setJobsChangesetList(csFiles)
         # Set the search source to use the downloaded troves
@@ -3667,7 +3816,14 @@ conary erase '%s=%s[%s]'
         # Calls _applyUpdateL, but deals with locks too
         try:
             self.db.commitLock(True)
-            return self._applyUpdateL(*args, **kwargs)
+            ret = self._applyUpdateL(*args, **kwargs)
+            # partial downloads of changesets which are no longer needed
+            # (because the update they were for changed) are only dropped
+            # once an update makes it through
+            path = getattr(self.db, 'downloadCheckpointPath', None)
+            if path:
+                util.rmtree(path, ignore_errors = True)
+            return ret
         finally:
             self.db.commitLock(False)
             self.db.close()
@@ -3770,10 +3926,16 @@ conary erase '%s=%s[%s]'
         import Queue
         from threading import Thread, Event
 
-        csQueue = Queue.Queue(5)
+        if self.cfg.downloadThreads > 1:
+            # the pool does its own prefetching
+            csQueue = Queue.Queue(1)
+            createAllCs = self._createAllCsPooled
+        else:
+            csQueue = Queue.Queue(5)
+            createAllCs = self._createAllCs
         stopDownloadEvent = Event()
 
-        downloadThread = Thread(None, self._createAllCs,
+        downloadThread = Thread(None, createAllCs,
                 args = (csQueue, allJobs, uJob, self.cfg, stopDownloadEvent))
         downloadThread.start()
 
@@ -3844,6 +4006,107 @@ conary erase '%s=%s[%s]'
         return self.db.syncCapsuleDatabase(makePins, callback)
 
 
+class _PrefetchState(object):
+    """
+    Bookkeeping shared between the changeset download workers and the
+    thread which feeds their results, in order, to the applier.
+    """
+
+    def __init__(self, jobCount, maxAhead, maxSize):
+        import threading
+        self.cond = threading.Condition()
+        # serializes access to the update job's trove source
+        self.sourceLock = threading.Lock()
+        self.jobCount = jobCount
+        self.maxAhead = max(1, maxAhead)
+        self.maxSize = maxSize
+        # index of the next job set to download
+        self.next = 0
+        # index of the next job set to hand to the applier
+        self.delivered = 0
+        # job index -> (result, size)
+        self.results = {}
+        self.pendingSize = 0
+        self.stopped = False
+
+    def claim(self, stopEvent):
+        """
+        Return the index of the next job set to download, waiting until it
+        fits in the prefetch budget, or None if there is nothing left to do.
+        The job set the applier needs next is always allowed.
+        """
+        self.cond.acquire()
+        try:
+            while True:
+                if (stopEvent.isSet() or self.stopped or
+                        self.next >= self.jobCount):
+                    return None
+                ahead = self.next - self.delivered
+                if not ahead or (ahead < self.maxAhead and
+                        (not self.maxSize or self.pendingSize < self.maxSize)):
+                    i = self.next
+                    self.next += 1
+                    return i
+                # wake up periodically to check stopEvent
+                self.cond.wait(5)
+        finally:
+            self.cond.release()
+
+    def put(self, i, result, size):
+        self.cond.acquire()
+        try:
+            self.results[i] = (result, size)
+            self.pendingSize += size
+            self.cond.notifyAll()
+        finally:
+            self.cond.release()
+
+    def take(self, i, stopEvent):
+        """
+        Wait for the result of job set C{i} and return it, or None if the
+        download was stopped first.
+        """
+        self.cond.acquire()
+        try:
+            while i not in self.results:
+                if stopEvent.isSet() or self.stopped:
+                    return None
+                self.cond.wait(5)
+            result, size = self.results.pop(i)
+            self.pendingSize -= size
+            self.delivered = i + 1
+            self.cond.notifyAll()
+            return result
+        finally:
+            self.cond.release()
+
+    def stop(self):
+        self.cond.acquire()
+        try:
+            self.stopped = True
+            self.results.clear()
+            self.cond.notifyAll()
+        finally:
+            self.cond.release()
+
+
+def _getChangeSetSize(cs):
+    """
+    Return the number of bytes the file containers backing C{cs} occupy,
+    which is what a downloaded changeset holds on disk until it is applied.
+    """
+    size = 0
+    for csf in cs.fileContainers:
+        f = csf.file
+        if f is None:
+            continue
+        if hasattr(f, 'size'):
+            size += f.size
+        elif hasattr(f, 'fileno'):
+            size += os.fstat(f.fileno()).st_size
+    return size
+
+
 class UpdateError(ClientError):
     """Base class for update errors"""
     def display(self):
@@ -23,6 +23,7 @@ from conary.lib import cfg, cfgtypes
 from base_drv import BaseDatabase as Database
 from base_drv import BaseCursor as Cursor
 from migration import SchemaMigration
+from pool import ConnectionPool, getPool
 from sqlerrors import InvalidBackend
 
 # default driver we want to use
@@ -83,4 +84,5 @@ class CfgDriver(cfg.CfgType):
     def format(self, val, displayOptions = None):
         return "%s %s" % val
 
-__all__ = [ "connect", "InvalidBackend", "CfgDriver"]
+__all__ = [ "connect", "ConnectionPool", "getPool", "InvalidBackend",
+            "CfgDriver"]
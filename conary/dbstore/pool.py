@@ -0,0 +1,198 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Persistent database connections shared by the requests a server process
+handles.
+
+A connection taken from a L{ConnectionPool} with C{checkout()} is the same
+database object a previous request used, with its schema information, the
+temporary tables it created and its schema version still in place, so only
+the first request on each connection pays for setting them up. Giving it
+back with C{checkin()} rolls back whatever the request left uncommitted.
+
+This is meant for networked backends (the postgresql, psycopg2 and pgpool
+drivers); sqlite connections cannot be shared between threads.
+"""
+
+import os
+import threading
+import time
+
+# Pools by driver and database, shared by everything in this process
+_pools = {}
+_poolsLock = threading.Lock()
+
+
+class ConnectionPool(object):
+    """
+    Keeps up to C{maxIdle} idle connections to C{database} open.
+
+    Connections which sat idle for more than C{checkInterval} seconds are
+    checked with C{alive()} before they are handed out again, and
+    connections older than C{maxAge} seconds (if set) are closed instead of
+    being reused.
+    """
+
+    def __init__(self, database, driver = None, maxIdle = 5,
+                 checkInterval = 30, maxAge = None):
+        self.database = database
+        self.driver = driver
+        self.maxIdle = maxIdle
+        self.checkInterval = checkInterval
+        self.maxAge = maxAge
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+        # (db, created, lastUsed) tuples, most recently used last
+        self._idle = []
+        # maps id(db) to when the checked out connections were created
+        self._active = {}
+        self.created = self.reused = self.discarded = 0
+        self.failedChecks = 0
+
+    def _connect(self):
+        # avoid a recursive import; this module is loaded by conary.dbstore
+        from conary.dbstore import connect
+        return connect(self.database, driver = self.driver)
+
+    def _forked(self):
+        # called with the lock held; connections inherited from the parent
+        # belong to it
+        if self.pid == os.getpid():
+            return
+        for db, created, lastUsed in self._idle:
+            db.close_fork()
+        self._idle = []
+        self._active = {}
+        self.pid = os.getpid()
+
+    def _expired(self, created, now):
+        return self.maxAge and now - created > self.maxAge
+
+    def checkout(self):
+        """Return an open connection, reusing an idle one if possible."""
+        while True:
+            self.lock.acquire()
+            try:
+                self._forked()
+                if not self._idle:
+                    break
+                db, created, lastUsed = self._idle.pop()
+            finally:
+                self.lock.release()
+
+            now = time.time()
+            if self._expired(created, now):
+                self._discard(db)
+                continue
+            if now - lastUsed > self.checkInterval and not db.alive():
+                self.failedChecks += 1
+                self._discard(db)
+                continue
+            self.lock.acquire()
+            try:
+                self._active[id(db)] = created
+                self.reused += 1
+            finally:
+                self.lock.release()
+            return db
+
+        db = self._connect()
+        self.lock.acquire()
+        try:
+            self._active[id(db)] = time.time()
+            self.created += 1
+        finally:
+            self.lock.release()
+        return db
+
+    def checkin(self, db):
+        """
+        Give back a connection from L{checkout}. Anything the caller left
+        uncommitted is rolled back; connections which fail at that are
+        closed.
+        """
+        self.lock.acquire()
+        try:
+            self._forked()
+            created = self._active.pop(id(db), None)
+        finally:
+            self.lock.release()
+        if created is None:
+            # checked out before a fork, or not ours
+            return
+
+        if db.closed or not db.dbh:
+            self._discard(db)
+            return
+        try:
+            db.rollback()
+        except Exception:
+            self._discard(db)
+            return
+
+        now = time.time()
+        if self._expired(created, now):
+            self._discard(db)
+            return
+        self.lock.acquire()
+        try:
+            if len(self._idle) < self.maxIdle:
+                self._idle.append((db, created, now))
+                return
+        finally:
+            self.lock.release()
+        self._discard(db)
+
+    def _discard(self, db):
+        self.discarded += 1
+        try:
+            db.close()
+        except Exception:
+            pass
+
+    def close(self):
+        """Close all idle connections."""
+        self.lock.acquire()
+        try:
+            idle = self._idle
+            self._idle = []
+        finally:
+            self.lock.release()
+        for db, created, lastUsed in idle:
+            self._discard(db)
+
+    def stats(self):
+        return dict(idle = len(self._idle), active = len(self._active),
+                    created = self.created, reused = self.reused,
+                    discarded = self.discarded,
+                    failedChecks = self.failedChecks)
+
+
+def getPool(database, driver = None, **kw):
+    """
+    Return the pool for C{database}, creating it with the given keyword
+    arguments if this process does not have one yet.
+    """
+    key = (driver, database)
+    _poolsLock.acquire()
+    try:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(database, driver, **kw)
+        return pool
+    finally:
+        _poolsLock.release()
@@ -590,45 +590,58 @@ class RegularFile(File):
     def sizeString(self):
         return "%8d" % self.contents.size()
 
+    @staticmethod
+    def extractContents(fileContents, target):
+        """
+        Uncompress C{fileContents} into a temporary file in the directory
+        C{target} will be restored to. Returns the sha1 of the contents and
+        the name of the temporary file. Does not touch C{target} itself, so
+        this is safe to run in another thread.
+        """
+        # this is first to let us copy the contents of a file
+        # onto itself; the unlink helps that to work
+        src = fileContents.get()
+        inFd = None
+
+        if fileContents.isCompressed() and hasattr(src, '_fdInfo'):
+            # inFd is None if we can't figure this information out
+            # (for _LazyFile for instance)
+            (inFd, inStart, inSize) = src._fdInfo()
+
+        path, name = os.path.split(target)
+        if not os.path.isdir(path):
+            util.mkdirChain(path)
+
+        # Uncompress to a temporary file, using the accelerated
+        # implementation if possible.
+        if inFd is not None and util.sha1Uncompress is not None:
+            return util.sha1Uncompress(inFd, inStart, inSize, path, name)
+
+        if fileContents.isCompressed():
+            src = gzip.GzipFile(mode='r', fileobj=src)
+        tmpfd, tmpname = tempfile.mkstemp(name, '.ct', path)
+        try:
+            d = digestlib.sha1()
+            f = os.fdopen(tmpfd, 'w')
+            util.copyfileobj(src, f, digest = d)
+            f.close()
+        except:
+            os.unlink(tmpname)
+            raise
+        return d.digest(), tmpname
+
     def restore(self, fileContents, root, target, journal=None, sha1 = None,
                 nameLookup=True, **kwargs):
 
         keepTempfile = kwargs.get('keepTempfile', False)
+        # (sha1, tmpname) from an earlier call to extractContents()
+        extracted = kwargs.pop('extracted', None)
         destTarget = target
 
         if fileContents is not None:
-            # this is first to let us copy the contents of a file
-            # onto itself; the unlink helps that to work
-            src = fileContents.get()
-            inFd = None
-
-            if fileContents.isCompressed() and hasattr(src, '_fdInfo'):
-                # inFd is None if we can't figure this information out
-                # (for _LazyFile for instance)
-                (inFd, inStart, inSize) = src._fdInfo()
-
-            path, name = os.path.split(target)
-            if not os.path.isdir(path):
-                util.mkdirChain(path)
-
-            # Uncompress to a temporary file, using the accelerated
-            # implementation if possible.
-            if inFd is not None and util.sha1Uncompress is not None:
-                actualSha1, tmpname = util.sha1Uncompress(
-                        inFd, inStart, inSize, path, name)
-            else:
-                if fileContents.isCompressed():
-                    src = gzip.GzipFile(mode='r', fileobj=src)
-                tmpfd, tmpname = tempfile.mkstemp(name, '.ct', path)
-                try:
-                    d = digestlib.sha1()
-                    f = os.fdopen(tmpfd, 'w')
-                    util.copyfileobj(src, f, digest = d)
-                    f.close()
-                    actualSha1 = d.digest()
-                except:
-                    os.unlink(tmpname)
-                    raise
+            if extracted is None:
+                extracted = self.extractContents(fileContents, target)
+            actualSha1, tmpname = extracted
 
             if keepTempfile:
                 # Make a hardlink "copy" for the caller to use
@@ -652,14 +665,63 @@ class RegularFile(File):
     def __init__(self, *args, **kargs):
         File.__init__(self, *args, **kargs)
 
+def contentsFromFilesystem(path, statBuf, sha1FailOk = False):
+    """
+    Return the sha1 and size of the regular file at C{path}, as stored in
+    its contents stream. Prelinked executables are measured as they were
+    before they were prelinked.
+    """
+    global _havePrelink
+
+    undoPrelink = False
+    if _havePrelink != False and (statBuf.st_mode & 0111):
+        try:
+            from conary.lib import elf
+            if elf.prelinked(path):
+                undoPrelink = True
+        except:
+            pass
+    if undoPrelink and _havePrelink is None:
+        _havePrelink = bool(os.access(PRELINK_CMD[0], os.X_OK))
+    if undoPrelink and _havePrelink:
+        prelink = subprocess.Popen(
+                PRELINK_CMD + ("-y", path),
+                stdout = subprocess.PIPE,
+                close_fds = True,
+                shell = False)
+        d = digestlib.sha1()
+        content = prelink.stdout.read()
+        size = 0
+        while content:
+            d.update(content)
+            size += len(content)
+            content = prelink.stdout.read()
+
+        prelink.wait()
+        return d.digest(), size
+
+    try:
+        sha1 = sha1helper.sha1FileBin(path)
+    except OSError:
+        if sha1FailOk:
+            sha1 = sha1helper.sha1Empty
+        else:
+            raise
+    return sha1, statBuf.st_size
+
 def FileFromFilesystem(path, pathId, possibleMatch = None, inodeInfo = False,
-        assumeRoot=False, statBuf=None, sha1FailOk=False):
+        assumeRoot=False, statBuf=None, sha1FailOk=False, hashCache=None):
+    """
+    Build a file object describing C{path}. If C{hashCache} is given
+    (see L{conary.local.hashcache.HashCache}), the contents sha1 is taken
+    from it when possible, and stored in it otherwise.
+    """
     if statBuf:
         s = statBuf
     else:
         s = os.lstat(path)
 
-    global userCache, groupCache, _havePrelink
+    global userCache, groupCache
 
     if assumeRoot:
         owner = 'root'
@@ -738,43 +800,18 @@ def FileFromFilesystem(path, pathId, possibleMatch = None, inodeInfo = False,
     if needsSha1:
         f.contents = RegularFileStream()
 
-        undoPrelink = False
-        if _havePrelink != False and f.inode.isExecutable():
-            try:
-                from conary.lib import elf
-                if elf.prelinked(path):
-                    undoPrelink = True
-            except:
-                pass
-        if undoPrelink and _havePrelink is None:
-            _havePrelink = bool(os.access(PRELINK_CMD[0], os.X_OK))
-        if undoPrelink and _havePrelink:
-            prelink = subprocess.Popen(
-                    PRELINK_CMD + ("-y", path),
-                    stdout = subprocess.PIPE,
-                    close_fds = True,
-                    shell = False)
-            d = digestlib.sha1()
-            content = prelink.stdout.read()
-            size = 0
-            while content:
-                d.update(content)
-                size += len(content)
-                content = prelink.stdout.read()
-
-            prelink.wait()
-            f.contents.size.set(size)
-            sha1 = d.digest()
-        else:
-            try:
-                sha1 = sha1helper.sha1FileBin(path)
-            except OSError:
-                if sha1FailOk:
-                    sha1 = sha1helper.sha1Empty
-                else:
-                    raise
-            f.contents.size.set(s.st_size)
-
+        sha1 = size = None
+        if hashCache is not None:
+            cached = hashCache.get(path, s)
+            if cached is not None:
+                sha1, size = cached
+        if sha1 is None:
+            sha1, size = contentsFromFilesystem(path, s,
+                                                sha1FailOk = sha1FailOk)
+            if hashCache is not None:
+                hashCache.set(path, s, sha1, size)
+
+        f.contents.size.set(size)
         f.contents.sha1.set(sha1)
 
     if inodeInfo:
@@ -842,6 +879,9 @@ def frozenFileFlags(frz):
 def frozenFileContentInfo(frz):
     return RegularFile.find(FILE_STREAM_CONTENTS, frz[1:])
 
+def frozenFileInode(frz):
+    return File.find(FILE_STREAM_INODE, frz[1:])
+
 def frozenFileTags(frz):
     return File.find(FILE_STREAM_TAGS, frz[1:])
 
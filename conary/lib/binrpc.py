@@ -0,0 +1,278 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Compact binary encoding for repository RPC calls.
+
+This carries exactly the same values as the XML-RPC encoding produced by
+L{conary.lib.util.xmlrpcDump} and decodes them to the same Python types
+(sequences become lists, ASCII unicode becomes str, and so on), so either
+encoding can be used for any call. Every value is a one byte tag followed by
+a fixed size number or a length-prefixed payload; frozen versions, flavors
+and streams are copied through verbatim instead of being escaped or base64
+encoded.
+
+Both ends have to agree to use it; see L{conary.repository.xmlshims}.
+"""
+
+import struct
+import xmlrpclib
+
+CONTENT_TYPE = 'application/x-conary-rpc'
+
+MAGIC = 'CRPC'
+FORMAT_VERSION = 1
+
+KIND_CALL = 'C'
+KIND_RESPONSE = 'R'
+
+# Containers nested deeper than this are rejected when decoding
+MAX_DEPTH = 64
+
+_header = struct.Struct('!4sBc')
+_length = struct.Struct('!I')
+_int = struct.Struct('!q')
+_float = struct.Struct('!d')
+
+_INT_MIN = -(1 << 63)
+_INT_MAX = (1 << 63) - 1
+
+
+class DecodeError(ValueError):
+    pass
+
+
+def _dump_str(value, write):
+    write('s' + _length.pack(len(value)))
+    write(value)
+
+def _dump_unicode(value, write):
+    try:
+        value = value.encode('ascii')
+    except UnicodeError:
+        value = value.encode('utf-8')
+        write('u' + _length.pack(len(value)))
+    else:
+        write('s' + _length.pack(len(value)))
+    write(value)
+
+def _dump_binary(value, write):
+    _dump_str(value.data, write)
+
+def _dump_int(value, write):
+    if _INT_MIN <= value <= _INT_MAX:
+        write('i' + _int.pack(value))
+    else:
+        value = str(value)
+        write('L' + _length.pack(len(value)))
+        write(value)
+
+def _dump_bool(value, write):
+    if value:
+        write('T')
+    else:
+        write('F')
+
+def _dump_none(value, write):
+    write('N')
+
+def _dump_float(value, write):
+    write('f' + _float.pack(value))
+
+def _dump_seq(value, write):
+    write('l' + _length.pack(len(value)))
+    for item in value:
+        _dump(item, write)
+
+def _dump_dict(value, write):
+    write('d' + _length.pack(len(value)))
+    for key, item in value.iteritems():
+        if isinstance(key, unicode):
+            _dump_unicode(key, write)
+        elif isinstance(key, str):
+            _dump_str(key, write)
+        else:
+            raise TypeError("dictionary key must be string")
+        _dump(item, write)
+
+_dispatch = {
+        str: _dump_str,
+        unicode: _dump_unicode,
+        xmlrpclib.Binary: _dump_binary,
+        int: _dump_int,
+        long: _dump_int,
+        bool: _dump_bool,
+        type(None): _dump_none,
+        float: _dump_float,
+        list: _dump_seq,
+        tuple: _dump_seq,
+        dict: _dump_dict,
+        }
+
+def _dump(value, write):
+    try:
+        f = _dispatch[type(value)]
+    except KeyError:
+        # Subclasses of basic types, e.g. ProtectedString
+        for type_ in type(value).__mro__:
+            if type_ in _dispatch:
+                f = _dispatch[type_]
+                break
+        else:
+            raise TypeError("cannot marshal %s objects" % type(value))
+    f(value, write)
+
+
+def dumps(params, methodname=None):
+    """
+    Encode the C{params} tuple as a call to C{methodname}, or as a response
+    if C{methodname} is not given.
+    """
+    assert isinstance(params, tuple), "argument must be tuple"
+    chunks = []
+    write = chunks.append
+    if methodname:
+        if isinstance(methodname, unicode):
+            methodname = methodname.encode('utf-8')
+        write(_header.pack(MAGIC, FORMAT_VERSION, KIND_CALL) +
+                _length.pack(len(methodname)))
+        write(methodname)
+    else:
+        write(_header.pack(MAGIC, FORMAT_VERSION, KIND_RESPONSE))
+    _dump_seq(params, write)
+    return ''.join(chunks)
+
+
+def dump(params, methodname=None, methodresponse=None, stream=None):
+    """
+    Drop-in replacement for L{conary.lib.util.xmlrpcDump}. C{methodresponse}
+    is accepted for compatibility; anything without a C{methodname} is a
+    response.
+    """
+    data = dumps(params, methodname)
+    if stream is None:
+        return data
+    stream.write(data)
+    return ''
+
+
+class _Decoder(object):
+
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def _take(self, count):
+        start = self.pos
+        end = start + count
+        if end > len(self.data):
+            raise DecodeError("truncated RPC data")
+        self.pos = end
+        return self.data[start:end]
+
+    def _unpack(self, st):
+        start = self.pos
+        self.pos += st.size
+        if self.pos > len(self.data):
+            raise DecodeError("truncated RPC data")
+        return st.unpack_from(self.data, start)[0]
+
+    def _string(self):
+        return self._take(self._unpack(_length))
+
+    def value(self, depth=0):
+        tag = self._take(1)
+        if tag == 's':
+            return self._string()
+        elif tag == 'i':
+            return self._unpack(_int)
+        elif tag == 'l':
+            if depth >= MAX_DEPTH:
+                raise DecodeError("RPC data nested too deeply")
+            count = self._unpack(_length)
+            return [ self.value(depth + 1) for x in xrange(count) ]
+        elif tag == 'd':
+            if depth >= MAX_DEPTH:
+                raise DecodeError("RPC data nested too deeply")
+            count = self._unpack(_length)
+            result = {}
+            for x in xrange(count):
+                key = self.value(depth + 1)
+                if not isinstance(key, basestring):
+                    raise DecodeError("dictionary key must be string")
+                result[key] = self.value(depth + 1)
+            return result
+        elif tag == 'T':
+            return True
+        elif tag == 'F':
+            return False
+        elif tag == 'N':
+            return None
+        elif tag == 'u':
+            try:
+                return self._string().decode('utf-8')
+            except UnicodeError:
+                raise DecodeError("invalid UTF-8 string in RPC data")
+        elif tag == 'L':
+            try:
+                return long(self._string())
+            except ValueError:
+                raise DecodeError("invalid integer in RPC data")
+        elif tag == 'f':
+            return self._unpack(_float)
+        raise DecodeError("unknown type code %r in RPC data" % tag)
+
+
+def loads(data):
+    """
+    Decode a call or response. Returns a C{(params, methodname)} tuple like
+    L{conary.lib.util.xmlrpcLoad}; C{methodname} is None for responses.
+    """
+    decoder = _Decoder(data)
+    if len(data) < _header.size:
+        raise DecodeError("truncated RPC data")
+    magic, version, kind = _header.unpack_from(data)
+    decoder.pos = _header.size
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise DecodeError("not a binary RPC message")
+    if kind == KIND_CALL:
+        methodname = decoder._string()
+    elif kind == KIND_RESPONSE:
+        methodname = None
+    else:
+        raise DecodeError("unknown binary RPC message kind %r" % kind)
+    if decoder._take(1) != 'l':
+        raise DecodeError("RPC parameters must be a list")
+    params = tuple(decoder.value(1)
+            for x in xrange(decoder._unpack(_length)))
+    if decoder.pos != len(data):
+        raise DecodeError("trailing garbage after RPC data")
+    return params, methodname
+
+
+def load(stream):
+    """Like L{loads}, but reads the message from a file-like object."""
+    if hasattr(stream, 'read'):
+        chunks = []
+        while True:
+            data = stream.read(16384)
+            if not data:
+                break
+            chunks.append(data)
+        data = ''.join(chunks)
+    else:
+        data = stream
+    return loads(data)
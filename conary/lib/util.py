@@ -42,7 +42,7 @@ import weakref
 import xmlrpclib
 import zlib
 
-from conary.lib import fixedglob, log, api, urlparse
+from conary.lib import binrpc, fixedglob, log, api, urlparse
 from conary.lib import networking
 from conary.lib.ext import digest_uncompress
 from conary.lib.ext import file_utils
@@ -1145,6 +1145,25 @@ def lstat(path):
 
     return sb
 
+def syncfs(fd):
+    """
+    Write everything cached for the filesystem which C{fd} is on out to
+    disk, like syncfs(2). Returns False without doing anything if the C
+    library does not provide syncfs.
+    """
+    import ctypes
+    from conary.lib.ext import ctypes_utils
+    libc = ctypes_utils.get_libc()
+    try:
+        c_syncfs = libc.syncfs
+    except AttributeError:
+        return False
+    c_syncfs.argtypes = (ctypes.c_int,)
+    c_syncfs.restype = ctypes.c_int
+    if c_syncfs(fd):
+        ctypes_utils.throw_errno(libc)
+    return True
+
 class LineReader:
 
     def readlines(self):
@@ -1803,8 +1822,13 @@ class ServerProxy(object):
         self._encoding = encoding
         self._allow_none = allow_none
 
-    def _request(self, methodname, params):
+    def _request(self, methodname, params, binary=False):
         # Call a method on the remote server
+        if binary:
+            request = binrpc.dumps(params, methodname)
+            return self._transport.request(self._url, request,
+                    contentType=binrpc.CONTENT_TYPE)
+
         request = xmlrpcDump(params, methodname,
             encoding = self._encoding, allow_none=self._allow_none)
 
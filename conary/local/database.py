@@ -36,7 +36,8 @@ from conary.local import capsules as capsulesmod
 from conary.local import localrep, sqldb, schema, update
 from conary.local.errors import DatabasePathConflictError, FileInWayError
 from conary.local.journal import JobJournal, NoopJobJournal
-from conary.repository import changeset, datastore, errors, filecontents
+from conary.repository import changeset, datastore, errors, filecontainer
+from conary.repository import filecontents
 from conary.repository import repository, trovesource
 
 OldDatabaseSchema = schema.OldDatabaseSchema
@@ -47,7 +48,7 @@ class CommitChangeSetFlags(util.Flags):
                   'replaceModifiedFiles', 'justDatabase', 'localRollbacks',
                   'test', 'keepJournal', 'replaceModifiedConfigFiles',
                   'skipCapsuleOps', 'noScripts',
-                  'ignoreMissingFiles',
+                  'ignoreMissingFiles', 'compactRollbacks', 'syncUpdates',
                   ]
 
     def shouldRunScripts(self, tagScriptsFile):
@@ -58,14 +59,134 @@ class CommitChangeSetFlags(util.Flags):
         return True
 
 
+class RollbackContents(datastore.DataStore):
+
+    """
+    Compressed file contents for the compact rollbacks of a rollback stack,
+    stored once for each sha1 no matter how many rollbacks refer to them.
+    """
+
+    def addContents(self, fileObj, precompressed, opJournal):
+        """
+        Store the contents read from C{fileObj} unless they are already
+        there, and return their sha1.
+        """
+        fd, tmpName = tempfile.mkstemp(suffix = '.new', dir = self.top)
+        sha1 = self._writeFile(fileObj, [ fd ], precompressed,
+                               computeSha1 = True)
+        path = self.hashToPath(sha1)
+        if os.path.exists(path):
+            os.unlink(tmpName)
+        else:
+            self.makeDir(path)
+            opJournal.create(path)
+            os.rename(tmpName, path)
+
+        return sha1
+
+    def prune(self, inUse):
+        """
+        Remove all contents whose sha1 (as a hex string) is not in the
+        C{inUse} set.
+        """
+        keep = set(self.hashToPath(x) for x in inUse)
+        for dirName, subDirs, fileNames in os.walk(self.top, topdown = False):
+            for fileName in fileNames:
+                path = os.path.join(dirName, fileName)
+                if path not in keep:
+                    os.unlink(path)
+            if dirName != self.top and not os.listdir(dirName):
+                os.rmdir(dirName)
+
+    def __init__(self, topPath):
+        # these are copies of system files; keep them as private as the
+        # rollbacks themselves
+        if not os.path.isdir(topPath):
+            os.mkdir(topPath, 0700)
+        datastore.DataStore.__init__(self, topPath)
+
+
+class _ReferencingContainer(object):
+
+    """
+    Takes the place of the FileContainer a changeset is written to, and
+    moves its file contents into a L{RollbackContents} store. The
+    changeset gets references to the stored contents instead, in the
+    same form as the ones the repository uses for its contents store.
+    """
+
+    def addFile(self, name, contents, tagInfo, precompressed = False):
+        if tagInfo[2:] != changeset.ChangedFileTypes.file[4:]:
+            self.csf.addFile(name, contents, tagInfo,
+                             precompressed = precompressed)
+            return
+
+        sha1 = self.store.addContents(contents.get(), precompressed,
+                                      self.opJournal)
+        self.refs.add(sha1helper.sha1ToString(sha1))
+        entry = "%s %d" % (sha1helper.sha1ToString(sha1),
+                           os.stat(self.store.hashToPath(sha1)).st_size)
+        self.csf.addFile(name, filecontents.FromString(entry,
+                                                       compressed = True),
+                         tagInfo[:2] + changeset.ChangedFileTypes.refr[4:],
+                         precompressed = True)
+
+    def __init__(self, csf, store, opJournal):
+        self.csf = csf
+        self.store = store
+        self.opJournal = opJournal
+        self.refs = set()
+
+
+def _readRollbackReference(name, tag, rawSize, subfile, store):
+    # FileContainer.dumpIter() callback which puts the stored contents
+    # back in place of the references written by _ReferencingContainer
+    if tag[2:] != changeset.ChangedFileTypes.refr[4:]:
+        return tag, rawSize, subfile
+
+    sha1, size = subfile.read().split(' ')
+    return (tag[:2] + changeset.ChangedFileTypes.file[4:], int(size),
+            store.openRawFile(sha1))
+
+
 class Rollback:
 
     reposName = "%s/repos.%d"
     localName = "%s/local.%d"
+    # sha1s of the stored contents a compact rollback refers to
+    refsName = "%s/refs.%d"
 
-    def add(self, opJournal, repos, local, rollbackScripts):
+    def _contentsStore(self):
+        return RollbackContents(os.path.dirname(self.dir) + "/contents")
+
+    def _writeCompact(self, cs, path, opJournal):
+        """
+        Write C{cs} to C{path} with its file contents moved into the
+        contents store, and return the sha1s of the contents it refers to.
+        """
+        outFile = os.fdopen(os.open(path, os.O_RDWR | os.O_CREAT |
+                                          os.O_TRUNC, 0600), "w+")
+        csf = filecontainer.FileContainer(outFile, append = True,
+                version = filecontainer.FILE_CONTAINER_VERSION_OFFSET_IDX)
+        csf.addFile("CONARYCHANGESET", filecontents.FromString(cs.freeze()),
+                    "")
+        wrapper = _ReferencingContainer(csf, self._contentsStore(),
+                                        opJournal)
+        cs.writeAllContents(wrapper, withReferences = False)
+        csf.close()
+        outFile.close()
+        return wrapper.refs
+
+    def add(self, opJournal, repos, local, rollbackScripts, compact = False):
+        """
+        Add a repository and local changeset to the rollback. If C{compact}
+        is set, file contents are kept in a store shared by all of the
+        rollbacks instead of in the changesets, and are only put back
+        into them when the rollback is applied.
+        """
         reposName = self.reposName % (self.dir, self.count)
         localName = self.localName % (self.dir, self.count)
+        refsName = self.refsName % (self.dir, self.count)
         countName = "%s/count" % self.dir
 
         opJournal.create(reposName)
@@ -86,8 +207,21 @@ class Rollback:
 
             rbs.save(self.dir)
 
-        repos.writeToFile(reposName, mode = 0600)
-        local.writeToFile(localName, mode = 0600)
+        if compact:
+            opJournal.create(refsName)
+            refs = self._writeCompact(repos, reposName, opJournal)
+            refs.update(self._writeCompact(local, localName, opJournal))
+            f = util.AtomicFile(refsName, chmod = 0600)
+            f.write("".join("%s\n" % x for x in sorted(refs)))
+            f.commit()
+        else:
+            # rollbacks never leave this system, and are applied by reading
+            # the contents in job order rather than container order
+            version = filecontainer.FILE_CONTAINER_VERSION_OFFSET_IDX
+            repos.writeToFile(reposName, mode = 0600,
+                              versionOverride = version)
+            local.writeToFile(localName, mode = 0600,
+                              versionOverride = version)
 
         if self.count:
             self.count += 1
@@ -102,25 +236,52 @@ class Rollback:
         os.write(fd, "%d\n" % self.count)
         os.close(fd)
 
-    def _getChangeSets(self, item, repos = True, local = True):
+    def _readChangeSet(self, path, item, materialize):
+        if not (materialize and
+                os.path.exists(self.refsName % (self.dir, item))):
+            return changeset.ChangeSetFromFile(path)
+
+        # rebuild the full changeset from the contents store
+        store = self._contentsStore()
+        fd, tmpName = tempfile.mkstemp(prefix = '.full', dir = self.dir)
+        try:
+            outFile = os.fdopen(fd, "w")
+            inFile = util.ExtendedFile(path, "r", buffering = False)
+            csf = filecontainer.FileContainer(inFile)
+            for data in csf.dumpIter(_readRollbackReference, (store,)):
+                outFile.write(data)
+            inFile.close()
+            outFile.close()
+            # the changeset keeps the file open
+            return changeset.ChangeSetFromFile(tmpName)
+        finally:
+            os.unlink(tmpName)
+
+    def _getChangeSets(self, item, repos = True, local = True,
+                       materialize = False):
+        """
+        Return the repository and local changesets of item C{item}. The
+        file contents of compact rollbacks are only available if
+        C{materialize} is set.
+        """
         if repos:
-            reposCs = changeset.ChangeSetFromFile(
-                                        self.reposName % (self.dir, item))
+            reposCs = self._readChangeSet(self.reposName % (self.dir, item),
+                                          item, materialize)
         else:
             reposCs = False
 
         if local:
-            localCs = changeset.ChangeSetFromFile(
-                                        self.localName % (self.dir, item))
+            localCs = self._readChangeSet(self.localName % (self.dir, item),
+                                          item, materialize)
         else:
             localCs = False
 
         return (reposCs, localCs)
 
-    def getLast(self):
+    def getLast(self, materialize = False):
         if not self.count:
             return (None, None)
-        return self._getChangeSets(self.count - 1)
+        return self._getChangeSets(self.count - 1, materialize = materialize)
 
     def getLastPostRollbackScripts(self):
         if not self.count:
@@ -145,7 +306,8 @@ class Rollback:
     def isLocal(self):
         """
         Return True if every element of the rollback is locally available,
-        False otherwise.
+        False otherwise. Only the troves are looked at, so the file contents
+        of compact rollbacks are not read back from the contents store.
         """
         for i in range(self.count):
             (reposCs, localCs) = self._getChangeSets(i, repos = True,
@@ -161,13 +323,18 @@ class Rollback:
             return
         os.unlink(self.reposName % (self.dir, self.count - 1))
         os.unlink(self.localName % (self.dir, self.count - 1))
+        util.removeIfExists(self.refsName % (self.dir, self.count - 1))
         self.count -= 1
         open("%s/count" % self.dir, "w").write("%d\n" % self.count)
 
     @api.publicApi
-    def iterChangeSets(self):
+    def iterChangeSets(self, materialize = True):
         """
         Iterate through the list of rollback changesets
+        @param materialize: If False, the file contents of compact rollbacks
+        are left as references to the rollback contents store, which is
+        enough to look at the troves in them.
+        @type materialize: bool
         @raises errors.ConaryError: raised if there's an I/O Error opening a
         changeset file
         @raises repository.filecontainer.BadContainer: raised if the changeset
@@ -177,7 +344,7 @@ class Rollback:
         within a changeset
         """
         for i in range(self.count):
-            csList = self._getChangeSets(i)
+            csList = self._getChangeSets(i, materialize = materialize)
             yield csList[0]
             yield csList[1]
 
@@ -333,6 +500,28 @@ class RollbackStack:
             assert(0)
 
         self.writeStatus()
+        self._pruneContents()
+
+    def _pruneContents(self):
+        """
+        Remove the contents stored for compact rollbacks which are no
+        longer referred to by any rollback on the stack.
+        """
+        contentsDir = self.dir + "/contents"
+        if not os.path.isdir(contentsDir):
+            return
+
+        inUse = set()
+        for i in range(self.first, self.last + 1):
+            rbDir = "%s/%d" % (self.dir, i)
+            if not os.path.isdir(rbDir):
+                continue
+            for name in os.listdir(rbDir):
+                if name.startswith("refs."):
+                    inUse.update(x.strip() for x in
+                                 open(os.path.join(rbDir, name)))
+
+        RollbackContents(contentsDir).prune(inUse)
 
     def invalidate(self):
         """
@@ -1581,6 +1770,12 @@ class SqlDbRepository(trovesource.SearchableTroveSource,
         self._updateTransactionCounter = True
         return self.db.addTroveDone(troveInfo)
 
+    def addTroveSetStart(self):
+        self.db.addTroveSetStart()
+
+    def addTroveSetDone(self):
+        self.db.addTroveSetDone()
+
     def pinTroves(self, troveList, pin):
         troves = self.getTroves(troveList)
 
@@ -1607,7 +1802,7 @@ class SqlDbRepository(trovesource.SearchableTroveSource,
         # available, we need a different technique
         if self._updateTransactionCounter:
             self.db.incrementTransactionCounter()
-        self.db.commit()
+        self.db.commit(durable = self._updateTransactionCounter)
 
     def close(self):
         if self._db:
@@ -1636,7 +1831,8 @@ class SqlDbRepository(trovesource.SearchableTroveSource,
         return self.dbpath == self.MEMORY or os.access(self.dbpath, os.W_OK)
 
     def _initDb(self):
-        self._db = sqldb.Database(self.dbpath, timeout = self._lockTimeout)
+        self._db = sqldb.Database(self.dbpath, timeout = self._lockTimeout,
+                                  tuning = self._tuning)
         datastore.DataStoreRepository.__init__(self,
                            dataStore = localrep.SqlDataStore(self.db.db))
 
@@ -1651,7 +1847,7 @@ class SqlDbRepository(trovesource.SearchableTroveSource,
 
     db = property(_getDb)
 
-    def __init__(self, path, timeout=None):
+    def __init__(self, path, timeout=None, tuning=None):
         if path == self.MEMORY:
             self.dbpath = path
         else:
@@ -1663,6 +1859,8 @@ class SqlDbRepository(trovesource.SearchableTroveSource,
         self._updateTransactionCounter = False
         # Locking timeout
         self._lockTimeout = timeout
+        # sqlite settings for sqldb.Database
+        self._tuning = tuning
 
 class Database(SqlDbRepository):
 
@@ -1778,7 +1976,8 @@ class Database(SqlDbRepository):
                   reposRollback, localRollback, rollbackPhase, fsJob,
                   updateDatabase, callback, tagScript, dbCache,
                   autoPinList, flags, journal, directoryCandidates,
-                  storeRollback = True, capsuleChangeSet = None):
+                  storeRollback = True, capsuleChangeSet = None,
+                  restoreThreads = 1):
         if commitFlags.shouldRunScripts(tagScript):
             # run preremove scripts before updating the database, otherwise
             # the file lists which get sent to them are incorrect. skipping
@@ -1865,7 +2064,7 @@ class Database(SqlDbRepository):
                 if not uJob.getRestartedFlag() or not prflag:
                     rollbackScripts = list(uJob.iterJobPostRollbackScripts())
             rollback.add(opJournal, reposRollback, localRollback,
-                rollbackScripts)
+                rollbackScripts, compact = commitFlags.compactRollbacks)
             del rollback
 
         errList = fsJob.getErrorList()
@@ -1920,7 +2119,8 @@ class Database(SqlDbRepository):
         fsJob.apply(journal, opJournal = opJournal,
                     justDatabase = commitFlags.justDatabase,
                     noScripts = commitFlags.noScripts,
-                    capsuleChangeSet = capsuleChangeSet)
+                    capsuleChangeSet = capsuleChangeSet,
+                    restoreThreads = restoreThreads)
 
         if (updateDatabase and not localChanges):
             for (name, version, flavor) in fsJob.getOldTroveList():
@@ -1945,6 +2145,9 @@ class Database(SqlDbRepository):
             log.syslog("removed %s=%s[%s]", name, version,
                        deps.formatFlavor(flavor))
 
+        # the files have to be on disk before the database says they are
+        opJournal.sync()
+
         callback.committingTransaction()
         self._updateTransactionCounter = True
         origCounter = self.db.getTransactionCounter()
@@ -2096,7 +2299,8 @@ class Database(SqlDbRepository):
                         callback = None,
                         removeHints = {}, autoPinList = RegularExpressionList(),
                         deferredScripts = None, commitFlags = None,
-                        repair = False, capsuleChangeSet = None):
+                        repair = False, capsuleChangeSet = None,
+                        restoreThreads = 1):
         assert(not cs.isAbsolute())
 
         if callback is None:
@@ -2121,7 +2325,9 @@ class Database(SqlDbRepository):
         if repair:
             flags.ignoreMissingFiles = True
 
-        self.db.begin()
+        # updates are synced when they are committed, whatever
+        # dbSynchronous says
+        self.db.begin(durable = True)
 
         for trv in cs.iterNewTroveList():
             if trv.getName().endswith(":source"):
@@ -2222,7 +2428,8 @@ class Database(SqlDbRepository):
 
         if self.opJournalPath:
             opJournal = JobJournal(self.opJournalPath, self.root, create = True,
-                                   callback = callback)
+                                   callback = callback,
+                                   durable = commitFlags.syncUpdates)
         else:
             opJournal = NoopJobJournal()
 
@@ -2237,7 +2444,8 @@ class Database(SqlDbRepository):
                             rollbackPhase, fsJob, updateDatabase, callback,
                             tagScript, dbCache, autoPinList, flags, journal,
                             directoryCandidates, storeRollback=storeRollback,
-                            capsuleChangeSet = capsuleChangeSet)
+                            capsuleChangeSet = capsuleChangeSet,
+                            restoreThreads = restoreThreads)
             except Exception, e:
                 if not issubclass(e.__class__, ConaryError):
                     callback.error("a critical error occured -- reverting "
@@ -2663,7 +2871,7 @@ class Database(SqlDbRepository):
             # rid of them (otherwise we're left with redirects!). primaries
             # don't really matter here anyway, so no reason to worry about
             # them
-            (reposCs, localCs) = rb.getLast()
+            (reposCs, localCs) = rb.getLast(materialize = True)
             reposCs.setPrimaryTroveList([])
 
             lastFsJob = None
@@ -2761,7 +2969,7 @@ class Database(SqlDbRepository):
                     raise RollbackError(name, err)
 
                 updJob.close()
-                (reposCs, localCs) = rb.getLast()
+                (reposCs, localCs) = rb.getLast(materialize = True)
 
             # Run post-rollback scripts at the very end of the rollback, when
             # all other operations have been performed
@@ -2866,6 +3074,11 @@ class Database(SqlDbRepository):
         return self.db.iterFindPathReferences(path, justPresent = justPresent,
                                               withStream = withStream)
 
+    def findPathReferences(self, pathList, justPresent = False,
+                           withStream = False):
+        return self.db.findPathReferences(pathList, justPresent = justPresent,
+                                          withStream = withStream)
+
     def pathsOwned(self, pathList):
         return self.db.pathsOwned(pathList)
 
@@ -2984,7 +3197,8 @@ class Database(SqlDbRepository):
     def capsuleDb(self):
         return capsulesmod.MetaCapsuleDatabase(self)
 
-    def __init__(self, root, path, modelPath=None, timeout=None, modelFile=None):
+    def __init__(self, root, path, modelPath=None, timeout=None, modelFile=None,
+                 tuning=None):
         """
         Instantiate a database object
         @param root: the path to '/' for this operation
@@ -2995,6 +3209,9 @@ class Database(SqlDbRepository):
         @type modelPath: string
         @param modelFile: optional model file (will journal snapshot)
         @type modelFile: L{conary.conaryclient.systemmodel.SystemModelFile}
+        @param tuning: sqlite settings overriding the defaults in
+        L{sqldb.Database}
+        @type tuning: dict
         @return: None
         @raises ExistingJournalError: Raised when a journal file exists,
         signifying a failed operation.
@@ -3010,20 +3227,26 @@ class Database(SqlDbRepository):
         self.lockFileObj = None
 
         if path == self.MEMORY: # memory-only db
-            SqlDbRepository.__init__(self, path, timeout = timeout)
+            SqlDbRepository.__init__(self, path, timeout = timeout,
+                                     tuning = tuning)
             # use :memory: as a marker not to bother with locking
             self.lockFile = path
             self.opJournalPath = None
+            self.hashCachePath = None
+            self.downloadCheckpointPath = None
             self.modelFile = None
             self.rollbackStack = None
         else:
             conarydbPath = util.joinPaths(root, path)
-            SqlDbRepository.__init__(self, conarydbPath, timeout = timeout)
+            SqlDbRepository.__init__(self, conarydbPath, timeout = timeout,
+                                     tuning = tuning)
             self.opJournalPath = conarydbPath + '/journal'
             top = util.joinPaths(root, path)
             self.modelFile = modelFile
 
             self.lockFile = top + "/syslock"
+            self.hashCachePath = top + "/hashcache"
+            self.downloadCheckpointPath = top + "/downloads"
             self.rollbackCache = top + "/rollbacks"
             self.rollbackStatus = self.rollbackCache + "/status"
             try:
@@ -268,6 +268,31 @@ class DependencyWorkTables:
         # we've removed. We insert those dependencies into our temporary
         # tables (which define everything which needs to be checked) with
         # a positive depNum which matches the depNum from the Requires table.
+        #
+        # Only requirements which could change are checked: those of troves
+        # which are being removed themselves (they order the removals), and
+        # those which use something a removed trove provided but which the
+        # new trove in the same job (whose provides are in TmpProvides under
+        # -nodeId) does not. Everything else stays satisfied by the new
+        # trove, so updating a library which most of the system requires
+        # does not mean checking most of the system again.
+        affected = """
+            Requires.depNum IN (
+                SELECT Requires.depNum
+                FROM RemovedTroveIds
+                JOIN Provides ON RemovedTroveIds.troveId = Provides.instanceId
+                LEFT OUTER JOIN TmpProvides ON
+                    TmpProvides.instanceId = -RemovedTroveIds.nodeId AND
+                    TmpProvides.depId = Provides.depId
+                JOIN Requires ON Provides.depId = Requires.depId
+                WHERE RemovedTroveIds.rowId > ? AND
+                      TmpProvides.instanceId IS NULL
+              UNION
+                SELECT Requires.depNum
+                FROM RemovedTroveIds
+                JOIN Requires ON RemovedTroveIds.troveId = Requires.instanceId
+            )"""
+
         self.cu.execute("""
         INSERT INTO TmpRequires (instanceId, depId, depNum, depCount)
         SELECT DISTINCT
@@ -276,8 +301,8 @@ class DependencyWorkTables:
         FROM RemovedTroveIds
         JOIN Provides ON RemovedTroveIds.troveId = Provides.instanceId
         JOIN Requires ON Provides.depId = Requires.depId
-        WHERE RemovedTroveIds.rowId > ?
-        """, max)
+        WHERE RemovedTroveIds.rowId > ? AND %s
+        """ % affected, max, max)
 
         self.cu.execute("""
         INSERT INTO DepCheck
@@ -290,7 +315,9 @@ class DependencyWorkTables:
         JOIN Requires ON Provides.depId = Requires.depId
         JOIN Dependencies ON Dependencies.depId = Requires.depId
         WHERE NOT Dependencies.class IN (%s) AND RemovedTroveIds.rowId > ?
-        """% ",".join('"%d"' % x.tag for x in self.ignoreDepClasses), max)
+              AND %s
+        """% (",".join('"%d"' % x.tag for x in self.ignoreDepClasses),
+              affected), max, max)
 
     def removeTrove(self, (name, version, flavor), nodeId):
         if flavor is None or flavor.isEmpty():
@@ -301,6 +328,83 @@ class DependencyWorkTables:
         self.cu.execute("INSERT INTO RemovedTroves VALUES(?, ?, ?, ?)",
                         (name, version.asString(), flavor, nodeId))
 
+class DependencySnapshot:
+    """
+    In-memory copy of what the troves in the database provide, as of
+    transactionCounter. It maps each (class, name, flag) row of the
+    Dependencies table to the set of instanceIds which provide it, and
+    is kept up to date by L{DependencyTables} as troves are added and
+    erased.
+    """
+
+    def _add(self, rows):
+        for (instanceId, classId, name, flag) in rows:
+            key = (classId, name, flag)
+            self.providers.setdefault(key, set()).add(instanceId)
+            self.provides.setdefault(instanceId, []).append(key)
+
+    def getProviders(self, classId, dep):
+        """
+        Returns the set of instanceIds which provide dep (which must
+        be of class classId).
+        """
+        names = dep.getName()
+        if len(names) != 1:
+            return set()
+
+        name = names[0]
+        result = self.providers.get((classId, name, NO_FLAG_MAGIC))
+        if not result:
+            return set()
+
+        for flag, sense in dep.getFlags()[0]:
+            result = result & self.providers.get((classId, name, flag),
+                                                 set())
+            if not result:
+                break
+
+        return result
+
+    @staticmethod
+    def readChanges(cu, instanceIds):
+        """
+        Returns the provides rows of the instanceIds given, to be passed
+        to L{update}.
+        """
+        if not instanceIds:
+            return []
+
+        cu.execute("""
+        SELECT Provides.instanceId, class, name, flag
+        FROM Provides JOIN Dependencies ON
+            Provides.depId = Dependencies.depId
+        WHERE Provides.instanceId IN (%s)
+        """ % ",".join("%d" % x for x in instanceIds))
+        return cu.fetchall()
+
+    def update(self, instanceIds, rows, transactionCounter):
+        for instanceId in instanceIds:
+            for key in self.provides.pop(instanceId, []):
+                providers = self.providers[key]
+                providers.discard(instanceId)
+                if not providers:
+                    del self.providers[key]
+
+        self._add(rows)
+        self.transactionCounter = transactionCounter
+
+    def __init__(self, cu, transactionCounter):
+        self.transactionCounter = transactionCounter
+        self.providers = {}
+        self.provides = {}
+
+        cu.execute("""
+        SELECT Provides.instanceId, class, name, flag
+        FROM Provides JOIN Dependencies ON
+            Provides.depId = Dependencies.depId
+        """)
+        self._add(cu)
+
 class DependencyChecker:
 
     # We build up a graph to let us split the changeset into pieces.
@@ -1062,6 +1166,12 @@ class DependencyChecker:
                 newNodeId = self._addJob(job)
                 newRequires = self._findNewDependencies(newNodeId, requires,
                                                         self.requiresToNodeId)
+                if self.snapshot is not None:
+                    newRequires = self._deferInstalledRequires(newNodeId,
+                                                               newRequires)
+                    for depClass, oneDep in provides.iterDeps():
+                        self.newProvides.add((depClass.tag,
+                                              oneDep.getName()[0]))
 
                 self.workTables._populateTmpTable(depList = self.depList,
                                                   troveNum = -newNodeId,
@@ -1082,6 +1192,53 @@ class DependencyChecker:
         self.workTables.merge()
         self.workTables.mergeRemoves()
 
+        if self.deferredRequires:
+            self._mergeDeferredRequires()
+
+    def _deferInstalledRequires(self, nodeId, depSet):
+        # Requirements which something installed provides are resolved by
+        # it unless the job removes it, so they are left out of the work
+        # tables until then. This keeps the SQL we run proportional to the
+        # job rather than to everything it requires from the system.
+        remaining = deps.DependencySet()
+        for depClass, oneDep in depSet.iterDeps():
+            providers = self.snapshot.getProviders(depClass.tag, oneDep)
+            if providers:
+                self.deferredRequires.append((nodeId, depClass, oneDep,
+                                              providers))
+            else:
+                remaining.addDep(depClass, oneDep)
+
+        return remaining
+
+    def _mergeDeferredRequires(self):
+        # deferred requirements are checked after all if everything which
+        # provided them is being removed, or if something in the job
+        # provides them as well (which orders the job)
+        self.cu.execute("SELECT troveId FROM RemovedTroveIds")
+        removedIds = set(x[0] for x in self.cu)
+
+        deferred = []
+        for item in self.deferredRequires:
+            (nodeId, depClass, oneDep, providers) = item
+            if (providers - removedIds and
+                    (depClass.tag, oneDep.getName()[0])
+                                            not in self.newProvides):
+                deferred.append(item)
+                continue
+
+            depSet = deps.DependencySet()
+            depSet.addDep(depClass, oneDep)
+            self.workTables._populateTmpTable(depList = self.depList,
+                                              troveNum = -nodeId,
+                                              requires = depSet,
+                                              provides = None,
+                                              multiplier = -1)
+
+        if len(deferred) != len(self.deferredRequires):
+            self.deferredRequires = deferred
+            self.workTables.merge()
+
     def _check(self, linkedJobs = None,
               criticalJobs = None, finalJobs = None, createGraph = False):
         # we can't create the graph if we're not finding the ordering
@@ -1186,7 +1343,7 @@ class DependencyChecker:
         self.done()
 
     def __init__(self, db, troveSource, findOrdering = True,
-                 ignoreDepClasses = set()):
+                 ignoreDepClasses = set(), snapshot = None):
         self.g = graph.DirectedGraph()
         # adding None to the front prevents us from using nodeId's of 0, which
         # would be a problem since we use negative nodeIds in the SQL
@@ -1205,6 +1362,12 @@ class DependencyChecker:
         self.providesToNodeId = {}
         self.requiresToNodeId = {}
         self.ignoreDepClasses = ignoreDepClasses
+        # DependencySnapshot of the installed system; requirements it
+        # resolves wait in deferredRequires, and newProvides holds the
+        # (class, name) of everything the job provides
+        self.snapshot = snapshot
+        self.deferredRequires = []
+        self.newProvides = set()
 
         self.workTables = DependencyWorkTables(self.db, self.cu,
                removeTables = True, ignoreDepClasses = self.ignoreDepClasses)
@@ -1269,6 +1432,7 @@ class DependencyTables:
 
     def add(self, cu, trove, troveId):
         self._add(cu, troveId, trove.getProvides(), trove.getRequires())
+        self.markChanged(troveId)
 
     def _add(self, cu, troveId, provides, requires):
         workTables = DependencyWorkTables(self.db, cu)
@@ -1277,6 +1441,7 @@ class DependencyTables:
         workTables.merge(intoDatabase = True)
 
     def delete(self, cu, troveId):
+        self.markChanged(troveId)
         schema.resetTable(cu, "suspectDepsOrig")
         schema.resetTable(cu, "suspectDeps")
 
@@ -1428,8 +1593,75 @@ class DependencyTables:
         self.db.rollback()
         return result
 
+    def getSnapshot(self, transactionCounter):
+        """
+        Returns a L{DependencySnapshot} of the database as of
+        transactionCounter, which must be the current transaction counter.
+        The snapshot is only read again if the database was changed by
+        something other than this object.
+        """
+        if (self.snapshot is None or
+                self.snapshot.transactionCounter != transactionCounter):
+            self.snapshot = DependencySnapshot(self.db.cursor(),
+                                               transactionCounter)
+            self.snapshotChanges = set()
+
+        return self.snapshot
+
+    def markChanged(self, troveId):
+        """
+        Notes that the dependencies of troveId changed in the current
+        transaction.
+        """
+        if self.snapshot is not None:
+            self.snapshotChanges.add(troveId)
+
+    def prepareSnapshot(self, cu, transactionCounter, counterIncremented):
+        """
+        Reads the changes the current transaction made to the snapshot.
+        transactionCounter is the counter this transaction commits, which
+        is one more than the snapshot's if counterIncremented is set. If
+        it is not, the database changed underneath the snapshot and it
+        is thrown away.
+        """
+        if self.snapshot is None or not self.snapshotChanges:
+            return
+
+        expected = self.snapshot.transactionCounter
+        if counterIncremented:
+            expected += 1
+
+        if transactionCounter != expected:
+            self.snapshot = None
+            self.snapshotChanges = set()
+            return
+
+        self.snapshotUpdate = (self.snapshotChanges,
+                DependencySnapshot.readChanges(cu, self.snapshotChanges),
+                transactionCounter)
+
+    def commitSnapshot(self):
+        """
+        Applies the changes read by L{prepareSnapshot} once the
+        transaction has been committed.
+        """
+        if self.snapshotUpdate is not None:
+            self.snapshot.update(*self.snapshotUpdate)
+            self.snapshotUpdate = None
+
+        self.snapshotChanges = set()
+
+    def rollbackSnapshot(self):
+        self.snapshotChanges = set()
+        self.snapshotUpdate = None
+
     def __init__(self, db):
         self.db = db
+        # DependencySnapshot, the troveIds changed by the current
+        # transaction, and what prepareSnapshot() read for them
+        self.snapshot = None
+        self.snapshotChanges = set()
+        self.snapshotUpdate = None
 
 class DependencyDatabase(DependencyTables):
     """ Creates a thin database (either on disk or in memory)
@@ -0,0 +1,149 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+"""
+Checksums of installed files, computed in parallel and remembered between
+runs of "conary verify".
+
+An entry is only used while the file's device, inode, size, mtime and ctime
+are the ones it was computed for. Writing to a file or replacing it changes
+at least one of those.
+"""
+
+import errno
+import marshal
+import Queue
+import threading
+
+from conary import files
+from conary.lib import log, util
+
+CACHE_VERSION = 1
+
+
+def _statKey(statBuf):
+    return (statBuf.st_dev, statBuf.st_ino, statBuf.st_size,
+            statBuf.st_mtime, statBuf.st_ctime)
+
+
+class HashCache(object):
+    """
+    Maps paths to the sha1 and size of their contents for
+    L{files.FileFromFilesystem}.
+
+    Entries loaded from C{path} are only used if C{trusted} is set;
+    checksums computed during this run always are. L{save} writes
+    everything back to C{path}.
+    """
+
+    def __init__(self, path = None, trusted = True):
+        self.path = path
+        self.trusted = trusted
+        self._lock = threading.Lock()
+        self._saved = {}
+        self._fresh = {}
+        if path:
+            self._load()
+
+    def _load(self):
+        try:
+            f = open(self.path, 'rb')
+        except IOError, e:
+            if e.errno not in (errno.ENOENT, errno.EACCES):
+                raise
+            return
+        try:
+            try:
+                version, entries = marshal.load(f)
+            except (EOFError, ValueError, TypeError):
+                log.warning("ignoring corrupt checksum cache %s", self.path)
+                return
+        finally:
+            f.close()
+        if version == CACHE_VERSION:
+            self._saved = entries
+
+    def get(self, path, statBuf):
+        """
+        Return the C{(sha1, size)} stored for C{path}, or None if there is
+        none which matches C{statBuf}.
+        """
+        key = _statKey(statBuf)
+        entry = self._fresh.get(path)
+        if entry is None and self.trusted:
+            entry = self._saved.get(path)
+        if entry is None or entry[0] != key:
+            return None
+        return entry[1], entry[2]
+
+    def set(self, path, statBuf, sha1, size):
+        self._lock.acquire()
+        try:
+            self._fresh[path] = (_statKey(statBuf), sha1, size)
+        finally:
+            self._lock.release()
+
+    def prefetch(self, pathList, threads):
+        """
+        Compute the checksums of the regular files in C{pathList}, a list
+        of C{(path, statBuf)} tuples, using C{threads} worker threads.
+        Files which cannot be read are skipped.
+        """
+        pathList = [ x for x in pathList if self.get(*x) is None ]
+        if not pathList:
+            return
+
+        queue = Queue.Queue()
+        for item in pathList:
+            queue.put(item)
+
+        def _work():
+            while True:
+                try:
+                    path, statBuf = queue.get_nowait()
+                except Queue.Empty:
+                    return
+                try:
+                    sha1, size = files.contentsFromFilesystem(path, statBuf)
+                except Exception:
+                    # the caller runs into it again, and reports it
+                    continue
+                self.set(path, statBuf, sha1, size)
+
+        workers = [ threading.Thread(target = _work)
+                    for x in range(min(threads, len(pathList))) ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+    def save(self):
+        """
+        Write the cache back to where it was loaded from. Failing to do so
+        (for instance because verify is not run as root) is not an error.
+        """
+        if not self.path or not self._fresh:
+            return
+        entries = dict(self._saved)
+        entries.update(self._fresh)
+        try:
+            f = util.AtomicFile(self.path, chmod = 0600)
+            f.write(marshal.dumps((CACHE_VERSION, entries)))
+            f.commit()
+        except (IOError, OSError), e:
+            log.debug("unable to save checksum cache %s: %s", self.path,
+                      e.strerror)
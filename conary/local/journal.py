@@ -22,6 +22,7 @@ import tempfile
 
 from conary import callbacks
 from conary.files import InodeStream
+from conary.lib import util
 from conary.streams import *
 
 JOURNAL_VERSION = 1
@@ -64,6 +65,8 @@ class JournalEntry(StreamSet):
 
 class NoopJobJournal:
 
+    durable = False
+
     def __init__(self):
         pass
 
@@ -82,6 +85,12 @@ class NoopJobJournal:
     def backup(self, target, skipDirs = False):
         pass
 
+    def barrier(self):
+        pass
+
+    def sync(self):
+        pass
+
     def commit(self):
         pass
 
@@ -94,12 +103,19 @@ class NoopJobJournal:
 class JobJournal(NoopJobJournal):
 
     # this is designed to be readable back to front, not front to back
+    #
+    # A durable journal is a write ahead log which survives crashes as well
+    # as errors. Callers use barrier() after journaling changes and before
+    # making them, and sync() once the changes are complete; both sync
+    # everything pending in one go, so a whole group of operations costs a
+    # single round of syncs.
 
     @staticmethod
     def _normpath(path):
         return os.path.normpath(path).replace('//', '/')
 
-    def __init__(self, path, root = '/', create = False, callback = None):
+    def __init__(self, path, root = '/', create = False, callback = None,
+                 durable = False):
         NoopJobJournal.__init__(self)
         # normpath leaves a leading // (probably for windows?)
         self.path = path
@@ -118,11 +134,25 @@ class JobJournal(NoopJobJournal):
         else:
             self.callback = callback
 
+        self.durable = durable
+        # what has changed since the last barrier() or sync(): whether
+        # there are entries revert() needs to put things back (backups and
+        # renames), directories and backups of files written by this job
+        # which have to be synced along with them, other directories whose
+        # entries changed, and files which were written or moved
+        self._needBarrier = False
+        self._barrierDirs = set()
+        self._barrierFiles = set()
+        self._dirtyDirs = set()
+        self._dirtyFiles = set()
+
         if create:
             self.immutable = False
             self.fd = os.open(path,
                               os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0600)
             os.write(self.fd, struct.pack("!H", JOURNAL_VERSION))
+            if durable:
+                self._barrierDirs.add(os.path.dirname(path))
         else:
             self.immutable = True
             self.fd = os.open(path, os.O_RDONLY)
@@ -163,18 +193,31 @@ class JobJournal(NoopJobJournal):
         origName = self._normpath(origName)
         newName = self._normpath(newName)
         self._record(JOURNAL_ENTRY_RENAME, origName, newName)
+        if self.durable:
+            self._needBarrier = True
+            self._dirtyDirs.add(os.path.dirname(origName))
+            self._dirtyDirs.add(os.path.dirname(newName))
+            self._dirtyFiles.discard(origName)
+            self._dirtyFiles.add(newName)
 
     def create(self, name):
         name = self._normpath(name)
         self._record(JOURNAL_ENTRY_CREATE, '', name)
+        if self.durable:
+            self._dirtyDirs.add(os.path.dirname(name))
+            self._dirtyFiles.add(name)
 
     def mkdir(self, name):
         name = self._normpath(name)
         self._record(JOURNAL_ENTRY_MKDIR, '', name)
+        if self.durable:
+            self._dirtyDirs.add(os.path.dirname(name))
 
     def remove(self, name):
         name = self._normpath(name)
         self._record(JOURNAL_ENTRY_REMOVE, '', name)
+        if self.durable:
+            self._dirtyDirs.add(os.path.dirname(name))
 
     def tryCleanupDir(self, name):
         # on *commit* try to remove this directory
@@ -198,9 +241,96 @@ class JobJournal(NoopJobJournal):
             if not stat.S_ISDIR(sb.st_mode):
                 self._backup(target, tmpname, sb)
                 os.link(target, tmpname)
+                if self.durable:
+                    self._needBarrier = True
+                    self._barrierDirs.add(path)
+                    if target in self._dirtyFiles:
+                        # written earlier in this job, so its contents may
+                        # not be on disk yet; the backup is only good if
+                        # they are
+                        self._barrierFiles.add(tmpname)
             elif not skipDirs:
                 self._backdir(target, sb)
 
+    def _syncPath(self, path, dataOnly = False):
+        # anything other than files and directories (symlinks, devices,
+        # fifos) lives entirely in the directory entry
+        sb = util.lstat(path)
+        if sb is None or not (stat.S_ISREG(sb.st_mode) or
+                              stat.S_ISDIR(sb.st_mode)):
+            return
+
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            if dataOnly:
+                os.fdatasync(fd)
+            else:
+                os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _syncFilesystems(self, dirs):
+        # one syncfs() for each filesystem the directories are on takes
+        # care of everything on them at once
+        byDevice = {}
+        for path in dirs:
+            sb = util.lstat(path)
+            if sb is not None:
+                byDevice.setdefault(sb.st_dev, path)
+
+        for path in byDevice.itervalues():
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                if not util.syncfs(fd):
+                    return False
+            finally:
+                os.close(fd)
+
+        return True
+
+    def barrier(self):
+        """
+        Make the journal entries written so far durable, along with the
+        backups they point to, before the changes they describe are made.
+        Does nothing unless the journal is durable and has backups or
+        renames which are not durable yet.
+        """
+        if not self.durable or not self._needBarrier:
+            return
+
+        for path in self._barrierFiles:
+            self._syncPath(path, dataOnly = True)
+        for path in self._barrierDirs:
+            self._syncPath(path)
+        os.fdatasync(self.fd)
+
+        self._barrierFiles.clear()
+        self._barrierDirs.clear()
+        self._needBarrier = False
+
+    def sync(self):
+        """
+        Make everything journaled so far, including the contents of the
+        files which were created or moved, durable. Does nothing unless the journal
+        is durable.
+        """
+        if not self.durable:
+            return
+
+        dirs = self._dirtyDirs | self._barrierDirs
+        if not self._syncFilesystems(dirs):
+            for path in self._dirtyFiles | self._barrierFiles:
+                self._syncPath(path, dataOnly = True)
+            for path in dirs:
+                self._syncPath(path)
+        os.fdatasync(self.fd)
+
+        self._dirtyFiles.clear()
+        self._dirtyDirs.clear()
+        self._barrierFiles.clear()
+        self._barrierDirs.clear()
+        self._needBarrier = False
+
     def commit(self):
         for kind, entry in self:
             if kind == JOURNAL_ENTRY_BACKUP:
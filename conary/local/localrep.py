@@ -132,8 +132,12 @@ class LocalRepositoryChangeSetJob(repository.ChangeSetJob):
         self.trovesAdded = []
         self.autoPinList = autoPinList
 
+        # files, dependencies and trove info of the new troves are merged
+        # into the database together once they have all been added
+        self.repos.addTroveSetStart()
         repository.ChangeSetJob.__init__(self, repos, cs, callback = callback,
                                          allowIncomplete=allowIncomplete)
+        self.repos.addTroveSetDone()
 
         for name, version, flavor in self.oldTroveList():
             self.repos.eraseTrove(name, version, flavor)
@@ -358,6 +358,23 @@ class RpmCapsuleOperation(SingleCapsuleOperation):
                 [ (x[0], y) for x, y in
                     itertools.izip(l, fileObjs) ] )
 
+        # only the owners of paths which are in the way matter, so find
+        # those first and look their owners up with a single query
+        pathsInWay = {}
+        for pathId, path, fileId, version in trv.iterFileList():
+            if os.path.dirname(path) in self.netSharedPath:
+                continue
+            s = util.lstat(util.joinPaths(self.root, path))
+            if s:
+                pathsInWay[path] = s
+
+        if pathsInWay:
+            pathOwners = self.db.findPathReferences(pathsInWay.keys(),
+                                                    justPresent = True,
+                                                    withStream = True)
+        else:
+            pathOwners = {}
+
         for fileInfo in trv.iterFileList():
             pathId, path, fileId, version = fileInfo
 
@@ -400,7 +417,7 @@ class RpmCapsuleOperation(SingleCapsuleOperation):
                 self.preservePath(path, unlink=True)
                 continue
 
-            s = util.lstat(absolutePath)
+            s = pathsInWay.get(path)
             if not s:
                 # there is nothing in the way, so there is nothing which
                 # concerns us here. Track the file for later.
@@ -409,9 +426,7 @@ class RpmCapsuleOperation(SingleCapsuleOperation):
 
             action = ACTION_CONFLICT
 
-            existingOwners = list(
-                self.db.iterFindPathReferences(path, justPresent = True,
-                                               withStream = True))
+            existingOwners = list(pathOwners.get(path, []))
 
             if existingOwners:
                 # Don't complain about files owned by the previous version
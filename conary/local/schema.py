@@ -17,7 +17,7 @@
 
 import sys
 import itertools
-from conary import trove, deps, errors, files, streams
+from conary import trove, deps, errors, files, sqlite3, streams
 from conary.dbstore import idtable, migration, sqlerrors
 
 # Stuff related to SQL schema maintenance and migration
@@ -58,6 +58,25 @@ def _createFlavors(db):
     db.commit()
     db.loadSchema()
 
+def _hasPartialIndexes():
+    return sqlite3._sqlite.sqlite_version_info() >= (3, 8, 0)
+
+def _createPresentPathIdx(cu):
+    # path -> (instanceId, pathId) for the files which are on disk. It is
+    # partial, so sqlite keeps it up to date whenever isPresent changes and
+    # path conflict checks only look at the rows for the paths being added.
+    if _hasPartialIndexes():
+        cu.execute("""
+        CREATE INDEX DBTroveFilesPresentPathIdx ON
+            DBTroveFiles(path, instanceId, pathId, fileId)
+            WHERE isPresent = 1""")
+    else:
+        # sqlite before 3.8.0 can't create (or even read) partial indexes;
+        # this one serves the same lookups, only less compactly
+        cu.execute("""
+        CREATE INDEX DBTroveFilesPresentPathIdx ON
+            DBTroveFiles(path, isPresent, instanceId, pathId)""")
+
 def createDBTroveFiles(db):
     if "DBTroveFiles" in db.tables:
         return
@@ -77,6 +96,7 @@ def createDBTroveFiles(db):
     cu.execute("CREATE INDEX DBTroveFilesIdx ON DBTroveFiles(fileId)")
     cu.execute("CREATE INDEX DBTroveFilesInstanceIdx ON DBTroveFiles(instanceId)")
     cu.execute("CREATE INDEX DBTroveFilesPathIdx ON DBTroveFiles(path)")
+    _createPresentPathIdx(cu)
 
     idtable.createIdTable(db, "Tags", "tagId", "tag")
 
@@ -889,14 +909,18 @@ def optSchemaUpdate(db):
                 # go - read-only
                 cu.execute('BEGIN IMMEDIATE')
                 cu.execute('delete from sqlite_stat1')
+                db.commit()
             except sqlerrors.ReadOnlyDatabase:
                 # the database will go slowly, but it should work.
                 pass
 
     # Create DatabaseAttributes (if it doesn't exist yet)
     createDatabaseAttributes(db)
-    #do we have the index we need?
-    if "TroveInfoInstTypeIdx" in db.tables["TroveInfo"]:
+    #do we have the indexes we need?
+    needInstType = "TroveInfoInstTypeIdx" not in db.tables["TroveInfo"]
+    needPresentPath = ("DBTroveFilesPresentPathIdx" not in
+                            db.tables["DBTroveFiles"])
+    if not (needInstType or needPresentPath):
         return
     # we need to have write access
     try:
@@ -906,9 +930,38 @@ def optSchemaUpdate(db):
         return
     else:
         db.rollback()
-    # we have write access and we need the index created
-    db.createIndex("TroveInfo", "TroveInfoInstTypeIdx",
-                   "infoType,instanceId")
+    # we have write access and we need the indexes created
+    if needInstType:
+        db.createIndex("TroveInfo", "TroveInfoInstTypeIdx",
+                       "infoType,instanceId")
+    if needPresentPath:
+        _createPresentPathIdx(cu)
+        db.commit()
+        db.loadSchema()
+
+def setJournalMode(db, mode):
+    """
+    Switch the database to journal mode C{mode} and return the mode it is
+    in afterwards. The mode is stored in the database file, but changing it
+    needs write access and no other connections to the database, so this
+    is tried again each time the database is opened for writing. Databases
+    in memory keep their own journal mode.
+    """
+    cu = db.cursor()
+    cu.execute("PRAGMA journal_mode", start_transaction = False)
+    current = cu.next()[0]
+    if current in (mode, 'memory'):
+        return current
+
+    try:
+        cu.execute("PRAGMA journal_mode = %s" % mode,
+                   start_transaction = False)
+        current = cu.next()[0]
+    except (sqlerrors.CursorError, sqlerrors.DatabaseLocked,
+            sqlerrors.ReadOnlyDatabase):
+        # someone else has it open; leave it for next time
+        pass
+    return current
 
 def checkVersion(db):
     global VERSION
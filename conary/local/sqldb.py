@@ -15,7 +15,9 @@
 #
 
 
+import errno
 import itertools
+import os
 import time
 
 from conary import dbstore
@@ -375,9 +377,21 @@ class DBFlavorMap(idtable.IdMapping):
 
 class Database:
     timeout = 30000
-    def __init__(self, path, timeout = None):
+    # sqlite settings; the constructor takes a dict overriding them. See
+    # the db* options of ConaryConfiguration. The journal mode is stored in
+    # the database, and is left alone unless one is given.
+    journalMode = None
+    synchronous = 'normal'
+    cacheSize = 32000000
+    mmapSize = 256000000
+
+    def __init__(self, path, timeout = None, tuning = None):
         if timeout is not None:
             self.timeout = timeout
+        if tuning:
+            for key, value in tuning.iteritems():
+                assert(hasattr(Database, key))
+                setattr(self, key, value)
         self.db = None
         try:
             self.db = dbstore.connect(path, driver = "sqlite",
@@ -396,6 +410,7 @@ class Database:
         else:
             readOnly = False
             self.db.rollback()
+        self._tune(readOnly)
         if readOnly and self.schemaVersion < schema.VERSION:
             raise OldDatabaseSchema(
                 "The Conary database on this system is too old.  It will be \n"
@@ -428,22 +443,88 @@ class Database:
         self.needsCleanup = False
         self.addVersionCache = {}
         self.flavorsNeeded = {}
+        # set once incrementTransactionCounter() has been called in the
+        # current transaction
+        self.counterIncremented = False
+        # set between addTroveSetStart() and addTroveSetDone()
+        self.depLoader = None
+        self.troveInfoRows = None
+        # the synchronous level the current transaction was started at, if
+        # it differs from self.synchronous
+        self.txnSynchronous = None
+
+    def _tune(self, readOnly):
+        cu = self.db.cursor()
+        # a negative cache size is in KiB instead of pages
+        cu.execute("PRAGMA cache_size = %d" % -(self.cacheSize // 1024),
+                   start_transaction = False)
+        cu.execute("PRAGMA mmap_size = %d" % self.mmapSize,
+                   start_transaction = False)
+        if readOnly or not self.journalMode:
+            cu.execute("PRAGMA journal_mode", start_transaction = False)
+            self.journalMode = cu.next()[0]
+        else:
+            self.journalMode = schema.setJournalMode(self.db,
+                                                     self.journalMode)
+
+        # Outside of WAL mode, anything less than FULL risks corrupting
+        # the database if the system crashes
+        if self.journalMode != 'wal':
+            self.synchronous = 'full'
+        self._setSynchronous(self.synchronous)
+
+    def _setSynchronous(self, level):
+        # sqlite refuses to change this inside of a transaction
+        cu = self.db.cursor()
+        cu.execute("PRAGMA synchronous = %s" % level,
+                   start_transaction = False)
+
+    def _restoreSynchronous(self):
+        if self.txnSynchronous:
+            self._setSynchronous(self.synchronous)
+            self.txnSynchronous = None
+
+    def _syncLog(self):
+        # with synchronous=normal, WAL mode writes commits to the log
+        # without syncing it; syncing it by hand makes them durable. A
+        # checkpoint would do the same, but waits for readers to finish
+        try:
+            fd = os.open(self.db.database + '-wal', os.O_RDONLY)
+        except OSError, e:
+            if e.errno != errno.ENOENT:
+                raise
+            return
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
 
     def __del__(self):
         if self.db and not self.db.closed:
             self.db.close()
         del self.db
 
-    def begin(self):
+    def begin(self, durable = False):
         """
         Force the database to begin a transaction; this locks the database
-        so no one can touch it until a commit() or rollback().
+        so no one can touch it until a commit() or rollback(). If
+        C{durable} is set, the transaction runs with a full sync whatever
+        C{synchronous} is.
         """
+        if (durable and self.synchronous != 'full'
+                and not self.db.inTransaction()):
+            self._setSynchronous('full')
+            self.txnSynchronous = 'full'
         return self.db.transaction()
 
     def rollback(self):
         self.needsCleanup = False
+        self.depLoader = None
+        self.troveInfoRows = None
         self.db.rollback()
+        self._restoreSynchronous()
+        self.depTables.rollbackSnapshot()
+        self.counterIncremented = False
 
     def iterAllTroveNames(self):
         return self.instances.iterNames()
@@ -784,8 +865,14 @@ order by
         cu.execute("DROP TABLE IncludedTroves")
 
         trove.troveInfo.installTime.set(time.time())
-        self.depTables.add(cu, trove, troveInstanceId)
-        self.troveInfoTable.addInfo(cu, trove, troveInstanceId)
+        if self.depLoader is None:
+            self.depTables.add(cu, trove, troveInstanceId)
+            self.troveInfoTable.addInfo(cu, trove, troveInstanceId)
+        else:
+            self.depLoader.add(trove, troveInstanceId)
+            self.depTables.markChanged(troveInstanceId)
+            self.troveInfoRows.extend(
+                self.troveInfoTable.getInfoRows(cu, trove, troveInstanceId))
 
         # these are collections that _could_ include trove (they have
         # an empty slot where this trove might fit)
@@ -803,7 +890,19 @@ order by
 
         self._sanitizeTroveCollection(cu, troveInstanceId)
 
+        if self.depLoader is None:
+            self._createNewFileTables(cu)
+
+        stmt = cu.compile("""
+                INSERT INTO NewFiles (instanceId, pathId, versionId, path,
+                                      fileId, stream, isPresent)
+                        VALUES (%d, ?, ?, ?, ?, ?, ?)""" % troveInstanceId)
+
+        return (cu, troveInstanceId, stmt, oldTroveId)
+
+    def _createNewFileTables(self, cu):
         cu.execute("""CREATE TEMPORARY TABLE NewFiles (
+                        instanceId INTEGER,
                         pathId BLOB,
                         versionId INTEGER,
                         path %(PATHTYPE)s,
@@ -812,15 +911,50 @@ order by
                         isPresent INTEGER)""" % self.db.keywords)
 
         cu.execute("""CREATE TEMPORARY TABLE NewFileTags (
+                        instanceId INTEGER,
                         pathId BLOB,
                         tag %(STRING)s)""" % self.db.keywords)
 
-        stmt = cu.compile("""
-                INSERT INTO NewFiles (pathId, versionId, path, fileId,
-                                      stream, isPresent)
-                        VALUES (?, ?, ?, ?, ?, ?)""")
+    def _mergeNewFiles(self, cu):
+        cu.execute("""
+            INSERT INTO DBTroveFiles (pathId, versionId, path, fileId,
+                                      instanceId, isPresent, stream)
+                        SELECT pathId, versionId, path, fileId, instanceId,
+                               isPresent, stream FROM NewFiles""")
+        cu.execute("""
+            INSERT INTO Tags (tag) SELECT DISTINCT
+                NewFileTags.tag FROM NewFileTags
+                LEFT OUTER JOIN Tags USING (tag)
+                WHERE Tags.tag is NULL
+        """)
+        cu.execute("""
+            INSERT INTO DBFileTags (streamId, tagId)
+                SELECT streamId, tagId FROM
+                    NewFileTags JOIN DBTroveFiles USING (instanceId, pathId)
+                    JOIN Tags USING (tag)""")
 
-        return (cu, troveInstanceId, stmt, oldTroveId)
+        cu.execute("DROP TABLE NewFiles")
+        cu.execute("DROP TABLE NewFileTags")
+
+    def addTroveSetStart(self):
+        """
+        Stage the troves added until L{addTroveSetDone} is called. Their
+        files, file tags, dependencies and trove info are collected in
+        temporary tables and merged into the database by a few statements
+        when the set is done instead of by several for every trove.
+        """
+        cu = self.db.cursor()
+        self._createNewFileTables(cu)
+        self.depLoader = deptable.BulkDependencyLoader(self.db, cu)
+        self.troveInfoRows = []
+
+    def addTroveSetDone(self):
+        cu = self.db.cursor()
+        self._mergeNewFiles(cu)
+        self.depLoader.done()
+        self.troveInfoTable.addInfoRows(self.troveInfoRows)
+        self.depLoader = None
+        self.troveInfoRows = None
 
     def _sanitizeTroveCollection(self, cu, instanceId, nameHint = None):
         # examine the list of present, missing, and not inPristine troves
@@ -934,8 +1068,10 @@ order by
             tags = files.frozenFileTags(fileStream)
 
             if tags:
-                cu.executemany("INSERT INTO NewFileTags VALUES (?, ?)",
-                               itertools.izip(itertools.repeat(pathId), tags))
+                cu.executemany("INSERT INTO NewFileTags VALUES (?, ?, ?)",
+                               itertools.izip(
+                                    itertools.repeat(troveInstanceId),
+                                    itertools.repeat(pathId), tags))
         else:
             cu.execute("""
               UPDATE DBTroveFiles
@@ -947,27 +1083,8 @@ order by
     def addTroveDone(self, troveInfo):
         (cu, troveInstanceId, addFileStmt, oldInstanceId) = troveInfo
 
-        cu.execute("""
-            INSERT INTO DBTroveFiles (pathId, versionId, path, fileId,
-                                      instanceId, isPresent, stream)
-                        SELECT pathId, versionId, path, fileId, %d,
-                               isPresent, stream FROM NewFiles"""
-               % troveInstanceId)
-        cu.execute("""
-            INSERT INTO Tags (tag) SELECT DISTINCT
-                NewFileTags.tag FROM NewFileTags
-                LEFT OUTER JOIN Tags USING (tag)
-                WHERE Tags.tag is NULL
-        """)
-        cu.execute("""
-            INSERT INTO DBFileTags (streamId, tagId)
-                SELECT streamId, tagId FROM
-                    DBTroveFiles JOIN NewFileTags USING (pathId)
-                    JOIN Tags USING (tag)
-                    WHERE instanceId = ?""", troveInstanceId)
-
-        cu.execute("DROP TABLE NewFiles")
-        cu.execute("DROP TABLE NewFileTags")
+        if self.depLoader is None:
+            self._mergeNewFiles(cu)
 
         return troveInstanceId
 
@@ -1011,12 +1128,24 @@ order by
         cu = self.db.cursor()
         cu2 = self.db.cursor()
         cu.execute("CREATE TEMPORARY TABLE NewInstances (instanceId integer)")
-        for instanceId in instanceIdList:
-            cu.execute("INSERT INTO NewInstances (instanceId) VALUES (?)",
-                       instanceId)
+        cu.executemany("INSERT INTO NewInstances (instanceId) VALUES (?)",
+                       ((x,) for x in instanceIdList))
 
+        # Only the paths being added are looked up in the index of present
+        # files; the CROSS JOIN keeps sqlite from scanning that index instead
         cu.execute("""
-            SELECT AddedFiles.path,
+            CREATE TEMPORARY TABLE NewPaths AS
+                SELECT DBTroveFiles.streamId AS streamId,
+                       DBTroveFiles.path AS path,
+                       DBTroveFiles.fileId AS fileId,
+                       DBTroveFiles.instanceId AS instanceId
+                FROM NewInstances
+                JOIN DBTroveFiles USING (instanceId)
+                WHERE DBTroveFiles.isPresent = 1
+        """)
+
+        cu.execute("""
+            SELECT NewPaths.path,
                    ExistingInstances.instanceId, ExistingFiles.pathId,
                    ExistingFiles.stream,
                    ExistingInstances.troveName, ExistingVersions.version,
@@ -1026,11 +1155,14 @@ order by
                    AddedInstances.troveName,
                    AddedVersions.version, AddedFlavors.flavor
 
-                FROM NewInstances
-                JOIN DBTroveFiles AS AddedFiles USING (instanceId)
-                JOIN DBTroveFiles AS ExistingFiles ON
-                    AddedFiles.path = ExistingFiles.path AND
-                    AddedFiles.instanceId != ExistingFiles.instanceId
+                FROM NewPaths
+                CROSS JOIN DBTroveFiles AS ExistingFiles ON
+                    NewPaths.path = ExistingFiles.path AND
+                    ExistingFiles.isPresent = 1 AND
+                    NewPaths.instanceId != ExistingFiles.instanceId AND
+                    NewPaths.fileId != ExistingFiles.fileId
+                JOIN DBTroveFiles AS AddedFiles ON
+                    AddedFiles.streamId = NewPaths.streamId
 
                 JOIN Instances AS ExistingInstances ON
                     ExistingFiles.instanceId = ExistingInstances.instanceId
@@ -1040,21 +1172,15 @@ order by
                     ExistingInstances.flavorId = ExistingFlavors.flavorId
 
                 JOIN Instances AS AddedInstances ON
-                    AddedInstances.instanceId = NewInstances.instanceId
+                    AddedInstances.instanceId = NewPaths.instanceId
                 JOIN Versions AS AddedVersions ON
                     AddedInstances.versionId = AddedVersions.versionId
                 JOIN Flavors AS AddedFlavors ON
                     AddedInstances.flavorId = AddedFlavors.flavorId
-
-                WHERE
-                    AddedFiles.isPresent = 1 AND
-                    ExistingFiles.isPresent = 1 AND
-                    AddedFiles.fileId != ExistingFiles.fileId
         """)
 
         conflicts = []
         replaced = {}
-        #import epdb;epdb.st()
         for (path, existingInstanceId, existingPathId, existingStream,
              existingTroveName, existingVersion, existingFlavor,
              addedInstanceId, addedPathId, addedStream, addedTroveName,
@@ -1122,6 +1248,7 @@ order by
                           versions.VersionFromString(addedVersion),
                           deps.deps.ThawFlavor(addedFlavor)))))
 
+        cu.execute("DROP TABLE NewPaths")
         cu.execute("DROP TABLE NewInstances")
 
         if conflicts:
@@ -1396,15 +1523,25 @@ order by
                               Versions.versionId = DBTroveFiles.versionId
                           ORDER BY idx
                           """ % streamStr)
+            # share the version objects and directory names between files
+            # instead of creating new ones for each of them
+            fileVersions = {}
+            dirNames = {}
             curIdx = 0
             for (idx, pathId, path, version, fileId, isPresent, stream) in cu:
                 if not pristine and not isPresent:
                     continue
-                version = versions.VersionFromString(version)
-                results[idx].addFile(pathId, path, version, fileId)
+                fileVersion = fileVersions.get(version)
+                if fileVersion is None:
+                    fileVersion = versions.VersionFromString(version)
+                    fileVersions[version] = fileVersion
+                dirName, baseName = os.path.split(path)
+                dirName = dirNames.setdefault(dirName, dirName)
+                results[idx].addRawFile(pathId, dirName, baseName,
+                                        fileVersion, fileId)
                 if stream:
-                    results[idx].addFileObject(fileId,
-                                               files.ThawFile(stream, pathId))
+                    # thawed by getFileObject() when it is needed
+                    results[idx].addFileStream(fileId, pathId, stream)
                 while idx != curIdx:
                     yield results[curIdx]
                     curIdx += 1
@@ -1466,7 +1603,11 @@ order by
         for x, in wasIn:
             self._sanitizeTroveCollection(cu, x, nameHint = troveName)
 
-    def commit(self):
+    def commit(self, durable = False):
+        """
+        Commit the current transaction. If C{durable} is set, it is synced
+        to disk before returning even if C{synchronous} would not do so.
+        """
         if self.needsCleanup:
             # this join could be slow; it would be much better if we could
             # restrict the select on Instances by instanceId, but that's
@@ -1506,15 +1647,36 @@ order by
             cu.execute("DROP TABLE RemovedVersions")
             self.needsCleanup = False
 
+        if self.depTables.snapshotChanges:
+            self.depTables.prepareSnapshot(self.db.cursor(),
+                                           self.getTransactionCounter(),
+                                           self.counterIncremented)
+
         self.db.commit()
+        self.depTables.commitSnapshot()
+        self.counterIncremented = False
+        if self.txnSynchronous:
+            self._restoreSynchronous()
+        elif durable and self.synchronous != 'full':
+            # the transaction was not started with begin(durable = True)
+            self._syncLog()
         self.addVersionCache = {}
         self.flavorsNeeded = {}
 
     def dependencyChecker(self, troveSource, findOrdering = True,
                           ignoreDepClasses = set()):
+        # the snapshot of the installed system is only good for what has
+        # been committed
+        if self.db.inTransaction(default = True):
+            snapshot = None
+        else:
+            snapshot = self.depTables.getSnapshot(
+                                        self.getTransactionCounter())
+
         return deptable.DependencyChecker(self.db, troveSource,
                                           findOrdering = findOrdering,
-                                          ignoreDepClasses = ignoreDepClasses)
+                                          ignoreDepClasses = ignoreDepClasses,
+                                          snapshot = snapshot)
 
     def pathIsOwned(self, path):
         for instanceId in self.troveFiles.iterPath(path):
@@ -1527,61 +1689,120 @@ order by
         return self._iterTroves(instanceIds=self.troveFiles.iterPath(path),
                                 pristine=pristine)
 
+    def _loadPathList(self, cu, pathList):
+        # callers drop the table again when they are done with it
+        cu.execute("""
+        CREATE TEMPORARY TABLE pathList(
+            path        %(STRING)s PRIMARY KEY
+        )""" % self.db.keywords, start_transaction = False)
+        self.db.bulkload("pathList", [ (x,) for x in set(pathList) ],
+                         [ "path" ], start_transaction = False)
+
     def pathsOwned(self, pathList):
         if not pathList:
             return []
 
         cu = self.db.cursor()
-        cu.execute("""
-        CREATE TEMPORARY TABLE pathList(
-            path        %(STRING)s
-        )""" % self.db.keywords, start_transaction = False)
-        self.db.bulkload("pathList", [ (x,) for x in pathList ], [ "path" ],
-                         start_transaction = False)
-        cu.execute("""
-            SELECT path FROM pathList JOIN DBTroveFiles USING(path) WHERE
-                DBTroveFiles.isPresent = 1
-        """)
-
-        pathsFound = set( x[0] for x in cu )
-        cu.execute("DROP TABLE pathList", start_transaction = False)
+        self._loadPathList(cu, pathList)
+        try:
+            cu.execute("""
+                SELECT DISTINCT path FROM pathList CROSS JOIN DBTroveFiles
+                    USING(path) WHERE DBTroveFiles.isPresent = 1
+            """)
+            pathsFound = set( x[0] for x in cu )
+        finally:
+            cu.execute("DROP TABLE pathList", start_transaction = False)
 
         return [ path in pathsFound for path in pathList ]
 
-    def iterFindPathReferences(self, path, justPresent = False,
-                               withStream = False):
+    def _iterPathReferences(self, cu, withStream):
+        versionCache = {}
+        flavorCache = {}
+        for (path, name, version, flavor, pathId, fileId, stream) in cu:
+            versionObj = versionCache.get(version)
+            if versionObj is None:
+                versionObj = versions.VersionFromString(version)
+                versionCache[version] = versionObj
+
+            flavorObj = flavorCache.get(flavor)
+            if flavorObj is None:
+                if flavor is None:
+                    flavorObj = deps.deps.Flavor()
+                else:
+                    flavorObj = deps.deps.ThawFlavor(flavor)
+                flavorCache[flavor] = flavorObj
+
+            if withStream:
+                yield path, (name, versionObj, flavorObj, pathId, fileId,
+                             stream)
+            else:
+                yield path, (name, versionObj, flavorObj, pathId, fileId)
+
+    def _pathReferencesQuery(self, pathTable, justPresent, withStream):
         if withStream:
-            stream = "stream"
+            stream = "DBTroveFiles.stream"
         else:
             stream = "NULL"
 
+        where = []
+        if pathTable:
+            # CROSS JOIN keeps sqlite from walking all of DBTroveFiles
+            # instead of looking up the (usually far fewer) paths asked for
+            pathSource = "pathList CROSS JOIN DBTroveFiles USING(path)"
+        else:
+            pathSource = "DBTroveFiles"
+            where.append("DBTroveFiles.path = ?")
+        if justPresent:
+            # lets sqlite use the partial index on the present paths
+            where.append("DBTroveFiles.isPresent = 1")
+        if where:
+            where = "WHERE " + " AND ".join(where)
+        else:
+            where = ""
+
+        return """SELECT DBTroveFiles.path, troveName, version, flavor,
+                         pathId, fileId, %s
+                    FROM %s
+                    JOIN Instances ON
+                        DBTroveFiles.instanceId = Instances.instanceId
+                    JOIN Versions ON
+                        Instances.versionId = Versions.versionId
+                    JOIN Flavors ON
+                        Flavors.flavorId = Instances.flavorId
+                    %s
+                """ % (stream, pathSource, where)
+
+    def iterFindPathReferences(self, path, justPresent = False,
+                               withStream = False):
         cu = self.db.cursor()
-        cu.execute("""SELECT troveName, version, flavor, pathId, fileId,
-                             DBTroveFiles.isPresent, %s
-                            FROM DBTroveFiles JOIN Instances ON
-                                DBTroveFiles.instanceId = Instances.instanceId
-                            JOIN Versions ON
-                                Instances.versionId = Versions.versionId
-                            JOIN Flavors ON
-                                Flavors.flavorId = Instances.flavorId
-                            WHERE
-                                path = ?
-                    """ % stream, path)
+        cu.execute(self._pathReferencesQuery(False, justPresent, withStream),
+                   path)
+        for path, ref in self._iterPathReferences(cu, withStream):
+            yield ref
 
-        for (name, version, flavor, pathId, fileId, isPresent, stream) in cu:
-            if not isPresent and justPresent:
-                continue
+    def findPathReferences(self, pathList, justPresent = False,
+                           withStream = False):
+        """
+        Look up the troves referencing each path in C{pathList} with a
+        single query. Returns a dict mapping the paths which are referenced
+        to lists of the tuples L{iterFindPathReferences} would yield for
+        them; paths nobody references are left out.
+        """
+        if not pathList:
+            return {}
 
-            version = versions.VersionFromString(version)
-            if flavor is None:
-                flavor = deps.deps.Flavor()
-            else:
-                flavor = deps.deps.ThawFlavor(flavor)
+        cu = self.db.cursor()
+        self._loadPathList(cu, pathList)
+        try:
+            cu.execute(self._pathReferencesQuery(True, justPresent,
+                                                 withStream))
+            refs = {}
+            for path, ref in self._iterPathReferences(cu, withStream):
+                refs.setdefault(path, []).append(ref)
+        finally:
+            cu.execute("DROP TABLE pathList", start_transaction = False)
 
-            if stream:
-                yield (name, version, flavor, pathId, fileId, stream)
-            else:
-                yield (name, version, flavor, pathId, fileId)
+        return refs
 
     def removeFileFromTrove(self, trove, path):
         versionId = self.versionTable[trove.getVersion()]
@@ -2340,6 +2561,7 @@ order by
         field = "transaction counter"
 
         exists, counter = self._getTransactionCounter(field)
+        self.counterIncremented = True
 
         cu = self.db.cursor()
         if not exists:
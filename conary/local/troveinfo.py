@@ -35,6 +35,9 @@ class TroveInfoTable:
         schema.createTroveInfo(db)
 
     def addInfo(self, cu, trove, idNum):
+        self.addInfoRows(self.getInfoRows(cu, trove, idNum))
+
+    def getInfoRows(self, cu, trove, idNum):
         # c = True if the trove is a component
         n = trove.getName()
         # complete fixup is internal to a single client run; it should never be stored
@@ -57,7 +60,10 @@ class TroveInfoTable:
         if frz:
             newInfo.append((idNum, -1, cu.binary(frz)))
 
-        self.db.bulkload("TroveInfo", newInfo,
+        return newInfo
+
+    def addInfoRows(self, rows):
+        self.db.bulkload("TroveInfo", rows,
                          [ 'instanceId', 'infoType', 'data'] )
 
 
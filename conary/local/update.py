@@ -19,13 +19,16 @@
 Handles all updates to the file system; files should never get changed
 on the filesystem except by this module!
 """
+import collections
 import errno
 import itertools
 import os
+import Queue
 import select
 import stat
 import sys
 import tempfile
+import threading
 import weakref
 
 from conary import errors, files, trove, versions
@@ -83,6 +86,138 @@ class LastRestored(object):
         self.target = None
         self.type = None
 
+class _RestorePool(object):
+    """
+    Uncompresses regular files from a change set in worker threads.
+
+    Files are submitted in restore order. The worker threads only create
+    temporary files next to their targets; putting them in place (the
+    backup of the old file, the rename, permissions and journal entries) is
+    done by L{flush} in the caller's thread, in the order the files were
+    submitted.
+
+    With a durable C{opJournal}, files are put in place in batches: the
+    old files of the whole batch are backed up and journaled behind a
+    single barrier before any of them are replaced.
+    """
+
+    # files put in place behind each barrier of a durable journal
+    durableBatch = 64
+
+    def __init__(self, threads, finish, opJournal):
+        self.finish = finish
+        self.opJournal = opJournal
+        self.queue = Queue.Queue()
+        self.pending = collections.deque()
+        # bounds the number of temporary files waiting to be renamed
+        self.maxPending = threads * 4
+        if opJournal.durable:
+            self.maxPending = max(self.maxPending, self.durableBatch)
+        self.closing = False
+        self.workers = []
+        for i in range(threads):
+            worker = threading.Thread(target = self._work)
+            worker.setDaemon(True)
+            worker.start()
+            self.workers.append(worker)
+
+    def _work(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            if self.closing:
+                item.done.set()
+                continue
+            try:
+                item.extracted = files.RegularFile.extractContents(
+                                        item.contents, item.target)
+            except:
+                item.error = sys.exc_info()
+            item.done.set()
+
+    def submit(self, contents, target, finishArgs):
+        """
+        Restore C{contents} to C{target}. C{finishArgs} are passed to the
+        C{finish} callable, along with the extracted contents, when it is
+        C{target}'s turn.
+        """
+        # parent directories are created in order, as they would be without
+        # the pool
+        util.mkdirChain(os.path.dirname(target))
+        item = _PendingRestore(contents, target, finishArgs)
+        self.pending.append(item)
+        self.queue.put(item)
+        if len(self.pending) > self.maxPending:
+            if self.opJournal.durable:
+                self._finishBatch()
+            else:
+                self._finishOne()
+
+    def _finishOne(self):
+        item = self.pending.popleft()
+        item.done.wait()
+        if item.error:
+            raise item.error[0], item.error[1], item.error[2]
+        self.finish(extracted = item.extracted, *item.finishArgs)
+
+    def _finishBatch(self):
+        if not self.pending:
+            return
+
+        # items stay pending until they are finished, so close() cleans up
+        # after them if anything goes wrong
+        for item in self.pending:
+            item.done.wait()
+            if item.error:
+                raise item.error[0], item.error[1], item.error[2]
+
+        for item in self.pending:
+            self.opJournal.backup(item.target)
+        self.opJournal.barrier()
+
+        while self.pending:
+            item = self.pending[0]
+            self.finish(extracted = item.extracted, backedUp = True,
+                        *item.finishArgs)
+            self.pending.popleft()
+
+    def flush(self):
+        """Finish every file submitted so far, in order."""
+        if self.opJournal.durable:
+            self._finishBatch()
+        while self.pending:
+            self._finishOne()
+
+    def close(self):
+        """
+        Stop the workers. Temporary files of anything which was not
+        finished (because of an error) are removed.
+        """
+        self.closing = True
+        for worker in self.workers:
+            self.queue.put(None)
+        for worker in self.workers:
+            worker.join()
+        while self.pending:
+            item = self.pending.popleft()
+            if item.extracted:
+                util.removeIfExists(item.extracted[1])
+
+
+class _PendingRestore(object):
+
+    __slots__ = [ 'contents', 'target', 'finishArgs', 'done', 'extracted',
+                  'error' ]
+
+    def __init__(self, contents, target, finishArgs):
+        self.contents = contents
+        self.target = target
+        self.finishArgs = finishArgs
+        self.done = threading.Event()
+        self.extracted = None
+        self.error = None
+
 class FilesystemJob:
     """
     Represents a set of actions which need to be applied to the filesystem.
@@ -258,6 +393,7 @@ class FilesystemJob:
         # hardlink.
         linkPath = self.linkGroups[linkGroup]
         opJournal.backup(target)
+        opJournal.barrier()
 
         try:
             util.createLink(linkPath, target)
@@ -291,21 +427,27 @@ class FilesystemJob:
 
     @classmethod
     def restoreFile(cls, fileObj, contents, root, target, journal, opJournal,
-            isSourceTrove, keepTempfile = False):
-        opJournal.backup(target)
+            isSourceTrove, keepTempfile = False, extracted = None,
+            backedUp = False):
+        if not backedUp:
+            opJournal.backup(target)
+            opJournal.barrier()
         rootLen = len(root.rstrip('/'))
 
+        kwargs = {}
+        if extracted is not None:
+            kwargs['extracted'] = extracted
         if fileObj.hasContents and contents and not \
                                    fileObj.flags.isConfig():
             # config file sha1's are verified when they get inserted
             # into the config file cache
             tmpf = fileObj.restore(contents, root, target, journal=journal,
                             sha1 = fileObj.contents.sha1(),
-                            keepTempfile = keepTempfile)
+                            keepTempfile = keepTempfile, **kwargs)
         else:
             tmpf = fileObj.restore(contents, root, target, journal=journal,
                             nameLookup = (not isSourceTrove),
-                            keepTempfile = keepTempfile)
+                            keepTempfile = keepTempfile, **kwargs)
         if keepTempfile and tmpf != target:
             opJournal.create(tmpf)
 
@@ -337,7 +479,7 @@ class FilesystemJob:
         return True
 
     def apply(self, journal = None, opJournal = None, justDatabase = False,
-              noScripts = False, capsuleChangeSet = None):
+              noScripts = False, capsuleChangeSet = None, restoreThreads = 1):
         assert(not self.errors)
         rootLen = len(self.root.rstrip('/'))
 
@@ -352,6 +494,7 @@ class FilesystemJob:
 
         for (oldPath, newPath, msg) in self.renames:
             opJournal.rename(oldPath, newPath)
+            opJournal.barrier()
             os.rename(oldPath, newPath)
             log.debug(msg)
 
@@ -372,6 +515,9 @@ class FilesystemJob:
         paths = self.removes.keys()
         paths.sort()
         paths.reverse()
+        # everything is backed up before anything is removed, so a durable
+        # journal needs just one barrier
+        toRemove = []
         for fileNum, target in enumerate(paths):
             (relativePath, fileObj, msg, ignoreMissing) = self.removes[target]
             self.callback.removeFiles(fileNum + 1, len(paths))
@@ -398,16 +544,20 @@ class FilesystemJob:
                     continue
 
                 opJournal.backup(target)
-                try:
-                    fileObj.remove(target)
-                    opJournal.remove(target)
-                except OSError, e:
-                    self.callback.error("%s could not be removed: %s",
-                                        target[rootLen:], e.strerror)
-                    raise
+                toRemove.append((target, fileObj))
 
             log.debug(msg, target)
 
+        opJournal.barrier()
+        for target, fileObj in toRemove:
+            try:
+                fileObj.remove(target)
+                opJournal.remove(target)
+            except OSError, e:
+                self.callback.error("%s could not be removed: %s",
+                                    target[rootLen:], e.strerror)
+                raise
+
         restoreIndex = 0
         while restoreIndex < len(restores):
             # handle things which are becoming directories first; this moves
@@ -421,6 +571,87 @@ class FilesystemJob:
                                  target, journal, opJournal,
                                  self.isSourceTrove)
 
+        if ((restoreThreads > 1 and util.sha1Uncompress is not None)
+                or opJournal.durable):
+            # a durable journal is synced once for each batch of files the
+            # pool puts in place rather than once for each file
+            pool = _RestorePool(max(restoreThreads, 1), self.restoreFile,
+                                opJournal)
+        else:
+            pool = None
+        try:
+            self._restoreFiles(restores, delayedRestores, ptrTargets,
+                               tmpPtrFiles, journal, opJournal, pool)
+        finally:
+            if pool is not None:
+                pool.close()
+
+        for (pathId, fileObj, target, msg, ptrId, fileId) in delayedRestores:
+            # we wouldn't be here if the fileObj didn't have contents and
+            # no override
+
+            # the source of the link group may not have been restored
+            # yet (it could be in the delayedRestore list itself). that's
+            # fine; we just restore the contents here and make the links
+            # for everything else
+            if fileObj.linkGroup():
+                linkGroup = fileObj.linkGroup()
+                if self.linkGroups.has_key(linkGroup):
+                    # this could create spurious backups, but they won't
+                    # hurt anything
+                    if self._createLink(fileObj.linkGroup(), target, opJournal):
+                        opJournal.create(target)
+                        continue
+                else:
+                    linkGroup = fileObj.linkGroup()
+                    self.linkGroups[linkGroup] = target
+
+            if isinstance(ptrTargets[ptrId], str):
+                contents = filecontents.FromFilesystem(ptrTargets[ptrId])
+            else:
+                contents = ptrTargets[ptrId]
+                ptrTargets[ptrId] = target
+
+            self.restoreFile(fileObj, contents,
+                        self.root, target, journal=journal,
+                        opJournal = opJournal,
+                        isSourceTrove = self.isSourceTrove)
+            log.debug(msg, target)
+
+        del delayedRestores
+        # At this point, clean up all temporary ptr files
+        for fname in tmpPtrFiles:
+            os.unlink(fname)
+
+        for (target, contents, msg) in self.newFiles:
+            opJournal.backup(target)
+            opJournal.barrier()
+            try:
+                os.unlink(target)
+            except OSError, e:
+                if e.errno != errno.ENOENT:
+                    raise
+            f = open(target, "w")
+            opJournal.create(target)
+            f.write(contents)
+            f.close()
+            self.callback.warning(msg)
+
+    def _restoreFiles(self, restores, delayedRestores, ptrTargets,
+                      tmpPtrFiles, journal, opJournal, pool):
+        """
+        Restore everything in C{restores} other than directories. Regular
+        files which come straight from the change set are handed to
+        C{pool}, if there is one, and every other operation waits for them
+        to be finished first, so the filesystem and C{opJournal} see the
+        same sequence of changes as they would without the pool.
+        """
+        if pool is None:
+            flush = lambda: None
+        else:
+            flush = pool.flush
+
+        contents = None
         restoreIndex = 0
         j = 0
         lastRestored = LastRestored()
@@ -429,6 +660,7 @@ class FilesystemJob:
                                                 restores[restoreIndex]
             restoreIndex += 1
             ptrId = pathId + fileId
+            fromChangeSet = False
 
             if isinstance(fileObj, files.Directory):
                 continue
@@ -444,6 +676,7 @@ class FilesystemJob:
                         break
 
                 assert(match)
+                flush()
 
                 (otherId, fileObj, target, msg, ptrId, otherFileId) = match[1]
 
@@ -487,6 +720,7 @@ class FilesystemJob:
                         self.linkGroups.has_key(fileObj.linkGroup()):
                     # this creates links whose target we already know
                     # (because it was already present or already restored)
+                    flush()
                     if self._createLink(fileObj.linkGroup(), target, opJournal):
                         self.updatePtrs(ptrId, pathId, ptrTargets, override,
                                    contents, target)
@@ -495,6 +729,7 @@ class FilesystemJob:
                     if (lastRestored.pathId, lastRestored.fileId) == \
                                     (pathId, fileId):
                         # we share contents with another path
+                        flush()
                         contType = lastRestored.type
                         if lastRestored.type == changeset.ChangedFileTypes.ptr:
                             contents = filecontents.FromString(
@@ -506,6 +741,7 @@ class FilesystemJob:
                         contType, contents = self.changeSet.getFileContents(
                                                             pathId, fileId,
                                                             compressed = True)
+                        fromChangeSet = True
 
                     assert(contType != changeset.ChangedFileTypes.diff)
                     # PTR types are restored later. We need to cache
@@ -543,12 +779,14 @@ class FilesystemJob:
                         # XXX we need to create this or conary thinks it
                         # was removed by the user if it doesn't already
                         # exist, when that's not what we mean here
+                        flush()
                         dirName = os.path.dirname(target)
                         util.mkdirChain(dirName)
                         name = os.path.basename(target)
                         tmpfd, tmpname = tempfile.mkstemp(name, '.ct', dirName)
                         os.close(tmpfd)
                         opJournal.backup(target)
+                        opJournal.barrier()
                         os.rename(tmpname, target)
 
                         continue
@@ -558,9 +796,25 @@ class FilesystemJob:
             if override != "":
                 contents = override
 
-            tmpPtrFile = self.restoreFile(fileObj, contents, self.root,
-                        target, journal, opJournal, self.isSourceTrove,
-                        keepTempfile = isPtrTarget)
+            if (pool is not None and fromChangeSet and not isPtrTarget
+                    and override == ""
+                    and contType == changeset.ChangedFileTypes.file
+                    and isinstance(fileObj, files.RegularFile)
+                    and not fileObj.flags.isConfig()
+                    and not fileObj.linkGroup()
+                    and contents.isCompressed()):
+                # uncompressed by the pool; finished in this order by
+                # flush(). config files are checked as they are restored,
+                # so they are left to restoreFile()
+                pool.submit(contents, target,
+                            (fileObj, contents, self.root, target, journal,
+                             opJournal, self.isSourceTrove))
+                tmpPtrFile = target
+            else:
+                flush()
+                tmpPtrFile = self.restoreFile(fileObj, contents, self.root,
+                            target, journal, opJournal, self.isSourceTrove,
+                            keepTempfile = isPtrTarget)
             if tmpPtrFile != target:
                 self.updatePtrs(ptrId, pathId, ptrTargets, override, contents,
                                 tmpPtrFile)
@@ -576,55 +830,7 @@ class FilesystemJob:
                 linkGroup = fileObj.linkGroup()
                 self.linkGroups[linkGroup] = target
 
-        for (pathId, fileObj, target, msg, ptrId, fileId) in delayedRestores:
-            # we wouldn't be here if the fileObj didn't have contents and
-            # no override
-
-            # the source of the link group may not have been restored
-            # yet (it could be in the delayedRestore list itself). that's
-            # fine; we just restore the contents here and make the links
-            # for everything else
-            if fileObj.linkGroup():
-                linkGroup = fileObj.linkGroup()
-                if self.linkGroups.has_key(linkGroup):
-                    # this could create spurious backups, but they won't
-                    # hurt anything
-                    if self._createLink(fileObj.linkGroup(), target, opJournal):
-                        opJournal.create(target)
-                        continue
-                else:
-                    linkGroup = fileObj.linkGroup()
-                    self.linkGroups[linkGroup] = target
-
-            if isinstance(ptrTargets[ptrId], str):
-                contents = filecontents.FromFilesystem(ptrTargets[ptrId])
-            else:
-                contents = ptrTargets[ptrId]
-                ptrTargets[ptrId] = target
-
-            self.restoreFile(fileObj, contents,
-                        self.root, target, journal=journal,
-                        opJournal = opJournal,
-                        isSourceTrove = self.isSourceTrove)
-            log.debug(msg, target)
-
-        del delayedRestores
-        # At this point, clean up all temporary ptr files
-        for fname in tmpPtrFiles:
-            os.unlink(fname)
-
-        for (target, contents, msg) in self.newFiles:
-            opJournal.backup(target)
-            try:
-                os.unlink(target)
-            except OSError, e:
-                if e.errno != errno.ENOENT:
-                    raise
-            f = open(target, "w")
-            opJournal.create(target)
-            f.write(contents)
-            f.close()
-            self.callback.warning(msg)
+        flush()
 
     def runPostTagScripts(self, tagSet = {}, tagScript = None):
         # this is run after the changes are in the database (but before
@@ -1009,7 +1215,23 @@ class FilesystemJob:
                                      newCompatClass, s, action))
 
         # Create new files. If the files we are about to create already
-        # exist, it's an error.
+        # exist, it's an error. Find the ones which are in the way first, so
+        # their owners can be looked up with a single query.
+        pathsInWay = {}
+        for (pathId, headPath, headFileId, headFileVersion) in \
+                                            troveCs.getNewFileList():
+            if pathId in removalList or headPath in pathsMoved:
+                continue
+            s = util.lstat(util.joinPaths(rootFixup, headPath))
+            if s is not None:
+                pathsInWay[headPath] = s
+
+        if isSrcTrove or not pathsInWay:
+            pathOwners = {}
+        else:
+            pathOwners = self.db.findPathReferences(pathsInWay.keys(),
+                                                    justPresent = True)
+
         for (pathId, headPath, headFileId, headFileVersion) in troveCs.getNewFileList():
             headRealPath = util.joinPaths(rootFixup, headPath)
 
@@ -1085,16 +1307,11 @@ class FilesystemJob:
 
             restoreFile = True
 
-            s = util.lstat(headRealPath)
+            s = pathsInWay.get(headPath)
             if s is not None:
                 # We found a conflict with an already-existing file. If
                 # we're installing binaries, let's see who owns it
-                if isSrcTrove:
-                    existingOwners = []
-                else:
-                    existingOwners = list(
-                        self.db.iterFindPathReferences(
-                                            headPath, justPresent = True))
+                existingOwners = pathOwners.get(headPath, [])
 
                 if existingOwners:
                     replaceThisFile = flags.replaceManagedFiles(headPath)
@@ -1912,7 +2129,7 @@ def _localChanges(repos, changeSet, curTrove, srcTrove, newVersion, root, flags,
                   withFileContents=True, forceSha1=False,
                   ignoreTransient=False, ignoreAutoSource=False,
                   crossRepositoryDeltas = True, allowMissingFiles = False,
-                  callback=UpdateCallback(), statCache = {}):
+                  callback=UpdateCallback(), statCache = {}, hashCache = None):
     """
     Populates a change set against the files in the filesystem and builds
     a trove object which describes the files installed.  The return
@@ -1946,6 +2163,8 @@ def _localChanges(repos, changeSet, curTrove, srcTrove, newVersion, root, flags,
     @type crossRepositoryDeltas: If set, deltas between file streams and
             file contents can be used even when the old and new versions
             of that file are on different repositories.
+    @param hashCache: checksums of files which have already been computed
+    @type hashCache: local.hashcache.HashCache
     """
     assert(root)
 
@@ -1981,7 +2200,8 @@ def _localChanges(repos, changeSet, curTrove, srcTrove, newVersion, root, flags,
     isSrcTrove = curTrove.getName().endswith(':source')
 
     if isinstance(srcTrove, trove.TroveWithFileObjects):
-        srcFileObjs = [ srcTrove.getFileObject(x[2]) for x in fileList ]
+        # thaw them one at a time as the loop gets to them
+        srcFileObjs = ( srcTrove.getFileObject(x[2]) for x in fileList )
     else:
         srcFileObjs = repos.getFileVersions( [ (x[0], x[2], x[3]) for x in
                                                         fileList ],
@@ -2037,7 +2257,8 @@ def _localChanges(repos, changeSet, curTrove, srcTrove, newVersion, root, flags,
             f = files.FileFromFilesystem(realPath, pathId,
                                          possibleMatch = possibleMatch,
                                          statBuf =
-                                            statCache.get(realPath, None))
+                                            statCache.get(realPath, None),
+                                         hashCache = hashCache)
         except OSError, e:
             if isSrcTrove:
                 callback.error(
@@ -2149,7 +2370,8 @@ def _localChanges(repos, changeSet, curTrove, srcTrove, newVersion, root, flags,
         assert(srcTrove or isinstance(version, versions.NewVersion))
 
         f = files.FileFromFilesystem(realPath, pathId,
-                                     statBuf = statCache.get(realPath, None))
+                                     statBuf = statCache.get(realPath, None),
+                                     hashCache = hashCache)
 
         if isSrcTrove:
             f.flags.isSource(set = True)
@@ -2197,7 +2419,8 @@ def buildLocalChanges(repos, pkgList, root = ".", withFileContents=True,
                       forceSha1 = False, ignoreTransient=False,
                       ignoreAutoSource = False, updateContainers = False,
                       crossRepositoryDeltas = True, allowMissingFiles = False,
-                      callback=UpdateCallback(), statCache = {}):
+                      callback=UpdateCallback(), statCache = {},
+                      hashCache = None):
     """
     Builds a change set against a set of files currently installed and
     builds a trove object which describes the files installed.  The
@@ -2226,6 +2449,8 @@ def buildLocalChanges(repos, pkgList, root = ".", withFileContents=True,
                              changed.
     @param statCache: Dictionary mapping paths to stat buffers.
     @type statCache: dict
+    @param hashCache: checksums of files which have already been computed
+    @type hashCache: local.hashcache.HashCache
     """
 
     changeSet = changeset.ChangeSet()
@@ -2241,7 +2466,8 @@ def buildLocalChanges(repos, pkgList, root = ".", withFileContents=True,
                                crossRepositoryDeltas = crossRepositoryDeltas,
                                allowMissingFiles = allowMissingFiles,
                                callback = callback,
-                               statCache = statCache)
+                               statCache = statCache,
+                               hashCache = hashCache)
         if result is None:
             # an error occurred
             return None
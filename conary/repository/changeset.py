@@ -435,6 +435,8 @@ class ChangeSet(streams.StreamSet):
         csf.addFile("CONARYCHANGESET", filecontents.FromString(str), "")
         correction = self.writeAllContents(csf,
                                            withReferences = withReferences)
+        # writes the offset index for containers which have one
+        csf.close()
         return (outFile.tell() - start) + correction
 
     def writeToFile(self, outFileName, withReferences = False, mode = 0666,
@@ -1419,30 +1421,41 @@ class ReadOnlyChangeSet(ChangeSet):
                 f.seek(0)
                 cont = filecontents.FromFile(f, compressed = True)
         else:
-            self.filesRead = True
-
-            rc = self._nextFile()
-            while rc:
-                name, tagInfo, f, csf = rc
+            rc = self._getIndexedFile(key, pathId)
+            if rc is not None:
+                # found through a container's offset index, which leaves
+                # the sequential file queue alone
+                name, tagInfo, f = rc
                 if not compressed:
                     f = gzip.GzipFile(None, "r", fileobj = f)
-
-                # if we found the key we're looking for, or the pathId
-                # we got is a config file, cache or break out of the loop
-                # accordingly
-                #
-                # we check for both the key and the pathId here for backwards
-                # compatibility reading old change set formats
-                if name == key or name == pathId or tagInfo[0] == '1':
-                    tag = 'cft-' + tagInfo.split()[1]
-                    cont = filecontents.FromFile(f, compressed = compressed)
-
-                    # we found the one we're looking for, break out
-                    if name == key or name == pathId:
-                        self.lastCsf = csf
-                        break
+                tag = 'cft-' + tagInfo.split()[1]
+                cont = filecontents.FromFile(f, compressed = compressed)
+            else:
+                self.filesRead = True
 
                 rc = self._nextFile()
+                while rc:
+                    name, tagInfo, f, csf = rc
+                    if not compressed:
+                        f = gzip.GzipFile(None, "r", fileobj = f)
+
+                    # if we found the key we're looking for, or the pathId
+                    # we got is a config file, cache or break out of the loop
+                    # accordingly
+                    #
+                    # we check for both the key and the pathId here for
+                    # backwards compatibility reading old change set formats
+                    if name == key or name == pathId or tagInfo[0] == '1':
+                        tag = 'cft-' + tagInfo.split()[1]
+                        cont = filecontents.FromFile(f,
+                                                     compressed = compressed)
+
+                        # we found the one we're looking for, break out
+                        if name == key or name == pathId:
+                            self.lastCsf = csf
+                            break
+
+                    rc = self._nextFile()
 
         if name != key and name != pathId:
             if len(pathId) == 16:
@@ -1451,6 +1464,24 @@ class ReadOnlyChangeSet(ChangeSet):
         else:
             return (tag, cont)
 
+    def _getIndexedFile(self, key, pathId):
+        """
+        Look up file contents in the file containers which carry an offset
+        index. Returns a (name, tagInfo, fileObj) tuple, or None if the
+        contents have to be found by reading the containers in order.
+        """
+        for csf in self.fileContainers:
+            if not csf.hasIndex():
+                continue
+            rc = csf.getFile(key)
+            if rc is None:
+                # older changesets are keyed by pathId alone
+                rc = csf.getFile(pathId)
+            if rc is not None:
+                return rc
+
+        return None
+
     def makeAbsolute(self, repos):
         """
         Converts this (relative) change set to an abstract change set.  File
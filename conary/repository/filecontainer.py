@@ -66,6 +66,28 @@ knowing the total size being stored as well as the dynamic compression making
 that size unknowable in advance. It does limit file storage size a bit, but
 leaves us with well over 63 bits of length.
 
+Containers of version FILE_CONTAINER_VERSION_OFFSET_IDX are followed by an
+index of the offset of every file table entry, so readers can seek straight
+to any entry by name instead of scanning the container in order::
+
+ - INDEX_MAGIC (2 bytes)
+ - number of index entries (4 bytes)
+ - index entry 1
+ - index entry N
+ - offset of INDEX_MAGIC from the start of the container (8 bytes)
+ - INDEX_TRAILER_MAGIC (4 bytes)
+
+Each index entry is::
+
+ - length of file name (2 bytes)
+ - offset of the file table entry from the start of the container (8 bytes)
+ - file name
+
+INDEX_MAGIC sits where the next file table entry would be, so sequential
+readers simply stop there. The index is optional; containers of that version
+which lack the trailer (for instance, because they were truncated) are read
+sequentially.
+
 This code is careful not to depend on the file pointer at all for reading
 (via pread). The file pointer is used while creating file containers.
 """
@@ -82,17 +104,26 @@ FILE_CONTAINER_MAGIC = "\xEA\x3F\x81\xBB"
 SUBFILE_MAGIC = 0x3FBB
 # used for files whose contents are > 4gig
 LARGE_SUBFILE_MAGIC = 0x40CD
+# marks the start of the trailing offset index
+INDEX_MAGIC = 0x1DC8
+INDEX_TRAILER_MAGIC = "\xEA\x3F\x1D\xC8"
 
 # File container versions. Add references to these in netclient too.
+FILE_CONTAINER_VERSION_OFFSET_IDX   = 2026101801
 FILE_CONTAINER_VERSION_FILEID_IDX   = 2007022001
 FILE_CONTAINER_VERSION_WITH_REMOVES = 2006071301
 FILE_CONTAINER_VERSION_NO_REMOVES   = 2005101901
 
-READABLE_VERSIONS = [ FILE_CONTAINER_VERSION_FILEID_IDX,
+READABLE_VERSIONS = [ FILE_CONTAINER_VERSION_OFFSET_IDX,
+                      FILE_CONTAINER_VERSION_FILEID_IDX,
                       FILE_CONTAINER_VERSION_WITH_REMOVES,
                       FILE_CONTAINER_VERSION_NO_REMOVES ]
 
-FILE_CONTAINER_VERSION_LATEST = max(READABLE_VERSIONS)
+# The offset index is only used for changesets stored on disk; it is never
+# negotiated with repositories, so the latest network version is unchanged.
+FILE_CONTAINER_VERSION_LATEST = FILE_CONTAINER_VERSION_FILEID_IDX
+
+INDEXED_VERSIONS = [ FILE_CONTAINER_VERSION_OFFSET_IDX ]
 
 SEEK_SET = 0
 SEEK_CUR = 1
@@ -102,7 +133,7 @@ class FileContainer:
 
     bufSize = 128 * 1024
 
-    def readHeader(self):
+    def readHeader(self, readIndex = True):
         magic = self.file.pread(4, 0)
         if len(magic) != 4 or magic != FILE_CONTAINER_MAGIC:
             raise BadContainer, "bad magic"
@@ -118,7 +149,62 @@ class FileContainer:
         self.contentsStart = 8
         self.next = self.contentsStart
 
+        self.index = None
+        if self.version in INDEXED_VERSIONS and readIndex:
+            self.index = self._readIndex()
+
+    def _readIndex(self):
+        self.file.seek(0, SEEK_END)
+        end = self.file.tell()
+        if end < self.contentsStart + 18:
+            return None
+
+        trailer = self.file.pread(12, end - 12)
+        if len(trailer) != 12 or trailer[8:] != INDEX_TRAILER_MAGIC:
+            return None
+        indexOffset = struct.unpack("!Q", trailer[:8])[0]
+        if indexOffset < self.contentsStart or indexOffset > end - 18:
+            raise BadContainer("invalid file container index")
+
+        data = self.file.pread(end - 12 - indexOffset, indexOffset)
+        magic, count = struct.unpack("!HI", data[:6])
+        if magic != INDEX_MAGIC:
+            raise BadContainer("invalid file container index")
+
+        index = {}
+        pos = 6
+        for i in xrange(count):
+            nameLen, offset = struct.unpack("!HQ", data[pos:pos + 10])
+            pos += 10
+            index[data[pos:pos + nameLen]] = offset
+            pos += nameLen
+            if pos > len(data):
+                raise BadContainer("invalid file container index")
+
+        return index
+
+    @staticmethod
+    def _packIndex(entries, indexOffset):
+        """
+        Return the index block and trailer for a list of (name, offset)
+        tuples, where the index itself starts at indexOffset.
+        """
+        l = [ struct.pack("!HI", INDEX_MAGIC, len(entries)) ]
+        for name, offset in entries:
+            l.append(struct.pack("!HQ", len(name), offset))
+            l.append(name)
+        l.append(struct.pack("!Q", indexOffset))
+        l.append(INDEX_TRAILER_MAGIC)
+        return ''.join(l)
+
+    def hasIndex(self):
+        return self.index is not None
+
     def close(self):
+        if self.file and self.mutable and self.index is not None:
+            indexOffset = self.file.tell() - self.start
+            self.file.write(self._packIndex(self.index, indexOffset))
+            self.index = None
         self.file = None
 
     def addFile(self, fileName, contents, tableData, precompressed = False):
@@ -127,6 +213,8 @@ class FileContainer:
 
         fileObj = contents.get()
         headerOffset = self.file.tell()
+        if self.index is not None:
+            self.index.append((fileName, headerOffset - self.start))
         self.file.write(struct.pack("!HH", SUBFILE_MAGIC, len(fileName)))
         self.file.write(struct.pack("!IH", 0, len(tableData)))
         self.file.write(fileName)
@@ -168,12 +256,73 @@ class FileContainer:
 
         return (name, tag, fcf)
 
-    def _nextFile(self):
-        offset = self.next
+    def getFile(self, name):
+        """
+        Return the (name, tag, fileObj) entry called C{name}, or None if the
+        container has no such entry. The position used by getNextFile() is
+        not affected. Containers with an offset index are read directly;
+        others are scanned from the beginning.
+        """
+        assert(not self.mutable)
+
+        if self.index is not None:
+            offset = self.index.get(name)
+            if offset is None:
+                return None
+            entryName, tag, size, dataOffset, nextOffset = \
+                    self._nextFile(offset)
+            if entryName != name:
+                raise BadContainer("invalid file container index")
+        else:
+            offset = self.contentsStart
+            while True:
+                entryName, tag, size, dataOffset, nextOffset = \
+                        self._nextFile(offset)
+                if entryName is None:
+                    return None
+                elif entryName == name:
+                    break
+                offset = nextOffset
+
+        fcf = util.SeekableNestedFile(self.file, size, start = dataOffset)
+        return (entryName, tag, fcf)
+
+    def verify(self):
+        """
+        Walk all of the entries of a read-only container, raising
+        BadContainer if it is truncated or followed by trailing data. The
+        position used by getNextFile() is not affected.
+        """
+        assert(not self.mutable)
+
+        self.file.seek(0, SEEK_END)
+        end = self.file.tell()
+        offset = self.contentsStart
+        while True:
+            name, tag, size, dataOffset, nextOffset = self._nextFile(offset)
+            if name is None:
+                break
+            if nextOffset > end:
+                raise BadContainer("file container is truncated")
+            offset = nextOffset
+
+        if self.version in INDEXED_VERSIONS and offset != end:
+            if self.index is None:
+                raise BadContainer("invalid file container index")
+        elif offset != end:
+            raise BadContainer("file container has trailing data")
+
+    def _nextFile(self, offset = None):
+        if offset is None:
+            offset = self.next
 
         nameLen = self.file.pread(10, offset)
         if not len(nameLen):
             return (None, None, None, None, None)
+        elif (self.version in INDEXED_VERSIONS and
+                nameLen[0:2] == struct.pack("!H", INDEX_MAGIC)):
+            # the offset index follows the last entry
+            return (None, None, None, None, None)
         elif len(nameLen) < 10:
             raise BadContainer("file container is truncated")
 
@@ -191,7 +340,8 @@ class FileContainer:
             size = totalSize - nameLen - tagLen
             nextOffset = offset + totalSize + 4
         else:
-            assert(subMagic == SUBFILE_MAGIC)
+            if subMagic != SUBFILE_MAGIC:
+                raise BadContainer("invalid file container entry")
             nameLen, size, tagLen = struct.unpack("!HIH", nameLen[2:])
             nextOffset = offset + nameLen + tagLen + size
 
@@ -243,6 +393,14 @@ class FileContainer:
         if offset:
             offset = max(0, offset - 8)
 
+        # expanding placeholders moves entries around, so the offset index
+        # is rebuilt as the stream is produced
+        if self.version in INDEXED_VERSIONS:
+            indexEntries = []
+        else:
+            indexEntries = None
+        position = 8
+
         next = self.getNextFile()
         while next is not None:
             name, tag, subfile = next
@@ -250,6 +408,9 @@ class FileContainer:
             tag, expandedSize, subfile = readFileFunc(name, tag, rawSize,
                     subfile, *args)
             header, footer = self._packFileHeader(name, tag, expandedSize)
+            if indexEntries is not None:
+                indexEntries.append((name, position))
+                position += len(header) + expandedSize + len(footer)
 
             if offset < len(header):
                 yield header[offset:]
@@ -271,6 +432,11 @@ class FileContainer:
                 offset = max(0, offset - len(footer))
             next = self.getNextFile()
 
+        if indexEntries is not None:
+            index = self._packIndex(indexEntries, position)
+            if offset < len(index):
+                yield index[offset:]
+
     def reset(self):
         """
         Reset the current position in the filecontainer to the beginning.
@@ -279,10 +445,12 @@ class FileContainer:
         self.next = self.contentsStart
 
     def __del__(self):
-        if self.file:
-            self.close()
+        # the index of a mutable container is only written by an explicit
+        # close(); the caller may already have closed the file by now
+        self.file = None
 
-    def __init__(self, file, version = None, append = False):
+    def __init__(self, file, version = None, append = False,
+                 readIndex = True):
         """
         Create a FileContainer object.
 
@@ -292,6 +460,9 @@ class FileContainer:
         is retained, so the caller may optionally close it.
         @param append: if True, creates a new filecontainer at the end
         of the passed flie object
+        @param readIndex: if False, the offset index of an existing
+        container is not loaded, which is needed when the end of the file
+        has not been written yet. Entries can then only be read in order.
         """
 
         # make our own copy of this file which nobody can close underneath us
@@ -301,7 +472,8 @@ class FileContainer:
             version = FILE_CONTAINER_VERSION_LATEST
 
         self.file.seek(0, SEEK_END)
-        if append or not self.file.tell():
+        self.start = self.file.tell()
+        if append or not self.start:
             try:
                 self.file.write(FILE_CONTAINER_MAGIC)
                 self.file.write(struct.pack("!I", version))
@@ -310,12 +482,19 @@ class FileContainer:
                     raise IOError(errno.EBADF, "File is not open for writing")
                 raise
 
+            self.version = version
+            if version in INDEXED_VERSIONS:
+                # (name, offset) list, written out by close()
+                self.index = []
+            else:
+                self.index = None
             self.mutable = True
         else:
             # we don't need to put this file pointer back; we don't depend
             # on it here at all; everything is through pseek
+            self.start = 0
             try:
-                self.readHeader()
+                self.readHeader(readIndex = readIndex)
             except:
                 self.file.close()
                 self.file = None
@@ -20,6 +20,8 @@ import errno
 import gzip
 import itertools
 import os
+import sys
+import threading
 import time
 import urllib
 import xml
@@ -32,6 +34,7 @@ from conary.cmds import metadata
 from conary import trove as trv_mod
 from conary import trovetup
 from conary import versions
+from conary.lib import digestlib
 from conary.lib import util, api
 from conary.lib import httputils
 from conary.lib import log
@@ -57,7 +60,7 @@ PermissionAlreadyExists = errors.PermissionAlreadyExists
 shims = xmlshims.NetworkConvertors()
 
 # end of range or last protocol version + 1
-CLIENT_VERSIONS = range(36, 73 + 1)
+CLIENT_VERSIONS = range(36, 75 + 1)
 
 from conary.repository.trovesource import TROVE_QUERY_ALL, TROVE_QUERY_PRESENT, TROVE_QUERY_NORMAL
 
@@ -72,6 +75,73 @@ class PartialResultsError(Exception):
         self.partialResults = partialResults
 
 
+class _StaleCheckpoint(Exception):
+    pass
+
+
+class _DownloadCheckpoint(object):
+    """
+    File in C{checkpointDir} which a changeset download from
+    C{serverName} for C{args} is written to. It is left behind if the
+    download fails, and the next download of the same changeset picks up
+    where the last one stopped. The last C{trim} bytes are discarded first
+    in case they are garbage (e.g. a proxy error page).
+    """
+
+    def __init__(self, checkpointDir, serverName, args, trim):
+        key = digestlib.sha1(repr((serverName,) + tuple(args))).hexdigest()
+        self.path = os.path.join(checkpointDir, 'partial-' + key)
+        self.sizesPath = self.path + '.sizes'
+        try:
+            self.sizes = [ int(x) for x in
+                    open(self.sizesPath).read().split() ]
+        except (IOError, ValueError):
+            self.sizes = None
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0600)
+        try:
+            if self.sizes is None:
+                size = 0
+            else:
+                size = max(0, os.fstat(fd).st_size - trim)
+            os.ftruncate(fd, size)
+            self.file = util.ExtendedFile(self.path, 'r+', buffering = False)
+        finally:
+            os.close(fd)
+        self.file.seek(0, 2)
+        self.size = self.file.tell()
+
+    def checkSizes(self, sizes):
+        """
+        Remember the sizes of the changesets being downloaded, raising
+        _StaleCheckpoint if they are not the ones which were being
+        downloaded when the checkpoint was taken.
+        """
+        if self.sizes == sizes:
+            return
+        if self.sizes is not None and self.size:
+            raise _StaleCheckpoint
+        f = util.AtomicFile(self.sizesPath, chmod = 0600)
+        f.write(' '.join(str(x) for x in sizes))
+        f.commit()
+        self.sizes = sizes
+
+    def reset(self):
+        """Start over with an empty file."""
+        self.file.truncate(0)
+        self.file.seek(0)
+        self.size = 0
+        self.sizes = None
+        util.removeIfExists(self.sizesPath)
+
+    def done(self):
+        """
+        Forget the checkpoint. The open file keeps the data around for as
+        long as it is needed.
+        """
+        util.removeIfExists(self.path)
+        util.removeIfExists(self.sizesPath)
+
+
 def unmarshalException(exceptionName, exceptionArgs, exceptionKwArgs):
     conv = xmlshims.NetworkConvertors()
     if exceptionName == "TroveIntegrityError" and len(exceptionArgs) > 1:
@@ -152,8 +222,9 @@ class ServerProxy(util.ServerProxy):
     def _marshalCall(self, method, request):
         start = time.time()
         rawRequest = request.toWire()
-        rawResponse = util.ServerProxy._request(self, method, rawRequest)
-        # XMLRPC responses are a 1-tuple
+        rawResponse = util.ServerProxy._request(self, method, rawRequest,
+                binary=request.version >= xmlshims.BINARY_RPC_VERSION)
+        # RPC responses are a 1-tuple
         rawResponse, = rawResponse
         response = self._responseFilter.fromWire(request.version, rawResponse,
                 self._transport.responseHeaders)
@@ -384,6 +455,8 @@ class NetworkRepositoryClient(xmlshims.NetworkConvertors,
                               repository.AbstractRepository,
                               trovesource.SearchableTroveSource):
     # Constants for changeset versions
+    FILE_CONTAINER_VERSION_OFFSET_IDX = \
+                            filecontainer.FILE_CONTAINER_VERSION_OFFSET_IDX
     FILE_CONTAINER_VERSION_FILEID_IDX = \
                             filecontainer.FILE_CONTAINER_VERSION_FILEID_IDX
     FILE_CONTAINER_VERSION_WITH_REMOVES = \
@@ -403,6 +476,13 @@ class NetworkRepositoryClient(xmlshims.NetworkConvertors,
         self.uploadRateLimit = cfg.uploadRateLimit
         self.c = ServerCache(cfg, pwPrompt)
         self.localRep = localRepository
+        # host -> semaphore limiting concurrent file contents downloads,
+        # server -> lock serializing the requests which set them up
+        self._hostSemaphores = {}
+        self._serverLocks = {}
+        self._hostSemaphoresLock = threading.Lock()
+        # per download thread settings of _getFileContentsParallel
+        self._streamLocal = threading.local()
 
         trovesource.SearchableTroveSource.__init__(self, searchableByType=True)
         self.searchAsRepository()
@@ -828,6 +908,12 @@ class NetworkRepositoryClient(xmlshims.NetworkConvertors,
             return self.c[serverName].listAccessGroups()
         return self.c[serverName].listRoles()
 
+    def getDatabasePoolStats(self, serverName):
+        if self.c[serverName].getProtocolVersion() < 75:
+            raise errors.InvalidServerVersion('getDatabasePoolStats requires '
+                    'Conary repository running 2.5.7 or newer')
+        return self.c[serverName].getDatabasePoolStats()
+
     def troveNames(self, label, troveTypes = TROVE_QUERY_PRESENT):
         if self.c[label].getProtocolVersion() < 60:
             return self.c[label].troveNames(self.fromLabel(label))
@@ -1347,8 +1433,12 @@ class NetworkRepositoryClient(xmlshims.NetworkConvertors,
     def createChangeSet(self, jobList, withFiles = True,
                         withFileContents = True,
                         excludeAutoSource = False, recurse = True,
-                        primaryTroveList = None, callback = None):
+                        primaryTroveList = None, callback = None,
+                        checkpointDir = None):
         """
+        @param checkpointDir: (optional) directory to keep partially
+            downloaded changesets in, so that a later call for the same
+            jobs resumes where this one failed.
         @raise RepositoryError: if a repository error occurred.
         """
         allJobs = [ (jobList, False) ]
@@ -1364,7 +1454,8 @@ class NetworkRepositoryClient(xmlshims.NetworkConvertors,
                                         recurse = recurse,
                                         primaryTroveList = primaryTroveList,
                                         callback = callback,
-                                        forceLocalGeneration = forceLocal)
+                                        forceLocalGeneration = forceLocal,
+                                        checkpointDir = checkpointDir)
 
                 if mergeTarget is None:
                     return cs
@@ -1411,7 +1502,9 @@ class NetworkRepositoryClient(xmlshims.NetworkConvertors,
             version from the server. The value is one of the C{FILE_CONTAINER_*}
             constants defined in the L{NetworkRepositoryClient} class. To map
             a protocol version into a changeset version, use
-            L{repository.changeset.getNativeChangesetVersion}.
+            L{repository.changeset.getNativeChangesetVersion}. Versions
+            servers do not send, like C{FILE_CONTAINER_VERSION_OFFSET_IDX},
+            are produced by rewriting the file locally.
         @raise FilesystemError: if the destination file is not writable
         @raise RepositoryError: if a repository error occurred.
         """
@@ -1429,7 +1522,8 @@ class NetworkRepositoryClient(xmlshims.NetworkConvertors,
                       withFileContents = True, target = None,
                       excludeAutoSource = False, primaryTroveList = None,
                       callback = None, forceLocalGeneration = False,
-                      changesetVersion = None, mirrorMode = False):
+                      changesetVersion = None, mirrorMode = False,
+                      checkpointDir = None):
         # This is a bit complicated due to servers not wanting to talk
         # to other servers. To make this work, we do this:
         #
@@ -1518,6 +1612,11 @@ class NetworkRepositoryClient(xmlshims.NetworkConvertors,
             kwargs = {}
             serverVersion = server.getProtocolVersion()
 
+            if changesetVersion in filecontainer.INDEXED_VERSIONS:
+                # servers never send these; the target gets rewritten in
+                # this version once everything has been downloaded
+                changesetVersion = None
+
             if mirrorMode and serverVersion >= 49:
                 if not changesetVersion:
                     changesetVersion = \
@@ -1527,22 +1626,41 @@ class NetworkRepositoryClient(xmlshims.NetworkConvertors,
             elif changesetVersion and serverVersion > 47:
                 args += (changesetVersion, )
 
-            # seek to the end of the file
-            outFile.seek(0, 2)
-            start = resume = outFile.tell()
+            checkpoint = None
+            if checkpointDir and not target and serverVersion >= 73:
+                # Download into a file which outlives this process, picking
+                # up whatever an earlier attempt left there
+                checkpoint = _DownloadCheckpoint(checkpointDir,
+                        server._serverName, args, self.cfg.downloadRetryTrim)
+                csFile = checkpoint.file
+                start = 0
+                resume = checkpoint.size
+            else:
+                csFile = outFile
+                # seek to the end of the file
+                outFile.seek(0, 2)
+                start = resume = outFile.tell()
             attempts = max(1, self.cfg.downloadAttempts)
             while attempts > 0:
                 if resume - start:
                     assert serverVersion >= 73
-                    outFile.seek(resume)
+                    csFile.seek(resume)
                     kwargs['resumeOffset'] = resume - start
                     if callback:
                         callback.warning("Changeset download was interrupted. "
                                 "Attempting to resume where it left off.")
+                else:
+                    kwargs.pop('resumeOffset', None)
                 try:
                     (sizes, extraTroveList, extraFileList, removedTroveList,
-                            extra,) = _getCsOnce(serverVersion, args, kwargs)
+                            extra,) = _getCsOnce(serverVersion, args, kwargs,
+                                    csFile, checkpoint)
                     break
+                except _StaleCheckpoint:
+                    # The changeset was regenerated since the checkpoint was
+                    # taken, so what we have is of no use
+                    checkpoint.reset()
+                    resume = start
                 except errors.TruncatedResponseError:
                     attempts -= 1
                     if not attempts or serverVersion < 73:
@@ -1550,19 +1668,34 @@ class NetworkRepositoryClient(xmlshims.NetworkConvertors,
                     # Figure out how many bytes were downloaded, then trim off
                     # a bit to ensure any garbage (e.g. a proxy error page) is
                     # discarded.
-                    keep = max(resume, outFile.tell() -
+                    keep = max(resume, csFile.tell() -
                             self.cfg.downloadRetryTrim)
                     if self.cfg.downloadRetryTrim and (
                             keep - resume > self.cfg.downloadRetryThreshold):
                         attempts = max(1, self.cfg.downloadAttempts)
                     resume = keep
 
+            if checkpoint is not None:
+                # Part of the file may have been written by an earlier
+                # process, so make sure it holds complete containers
+                offset = start
+                try:
+                    for size in sizes:
+                        filecontainer.FileContainer(util.SeekableNestedFile(
+                            csFile, size, offset)).verify()
+                        offset += size
+                except filecontainer.BadContainer, err:
+                    checkpoint.reset()
+                    raise errors.RepositoryError(
+                        "Downloaded changeset is corrupt: %s" % str(err))
+                checkpoint.done()
+
             chgSetList += self.toJobList(extraTroveList)
             filesNeeded.update(self.toFilesNeeded(extraFileList))
             removedList += self.toJobList(removedTroveList)
 
             for size in sizes:
-                f = util.SeekableNestedFile(outFile, size, start)
+                f = util.SeekableNestedFile(csFile, size, start)
                 try:
                     newCs = changeset.ChangeSetFromFile(f)
                 except IOError, err:
@@ -1577,7 +1710,7 @@ class NetworkRepositoryClient(xmlshims.NetworkConvertors,
             return (cs, self.toJobList(extraTroveList),
                     self.toFilesNeeded(extraFileList))
 
-        def _getCsOnce(serverVersion, args, kwargs):
+        def _getCsOnce(serverVersion, args, kwargs, outFile, checkpoint):
             l = server.getChangeSet(*args, **kwargs)
             extra = {}
             if serverVersion >= 50:
@@ -1601,6 +1734,8 @@ class NetworkRepositoryClient(xmlshims.NetworkConvertors,
             # later sends them as strings instead of ints due to the 2
             # GiB limitation
             sizes = [ int(x) for x in sizes ]
+            if checkpoint is not None:
+                checkpoint.checkSizes(sizes)
 
             if hasattr(url, 'read'):
                 # Nested changeset file in a multi-part response
@@ -2188,13 +2323,23 @@ class NetworkRepositoryClient(xmlshims.NetworkConvertors,
 
     def getFileContentsObjects(self, server, fileList, callback, outF,
                                compressed):
-        url, sizes = self.c[server].getFileContents(fileList)
+        # streams downloaded at once share the server proxy, whose
+        # transport remembers which proxy the last request went through
+        lock = self._getServerLock(server)
+        lock.acquire()
+        try:
+            url, sizes = self.c[server].getFileContents(fileList)
+            forceProxy = self.c[server].usedProxy()
+        finally:
+            lock.release()
         return self._getFileContentsObjects(server, url, sizes,
                                             fileList, callback, outF,
-                                            compressed)
+                                            compressed,
+                                            forceProxy = forceProxy)
 
     def _getFileContentsObjects(self, server, url, sizes,
-                                fileList, callback, outF, compressed):
+                                fileList, callback, outF, compressed,
+                                forceProxy = None):
         # protocol version 44 and later return sizes as strings rather
         # than ints to avoid 2 GiB limits
         sizes = [ int(x) for x in sizes ]
@@ -2202,10 +2347,8 @@ class NetworkRepositoryClient(xmlshims.NetworkConvertors,
 
         # "forceProxy" here makes sure that multi-part requests go back through
         # the same proxy on subsequent requests.
-        forceProxy = self.c[server].usedProxy()
-        headers = [('X-Conary-Servername', server)]
-        inF = transport.ConaryURLOpener(proxyMap = self.c.proxyMap).open(url,
-                forceProxy=forceProxy, headers=headers)
+        if forceProxy is None:
+            forceProxy = self.c[server].usedProxy()
 
         if callback:
             wrapper = callbacks.CallbackRateWrapper(
@@ -2214,6 +2357,23 @@ class NetworkRepositoryClient(xmlshims.NetworkConvertors,
         else:
             copyCallback = None
 
+        rateLimit = getattr(self._streamLocal, 'rateLimit',
+                            self.downloadRateLimit)
+        start = self._downloadFileContents(server, url, sizes, outF,
+                                           forceProxy, copyCallback,
+                                           rateLimit)
+        return self._splitFileContents(outF, start, sizes, compressed)
+
+    def _downloadFileContents(self, server, url, sizes, outF, forceProxy,
+                              copyCallback, rateLimit):
+        """
+        Append the multipart file contents stream at C{url} to C{outF},
+        returning the offset it starts at.
+        """
+        headers = [('X-Conary-Servername', server)]
+        inF = transport.ConaryURLOpener(proxyMap = self.c.proxyMap).open(url,
+                forceProxy=forceProxy, headers=headers)
+
         # make sure we append to the end (creating the gzip file
         # object does a certain amount of seeking through the
         # nested file object which we need to undo
@@ -2221,7 +2381,7 @@ class NetworkRepositoryClient(xmlshims.NetworkConvertors,
         start = outF.tell()
 
         totalSize = util.copyfileobj(inF, outF,
-                                     rateLimit = self.downloadRateLimit,
+                                     rateLimit = rateLimit,
                                      callback = copyCallback)
         if totalSize == None:
             raise errors.RepositoryError("Unknown error downloading changeset")
@@ -2232,6 +2392,11 @@ class NetworkRepositoryClient(xmlshims.NetworkConvertors,
         elif totalSize != sum(sizes):
             raise errors.TruncatedResponseError(sum(sizes), totalSize)
 
+        return start
+
+    @staticmethod
+    def _splitFileContents(outF, start, sizes, compressed):
+        totalSize = sum(sizes)
         fileObjList= []
         for size in sizes:
             nestedF = util.SeekableNestedFile(outF, size, start)
@@ -2252,6 +2417,151 @@ class NetworkRepositoryClient(xmlshims.NetworkConvertors,
 
         return fileObjList
 
+    def _getHostSemaphore(self, server):
+        """
+        Return the semaphore limiting concurrent downloads through the host
+        (the server itself, or the proxy in front of it) which contents from
+        C{server} are fetched from. Servers which are not reached over the
+        network get one download at a time.
+        """
+        url = getattr(self.c[server], '_url', None)
+        if url is None:
+            host = ('local', server)
+            limit = 1
+        else:
+            host = None
+            if url.scheme in ('http', 'https'):
+                for target in self.c.proxyMap.getProxyIter(url):
+                    if target != proxy_map.DirectConnection:
+                        host = str(target)
+                    break
+            if host is None:
+                host = str(url.hostport)
+            limit = max(1, self.cfg.downloadStreamsPerHost)
+
+        self._hostSemaphoresLock.acquire()
+        try:
+            sem = self._hostSemaphores.get(host)
+            if sem is None:
+                sem = threading.BoundedSemaphore(limit)
+                self._hostSemaphores[host] = sem
+            return sem
+        finally:
+            self._hostSemaphoresLock.release()
+
+    def _getServerLock(self, server):
+        self._hostSemaphoresLock.acquire()
+        try:
+            lock = self._serverLocks.get(server)
+            if lock is None:
+                lock = self._serverLocks[server] = threading.Lock()
+            return lock
+        finally:
+            self._hostSemaphoresLock.release()
+
+    def _splitFileContentsRequest(self, itemList, fileList):
+        """
+        Split the (index, (fileId, fileVersion)) requests for one server
+        into lists of roughly equal expected size, one per download stream.
+        Sizes are only known for items which carry a file object.
+        """
+        maxStreams = max(1, self.cfg.downloadStreamsPerHost)
+        streamSize = self.cfg.downloadStreamSize
+        if maxStreams == 1 or not streamSize or len(itemList) < 2:
+            return [ itemList ]
+
+        weights = []
+        for i, item in itemList:
+            fileObj = None
+            if len(fileList[i]) >= 3:
+                fileObj = fileList[i][2]
+            if fileObj is None or not getattr(fileObj, 'hasContents', False):
+                # unknown sizes can't be balanced
+                return [ itemList ]
+            weights.append(fileObj.contents.size())
+
+        total = sum(weights)
+        count = min(maxStreams, len(itemList),
+                    (total + streamSize - 1) // streamSize)
+        if count <= 1:
+            return [ itemList ]
+
+        # largest items first, each onto the least loaded stream; the
+        # original order is kept within each stream
+        loads = [ (0, x) for x in range(count) ]
+        assignments = [ [] for x in range(count) ]
+        for pos in sorted(range(len(itemList)), key = lambda x: -weights[x]):
+            load, stream = min(loads)
+            loads[stream] = (load + weights[pos], stream)
+            assignments[stream].append(pos)
+
+        return [ [ itemList[x] for x in sorted(positions) ]
+                 for positions in assignments if positions ]
+
+    def _getFileContentsParallel(self, streams, callback, outF, compressed):
+        """
+        Fetch several file contents streams at once, each through
+        L{getFileContentsObjects}, with at most downloadStreamsPerHost at a
+        time from any one host. C{streams} is a list of (server, fileList)
+        tuples; a list of file contents object lists is returned in the
+        same order. The first stream is stored in C{outF}, the others in
+        temporary files.
+        """
+        # server proxies are set up here rather than by the threads
+        semaphores = [ self._getHostSemaphore(x[0]) for x in streams ]
+
+        if callback:
+            progress = _StreamProgress(callback)
+        else:
+            progress = None
+
+        rateLimit = self.downloadRateLimit
+        if rateLimit:
+            # share the limit between the streams
+            rateLimit = max(1, rateLimit // len(streams))
+
+        results = [ None ] * len(streams)
+        excInfo = [ None ] * len(streams)
+
+        def _download(i):
+            server, fileList = streams[i]
+            semaphores[i].acquire()
+            try:
+                try:
+                    if i == 0:
+                        f = outF
+                    else:
+                        (fd, path) = util.mkstemp(suffix = 'filecontents')
+                        f = util.ExtendedFile(path, "r+", buffering = False)
+                        os.close(fd)
+                        os.unlink(path)
+                    if progress:
+                        streamCallback = progress.getCallback(i)
+                    else:
+                        streamCallback = None
+                    self._streamLocal.rateLimit = rateLimit
+                    results[i] = self.getFileContentsObjects(server,
+                                        fileList, streamCallback, f,
+                                        compressed)
+                except:
+                    excInfo[i] = sys.exc_info()
+            finally:
+                semaphores[i].release()
+
+        threads = []
+        for i in range(len(streams)):
+            thread = threading.Thread(target = _download, args = (i,))
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+
+        for info in excInfo:
+            if info is not None:
+                raise info[0], info[1], info[2]
+
+        return results
+
     # added at protocol version 67
     def getFileContentsFromTrove(self, name, version, flavor, pathList,
                                  callback = None, compressed = False):
@@ -2340,7 +2650,14 @@ class NetworkRepositoryClient(xmlshims.NetworkConvertors,
             os.close(fd)
             os.unlink(path)
 
+        streams = []
         for server, itemList in byServer.iteritems():
+            for streamItems in self._splitFileContentsRequest(itemList,
+                                                              fileList):
+                streams.append((server, streamItems))
+
+        requests = []
+        for server, itemList in streams:
             fileList = [ (self.fromFileId(x[1][0]),
                           self.fromVersion(x[1][1])) for x in itemList ]
             if callback:
@@ -2348,11 +2665,21 @@ class NetworkRepositoryClient(xmlshims.NetworkConvertors,
                     callback.requestingFileContentsWithCount(len(fileList))
                 else:
                     callback.requestingFileContents()
+            requests.append((server, fileList))
 
-            fileObjList = self.getFileContentsObjects(server, fileList,
-                                                      callback, outF,
-                                                      compressed)
+        if len(requests) == 1:
+            server, fileList = requests[0]
+            allObjLists = [ self.getFileContentsObjects(server, fileList,
+                                                        callback, outF,
+                                                        compressed) ]
+        else:
+            # streams from different hosts always run at once;
+            # downloadStreamsPerHost limits the ones to the same host
+            allObjLists = self._getFileContentsParallel(requests, callback,
+                                                        outF, compressed)
 
+        for (server, itemList), fileObjList in itertools.izip(streams,
+                                                              allObjLists):
             for (i, item), fObj in itertools.izip(itemList, fileObjList):
                 contents[i] = fObj
 
@@ -2436,6 +2763,12 @@ class NetworkRepositoryClient(xmlshims.NetworkConvertors,
     def commitChangeSetFile(self, fName, mirror = False, callback = None,
                             hidden = False):
         cs = changeset.ChangeSetFromFile(fName)
+        if [ x for x in cs.fileContainers
+                if x.version in filecontainer.INDEXED_VERSIONS ]:
+            # repositories don't accept offset-indexed containers, so send
+            # the changeset in the usual version
+            return self.commitChangeSet(cs, mirror = mirror,
+                                        callback = callback, hidden = hidden)
         return self._commit(cs, fName, mirror = mirror, callback = callback,
                             hidden = hidden)
 
@@ -2533,6 +2866,31 @@ class NetworkRepositoryClient(xmlshims.NetworkConvertors,
         return [ (m,t,trv_mod.TroveInfo(base64.b64decode(ti)))
                  for (m,t,ti) in info ]
 
+    def iterNewTroveInfo(self, host, mark, infoTypes=[], labels=[],
+                         thaw=True, pageSize=1000):
+        """
+        Like L{getNewTroveInfo}, but fetches the trove info C{pageSize}
+        troves at a time as the result is iterated over.
+        """
+        server = self.c[host]
+        if server.getProtocolVersion() < 75:
+            raise errors.InvalidServerVersion('iterNewTroveInfo requires '
+                    'Conary repository running 2.5.7 or newer')
+        if thaw:
+            labels = [ self.fromLabel(x) for x in labels ]
+
+        def _iter(instanceId):
+            while True:
+                info, instanceId = server.getNewTroveInfoPage(mark,
+                        infoTypes, labels, instanceId, pageSize)
+                for m, (n, v, f), ti in info:
+                    if thaw:
+                        ti = trv_mod.TroveInfo(base64.b64decode(ti))
+                    yield m, (n, self.toVersion(v), self.toFlavor(f)), ti
+                if len(info) < pageSize:
+                    break
+        return _iter(0)
+
     def setTroveInfo(self, info, freeze=True):
         # info is a set of ((name, version, flavor), troveInfo) tuples
         byServer = {}
@@ -2577,6 +2935,26 @@ class NetworkRepositoryClient(xmlshims.NetworkConvertors,
                    x[2]
                  ) for x in server.getNewTroveList(mark) ]
 
+    def iterNewTroveList(self, host, mark, pageSize=1000):
+        """
+        Like L{getNewTroveList}, but iterates over every trove changed at or
+        after C{mark}, fetching them C{pageSize} at a time in C{mark} order.
+        """
+        server = self.c[host]
+        if server.getProtocolVersion() < 75:
+            raise errors.InvalidServerVersion('iterNewTroveList requires '
+                    'Conary repository running 2.5.7 or newer')
+
+        def _iter(mark, instanceId):
+            while True:
+                page = server.getNewTroveListPage(mark, instanceId, pageSize)
+                for mark, (n, v, f), troveType, instanceId in page:
+                    yield (mark, (n, self.thawVersion(v), self.toFlavor(f)),
+                           troveType)
+                if len(page) < pageSize:
+                    break
+        return _iter(mark, 0)
+
     def addPGPKeyList(self, host, keyList):
         self.c[host].addPGPKeyList([ base64.encodestring(x) for x in keyList ])
 
@@ -2887,6 +3265,61 @@ class NetworkRepositoryClient(xmlshims.NetworkConvertors,
             server.setAbortCheck(None)
 
 
+class _StreamProgress(object):
+    """
+    Reports the combined progress of several concurrent file contents
+    downloads through a single callback object.
+    """
+
+    def __init__(self, callback):
+        self.callback = callback
+        self.lock = threading.Lock()
+        self.amounts = {}
+        self.totals = {}
+        self.rates = {}
+
+    def getCallback(self, stream):
+        return _StreamCallback(self, stream)
+
+    def setRate(self, stream, rate):
+        self.lock.acquire()
+        try:
+            self.rates[stream] = rate
+            self.callback.setRate(sum(self.rates.values()))
+        finally:
+            self.lock.release()
+
+    def downloading(self, stream, amount, total):
+        self.lock.acquire()
+        try:
+            self.amounts[stream] = amount
+            self.totals[stream] = total
+            self.callback.downloadingFileContents(sum(self.amounts.values()),
+                                                  sum(self.totals.values()))
+        finally:
+            self.lock.release()
+
+
+class _StreamCallback(object):
+    """
+    Callback for one of the streams of a L{_StreamProgress}; everything
+    other than the download progress goes straight to the real callback.
+    """
+
+    def __init__(self, progress, stream):
+        self._progress = progress
+        self._stream = stream
+
+    def setRate(self, rate):
+        self._progress.setRate(self._stream, rate)
+
+    def downloadingFileContents(self, amount, total):
+        self._progress.downloading(self._stream, amount, total)
+
+    def __getattr__(self, name):
+        return getattr(self._progress.callback, name)
+
+
 class FileResultSet(list):
     """
     Container for the result of a getFileVersions call. Behaves like a list of
@@ -213,7 +213,7 @@ class RoleTroves(RoleTable):
 # class and methods for handling RoleAllPermissions operations
 class RolePermissions(RoleTable):
 
-    def _filterItems(self, cu, sql, permissionId=None):
+    def _filterItems(self, cu, sql, permissionId=None, roleId=None):
         """
         Apply regexp permission checks, returning a SQL clause that filters a
         join between instances and permissions.
@@ -223,7 +223,8 @@ class RolePermissions(RoleTable):
         """
         cu.execute("SELECT DISTINCT itemId, item FROM Items"
                 " JOIN Permissions USING ( itemId )"
-                + self.getWhereArgs("WHERE", permissionId=permissionId))
+                + self.getWhereArgs("WHERE", permissionId=permissionId,
+                                    userGroupId=roleId))
         patterns = dict(cu)
 
         # The supplied query yields items that need to be checked against
@@ -245,35 +246,47 @@ class RolePermissions(RoleTable):
         else:
             return None
 
-    def addId(self, cu = None, permissionId = None, roleId = None, instanceId = None):
+    def addId(self, cu = None, permissionId = None, roleId = None,
+              instanceId = None, instanceRange = None,
+              table = "UserGroupAllPermissions"):
         """
         Adds into the RoleAllPermissions table new entries triggered by one or
-        more recordIds.
+        more recordIds. C{instanceRange} is a C{(start, end)} tuple which
+        limits the instances considered to C{start <= instanceId < end}.
+        The entries go into C{table} instead if it is given, which must
+        have the same columns.
         """
         if cu is None:
             cu = self.db.cursor()
-        itemClause = self._filterItems(cu, "SELECT DISTINCT itemId, item "
-                "FROM Instances JOIN Items USING (itemId)"
-                + self.getWhereArgs("WHERE", instanceId=instanceId),
-                permissionId=permissionId)
+        instanceCond = []
+        if instanceId is not None:
+            instanceCond.append("i.instanceId = %d" % instanceId)
+        if instanceRange is not None:
+            instanceCond.append("i.instanceId >= %d AND i.instanceId < %d"
+                                % instanceRange)
+        instanceWhere = ""
+        if instanceCond:
+            instanceWhere = " WHERE " + " AND ".join(instanceCond)
+        itemClause = self._filterItems(cu, "SELECT DISTINCT i.itemId, item "
+                "FROM Instances i JOIN Items USING (itemId)" + instanceWhere,
+                permissionId=permissionId, roleId=roleId)
         if not itemClause:
             # No items matched any permission
             return
+        cond = [ itemClause ] + instanceCond
+        if permissionId is not None:
+            cond.append("p.permissionId = %d" % permissionId)
+        if roleId is not None:
+            cond.append("p.userGroupId = %d" % roleId)
         cu.execute(
-        """INSERT INTO UserGroupAllPermissions
+        """INSERT INTO %s
                 (permissionId, userGroupId, instanceId, canWrite)
             SELECT p.permissionId, p.userGroupId, i.instanceId, p.canWrite
             FROM Instances i
             JOIN Nodes USING (itemId, versionId)
             JOIN LabelMap USING (itemId, branchId)
             JOIN Permissions p ON p.labelId = 0 OR p.labelId = LabelMap.labelId
-            WHERE %s%s""" % (
-                itemClause,
-                self.getWhereArgs(" AND",
-                    permissionId=permissionId,
-                    roleId=roleId,
-                    instanceId=instanceId,
-                    )))
+            WHERE %s""" % (table, " AND ".join(cond)))
 
     def addInstanceSet(self, cu, table, column):
         itemClause = self._filterItems(cu,
@@ -393,84 +406,162 @@ class RoleInstances(RoleTable):
         roleId = self._getRoleId(role)
         return self.rt.list(roleId)
 
-    # changes in the Permissions table
-    def addPermissionId(self, permissionId, roleId):
-        cu = self.db.cursor()
-        self.rp.addId(cu, permissionId = permissionId)
-        # figure out newly accessible troves. We keep track separately
-        # to speed up the Latest update
-        schema.resetTable(cu, "tmpInstances")
-        cu.execute("""
-        insert into tmpInstances(instanceId)
-        select instanceId from UserGroupAllPermissions as ugap
-        where permissionId = ?
-          and not exists (
-              select instanceId from UserGroupInstancesCache as ugi
-              where ugi.userGroupId = ?
-              and ugi.instanceId = ugap.instanceId ) """,
-                   (permissionId, roleId),
-                   start_transaction = False)
-        # update UsergroupInstancesCache
+    def _updateCache(self, cu, roleId):
+        """
+        Bring the UserGroupInstancesCache rows of roleId for the instances
+        in tmpInstances in line with UserGroupAllPermissions and
+        UserGroupAllTroves, which have to be up to date already. Only rows
+        which differ are written, and the LatestCache is only recomputed
+        for the instances roleId gained or lost access to.
+        """
+        self.db.analyze("tmpInstances")
         cu.execute("""
-        insert into UserGroupInstancesCache (userGroupId, instanceId, canWrite)
-        select userGroupId, instanceId,
-               case when sum(canWrite) = 0 then 0 else 1 end as canWrite
-        from UserGroupAllPermissions
-        where permissionId = ?
+        update UserGroupInstancesCache set canWrite = coalesce((
+            select max(canWrite) from UserGroupAllPermissions as ugap
+            where ugap.userGroupId = UserGroupInstancesCache.userGroupId
+              and ugap.instanceId = UserGroupInstancesCache.instanceId ), 0)
+        where userGroupId = :roleId
           and instanceId in (select instanceId from tmpInstances)
-        group by userGroupId, instanceId
-        """, permissionId)
-        # update Latest
-        self.latest.updateRoleId(cu, roleId, tmpInstances=True)
-
-    def updatePermissionId(self, permissionId, roleId):
-        cu = self.db.cursor()
-        schema.resetTable(cu, "tmpInstances")
-        # figure out how the access is changing
-        cu.execute("""
-        insert into tmpInstances(instanceId)
-        select instanceId from UserGroupAllPermissions
-        where permissionId = ? """, permissionId, start_transaction=False)
-        # re-add
-        self.rp.deleteId(cu, permissionId = permissionId)
-        self.rp.addId(cu, permissionId = permissionId)
-        # remove from consideration troves for which we still have access
+          and canWrite != coalesce((
+            select max(canWrite) from UserGroupAllPermissions as ugap
+            where ugap.userGroupId = UserGroupInstancesCache.userGroupId
+              and ugap.instanceId = UserGroupInstancesCache.instanceId ), 0)
+        """, roleId=roleId)
+        # drop the instances which stay visible or stay hidden
         cu.execute("""
         delete from tmpInstances
         where exists (
+            select 1 from UserGroupInstancesCache as ugi
+            where ugi.userGroupId = :roleId
+              and ugi.instanceId = tmpInstances.instanceId )
+        and ( exists (
             select 1 from UserGroupAllPermissions as ugap
             where ugap.userGroupId = :roleId
               and ugap.instanceId = tmpInstances.instanceId )
         or exists (
+            select 1 from UserGroupAllTroves as ugat
+            where ugat.userGroupId = :roleId
+              and ugat.instanceId = tmpInstances.instanceId ) )
+        """, roleId=roleId, start_transaction=False)
+        cu.execute("""
+        delete from tmpInstances
+        where not exists (
+            select 1 from UserGroupInstancesCache as ugi
+            where ugi.userGroupId = :roleId
+              and ugi.instanceId = tmpInstances.instanceId )
+        and not exists (
+            select 1 from UserGroupAllPermissions as ugap
+            where ugap.userGroupId = :roleId
+              and ugap.instanceId = tmpInstances.instanceId )
+        and not exists (
             select 1 from UserGroupAllTroves as ugat
             where ugat.userGroupId = :roleId
               and ugat.instanceId = tmpInstances.instanceId )
         """, roleId=roleId, start_transaction=False)
-        self.db.analyze("tmpInstances")
-        # remove trove access from troves that are left
+        cu.execute("select count(*) from tmpInstances")
+        if not cu.fetchone()[0]:
+            return
+        # what is left either gained access and has no UGIC row yet, or
+        # lost it and still has one
+        cu.execute("""
+        insert into UserGroupInstancesCache (userGroupId, instanceId, canWrite)
+        select %d, tmpInstances.instanceId, coalesce(max(ugap.canWrite), 0)
+        from tmpInstances
+        left join UserGroupAllPermissions as ugap on
+            ugap.userGroupId = %d and
+            ugap.instanceId = tmpInstances.instanceId
+        where not exists (
+            select 1 from UserGroupInstancesCache as ugi
+            where ugi.userGroupId = %d
+              and ugi.instanceId = tmpInstances.instanceId )
+        group by tmpInstances.instanceId
+        """ % (roleId, roleId, roleId))
         cu.execute("""
         delete from UserGroupInstancesCache
         where userGroupId = :roleId
           and instanceId in (select instanceId from tmpInstances)
+          and not exists (
+              select 1 from UserGroupAllPermissions as ugap
+              where ugap.userGroupId = :roleId
+                and ugap.instanceId = UserGroupInstancesCache.instanceId )
           and not exists (
               select 1 from UserGroupAllTroves as ugat
               where ugat.userGroupId = :roleId
                 and ugat.instanceId = UserGroupInstancesCache.instanceId )
         """, roleId=roleId)
-        # add the new troves now
+        # tmpInstances has instanceIds for which Latest needs to be recomputed
+        self.latest.updateRoleId(cu, roleId, tmpInstances=True)
+
+    # changes in the Permissions table
+    def addPermissionId(self, permissionId, roleId):
+        cu = self.db.cursor()
+        self.rp.addId(cu, permissionId = permissionId)
+        # everything the new permission grants is a candidate for a
+        # change in UserGroupInstancesCache
+        schema.resetTable(cu, "tmpInstances")
         cu.execute("""
-        insert into UserGroupInstancesCache(userGroupId, instanceId, canWrite)
-        select userGroupId, instanceId,
-               case when sum(canWrite) = 0 then 0 else 1 end as canWrite
-        from UserGroupAllPermissions as ugap
-        where ugap.permissionId = ?
+        insert into tmpInstances(instanceId)
+        select instanceId from UserGroupAllPermissions
+        where permissionId = ? """, permissionId, start_transaction = False)
+        self._updateCache(cu, roleId)
+
+    def updatePermissionId(self, permissionId, roleId):
+        cu = self.db.cursor()
+        # compute what the permission grants now and apply only the
+        # difference to what it granted before; on large repositories most
+        # of it stays the same
+        schema.resetTable(cu, "tmpUGAP")
+        self.rp.addId(cu, permissionId = permissionId, table = "tmpUGAP")
+        self.db.analyze("tmpUGAP")
+        schema.resetTable(cu, "tmpInstances")
+        # troves the permission no longer matches
+        cu.execute("""
+        insert into tmpInstances(instanceId)
+        select instanceId from UserGroupAllPermissions as ugap
+        where ugap.permissionId = :permissionId
           and not exists (
-              select 1 from UserGroupInstancesCache as ugi
-              where ugi.instanceId = ugap.instanceId
-                and ugi.userGroupId = ugap.userGroupId )
-        group by userGroupId, instanceId
+              select 1 from tmpUGAP
+              where tmpUGAP.permissionId = :permissionId
+                and tmpUGAP.instanceId = ugap.instanceId )
+        """, permissionId=permissionId, start_transaction=False)
+        cu.execute("""
+        delete from UserGroupAllPermissions
+        where permissionId = ?
+          and instanceId in (select instanceId from tmpInstances)
         """, permissionId)
-        self.latest.updateRoleId(cu, roleId)
+        # troves it matches now, but did not before
+        cu.execute("""
+        insert into tmpInstances(instanceId)
+        select instanceId from tmpUGAP
+        where not exists (
+            select 1 from UserGroupAllPermissions as ugap
+            where ugap.permissionId = :permissionId
+              and ugap.instanceId = tmpUGAP.instanceId )
+        """, permissionId=permissionId, start_transaction=False)
+        cu.execute("""
+        insert into UserGroupAllPermissions
+            (permissionId, userGroupId, instanceId, canWrite)
+        select permissionId, userGroupId, instanceId, canWrite
+        from tmpUGAP
+        where not exists (
+            select 1 from UserGroupAllPermissions as ugap
+            where ugap.permissionId = tmpUGAP.permissionId
+              and ugap.instanceId = tmpUGAP.instanceId )
+        """)
+        # the write flag may have changed along with the pattern or label
+        cu.execute("select canWrite from Permissions where permissionId = ?",
+                   permissionId)
+        canWrite = cu.fetchone()[0]
+        cu.execute("""
+        insert into tmpInstances(instanceId)
+        select instanceId from UserGroupAllPermissions
+        where permissionId = ? and canWrite != ?
+        """, (permissionId, canWrite), start_transaction=False)
+        cu.execute("""
+        update UserGroupAllPermissions set canWrite = ?
+        where permissionId = ? and canWrite != ?
+        """, (canWrite, permissionId, canWrite))
+        self._updateCache(cu, roleId)
         return True
 
     # updates the canWrite flag for an acl change
@@ -497,34 +588,16 @@ class RoleInstances(RoleTable):
 
     def deletePermissionId(self, permissionId, roleId):
         cu = self.db.cursor()
-        # compute the list of troves for which no other RAP/RAT access exists
+        # only the troves this permission matched can be affected
         schema.resetTable(cu, "tmpInstances")
         cu.execute("""
         insert into tmpInstances(instanceId)
-        select ugi.instanceId from UserGroupInstancesCache as ugi
-        where ugi.userGroupId = ?
-          and not exists (
-              select 1 from UserGroupAllPermissions as ugap
-              where ugap.userGroupId = ?
-                and ugap.instanceId = ugi.instanceId
-                and ugap.permissionId != ? )
-          and not exists (
-              select 1 from UserGroupAllTroves as ugat
-              where ugat.instanceId = ugi.instanceId
-                and ugat.userGroupId = ? )""",
-                   (roleId, roleId, permissionId, roleId),
-                   start_transaction = False)
+        select instanceId from UserGroupAllPermissions
+        where permissionId = ? """, permissionId, start_transaction = False)
         # clean up the flattened table
         cu.execute("delete from UserGroupAllPermissions where permissionId = ?",
                    permissionId)
-        # now we have only the troves which need to be erased out of UGIC
-        self.db.analyze("tmpInstances")
-        cu.execute("""
-        delete from UserGroupInstancesCache
-        where userGroupId = ?
-        and instanceId in (select instanceId from tmpInstances)""", roleId)
-        # update Latest
-        self.latest.updateRoleId(cu, roleId, tmpInstances=True)
+        self._updateCache(cu, roleId)
 
     # a new trove has been comitted to the system
     def addInstanceId(self, instanceId):
@@ -623,3 +696,96 @@ class RoleInstances(RoleTable):
         else: # this is a full rebuild
             self.latest.rebuild()
         return True
+
+    def _rebuildRange(self, cu, roleId, start, end):
+        # compare the flattened permissions for this slice of instances
+        # with what they should be, and rewrite the instances which differ
+        rangeCond = "instanceId >= %d and instanceId < %d" % (start, end)
+        schema.resetTable(cu, "tmpUGAP")
+        self.rp.addId(cu, roleId = roleId, instanceRange = (start, end),
+                      table = "tmpUGAP")
+        self.db.analyze("tmpUGAP")
+        schema.resetTable(cu, "tmpInstances")
+        cu.execute("""
+        insert into tmpInstances(instanceId)
+        select instanceId from tmpUGAP
+        where not exists (
+            select 1 from UserGroupAllPermissions as ugap
+            where ugap.permissionId = tmpUGAP.permissionId
+              and ugap.instanceId = tmpUGAP.instanceId
+              and ugap.canWrite = tmpUGAP.canWrite )
+        """, start_transaction=False)
+        cu.execute("""
+        insert into tmpInstances(instanceId)
+        select instanceId from UserGroupAllPermissions as ugap
+        where userGroupId = %d and %s
+          and not exists (
+              select 1 from tmpUGAP
+              where tmpUGAP.permissionId = ugap.permissionId
+                and tmpUGAP.instanceId = ugap.instanceId
+                and tmpUGAP.canWrite = ugap.canWrite )
+        """ % (roleId, rangeCond), start_transaction=False)
+        cu.execute("""
+        delete from UserGroupAllPermissions
+        where userGroupId = ?
+          and instanceId in (select instanceId from tmpInstances)
+        """, roleId)
+        cu.execute("""
+        insert into UserGroupAllPermissions
+            (permissionId, userGroupId, instanceId, canWrite)
+        select permissionId, userGroupId, instanceId, canWrite
+        from tmpUGAP
+        where instanceId in (select instanceId from tmpInstances)
+        """)
+        # and check every instance of the slice this role can or could see
+        schema.resetTable(cu, "tmpInstances")
+        cu.execute("""
+        insert into tmpInstances(instanceId)
+        select instanceId from UserGroupInstancesCache
+        where userGroupId = %(roleId)d and %(range)s
+        union
+        select instanceId from UserGroupAllPermissions
+        where userGroupId = %(roleId)d and %(range)s
+        union
+        select instanceId from UserGroupAllTroves
+        where userGroupId = %(roleId)d and %(range)s
+        """ % dict(roleId=roleId, range=rangeCond), start_transaction=False)
+        self._updateCache(cu, roleId)
+
+    def iterRebuild(self, start = None, batchSize = 50000):
+        """
+        Rebuild the UGIC table entries like L{rebuild}, but in small steps
+        which commit as they go, so the repository can stay online while
+        it runs. Rows which are right already are left alone.
+
+        Yields a C{(roleId, instanceId)} position after every step; passing
+        the last one as C{start} resumes an interrupted rebuild from there.
+        The LatestCache is only recomputed where access changes.
+        """
+        cu = self.db.cursor()
+        cu.execute("select max(instanceId) from Instances")
+        maxInstanceId = cu.fetchone()[0] or 0
+        cu.execute("select userGroupId from UserGroups order by userGroupId")
+        roleIds = [ x[0] for x in cu ]
+        startRoleId, startInstanceId = start or (None, None)
+        for roleId in roleIds:
+            if startRoleId is not None and roleId < startRoleId:
+                continue
+            if roleId == startRoleId:
+                first = startInstanceId
+            else:
+                first = 0
+            if first == 0:
+                # trove grants are few; redo them in one go
+                logMe(3, "rebuilding UserGroupAllTroves", "roleId=%s" % roleId)
+                cu = self.db.transaction()
+                self.rt.rebuild(cu, roleId = roleId)
+                self.db.commit()
+            for lo in xrange(first, maxInstanceId + 1, batchSize):
+                hi = lo + batchSize
+                logMe(3, "rebuilding UserGroupInstancesCache",
+                      "roleId=%s instanceIds=%d-%d" % (roleId, lo, hi))
+                cu = self.db.transaction()
+                self._rebuildRange(cu, roleId, lo, hi)
+                self.db.commit()
+                yield roleId, hi
@@ -15,6 +15,7 @@
 #
 
 
+import threading
 import time as pytime
 
 class EmptyCache(dict):
@@ -38,27 +39,117 @@ class EmptyCache(dict):
         return None
 
 
-class DumbCache(dict):
+# Rough per-entry overhead of the key, the list node and the dict slot
+ENTRY_OVERHEAD = 200
 
-    def __init__(self, limit = 2000):
-        dict.__init__(self)
-        self.limit = limit
 
-    def get(self, key, key_prefix = None):
-        key = (key_prefix, key)
-        val = dict.get(self, key, None)
-        if val is None:
-            return None
+def approximateSize(value):
+    """
+    Guess how many bytes C{value} occupies. Strings are counted by length
+    and containers are walked; anything else is charged a flat amount.
+    This only needs to be good enough to keep the cache near its budget.
+    """
+    if isinstance(value, basestring):
+        return len(value) + 40
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return 64 + 8 * len(value) + sum(approximateSize(x) for x in value)
+    if isinstance(value, dict):
+        return 280 + sum(approximateSize(k) + approximateSize(v)
+                         for k, v in value.iteritems())
+    return 24
 
-        (val, expires) = val
-        if expires is None:
-            return val
 
-        if pytime.time() > expires:
-            del self[key]
-            return None
+# Indexes into the entries of LRUCache's linked list
+_PREV, _NEXT, _KEY, _VALUE, _EXPIRES, _SIZE = range(6)
+
+
+class LRUCache(object):
+    """
+    In-process stand-in for memcached. Entries are kept in least recently
+    used order in a circular doubly linked list, so lookups, stores and
+    evictions are all O(1). The cache is bounded both by item count
+    (C{limit}) and by the approximate size of the stored values in bytes
+    (C{sizeLimit}); a limit of 0 disables that bound.
 
-        return val
+    Hit, miss and eviction counts are kept in C{hits}, C{misses},
+    C{evictions} and C{expirations}.
+    """
+
+    def __init__(self, limit = 2000, sizeLimit = 64 * 1024 * 1024):
+        self.limit = limit
+        self.sizeLimit = sizeLimit
+        self.lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        self.lock.acquire()
+        try:
+            self._map = {}
+            self._root = root = []
+            root[:] = [ root, root, None, None, None, 0 ]
+            self.size = 0
+            self.hits = self.misses = 0
+            self.evictions = self.expirations = 0
+        finally:
+            self.lock.release()
+
+    def __len__(self):
+        return len(self._map)
+
+    def __contains__(self, key):
+        return self._lookup((None, key), count = False) is not None
+
+    def stats(self):
+        return dict(items = len(self._map), bytes = self.size,
+                    hits = self.hits, misses = self.misses,
+                    evictions = self.evictions,
+                    expirations = self.expirations)
+
+    def _unlink(self, entry):
+        entry[_PREV][_NEXT] = entry[_NEXT]
+        entry[_NEXT][_PREV] = entry[_PREV]
+
+    def _linkFront(self, entry):
+        root = self._root
+        first = root[_NEXT]
+        entry[_PREV] = root
+        entry[_NEXT] = first
+        first[_PREV] = entry
+        root[_NEXT] = entry
+
+    def _remove(self, entry):
+        self._unlink(entry)
+        del self._map[entry[_KEY]]
+        self.size -= entry[_SIZE]
+
+    def _lookup(self, key, count = True):
+        self.lock.acquire()
+        try:
+            entry = self._map.get(key)
+            if entry is None:
+                if count:
+                    self.misses += 1
+                return None
+            if entry[_EXPIRES] is not None and \
+                    pytime.time() > entry[_EXPIRES]:
+                self._remove(entry)
+                if count:
+                    self.expirations += 1
+                    self.misses += 1
+                return None
+            if count:
+                self.hits += 1
+            self._unlink(entry)
+            self._linkFront(entry)
+            return entry
+        finally:
+            self.lock.release()
+
+    def get(self, key, key_prefix = None):
+        entry = self._lookup((key_prefix, key))
+        if entry is None:
+            return None
+        return entry[_VALUE]
 
     def get_multi(self, keys, key_prefix = None):
         r = {}
@@ -69,46 +160,84 @@ class DumbCache(dict):
 
         return r
 
+    def _store(self, key, value, expires):
+        size = approximateSize(value) + ENTRY_OVERHEAD
+        if self.sizeLimit and size > self.sizeLimit:
+            # would evict everything else and still not fit
+            self.delete(key[1], key_prefix = key[0])
+            return
+
+        self.lock.acquire()
+        try:
+            entry = self._map.get(key)
+            if entry is not None:
+                self._remove(entry)
+            entry = [ None, None, key, value, expires, size ]
+            self._linkFront(entry)
+            self._map[key] = entry
+            self.size += size
+            self._shrink()
+        finally:
+            self.lock.release()
+
     def set(self, key, value, time = 0, key_prefix = None):
-        key = (key_prefix, key)
         if time:
-            self[key] = (value, pytime.time() + time)
+            expires = pytime.time() + time
         else:
-            self[key] = (value, None)
-
-        if len(self) > self.limit:
-            self._shrink()
+            expires = None
+        self._store((key_prefix, key), value, expires)
 
     def set_multi(self, items, time = 0, key_prefix = None):
         for key, val in items.iteritems():
             self.set(key, val, time = time, key_prefix = key_prefix)
 
-    def _shrink(self):
-        order = sorted((x for x in self.items() if x[1][1] is not None),
-                       lambda a, b: cmp(b[1][1], a[1][1]))
-        toRemove = order[0:self.limit / 10]
-        if (len(self) - len(toRemove)) > (self.limit * 0.95):
-            toRemove += [ x for x in self.items() ][0:self.limit / 10]
+    def delete(self, key, key_prefix = None):
+        self.lock.acquire()
+        try:
+            entry = self._map.get((key_prefix, key))
+            if entry is not None:
+                self._remove(entry)
+        finally:
+            self.lock.release()
 
-        for x in toRemove:
-            del self[x[0]]
+    def _shrink(self):
+        # called with the lock held; evicts from the tail of the list
+        root = self._root
+        while (self.limit and len(self._map) > self.limit) or \
+                (self.sizeLimit and self.size > self.sizeLimit):
+            entry = root[_PREV]
+            if entry is root:
+                break
+            self._remove(entry)
+            self.evictions += 1
 
     def incr(self, key, delta=1):
-        val = self.get(key)
-        if val is None:
-            return None
+        self.lock.acquire()
         try:
-            val = long(val)
-        except ValueError:
-            return None
-        val = str(val + delta)
-        self.set(key, val)
-        return val
+            entry = self._lookup((None, key))
+            if entry is None:
+                return None
+            try:
+                val = long(entry[_VALUE])
+            except ValueError:
+                return None
+            val = str(val + delta)
+            # like memcached, the expiration time is left alone
+            self._store((None, key), val, entry[_EXPIRES])
+            return val
+        finally:
+            self.lock.release()
+
+
+# Older name for LRUCache
+DumbCache = LRUCache
 
 
-def getCache(url):
+def getCache(url, sizeLimit = None):
     if url is None:
-        return DumbCache()
+        if sizeLimit is None:
+            return LRUCache()
+        return LRUCache(sizeLimit = sizeLimit)
 
     import memcache
     return memcache.Client([ url ])
@@ -0,0 +1,292 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Persistent least-recently-used index for on-disk caches.
+
+The changeset and file contents caches used by the proxy store one file per
+cached item. This module keeps a small sqlite database next to those files
+which records the size and last access time of every item, so the caches can
+be held to a byte budget without walking the directory tree.
+"""
+
+import errno
+import fcntl
+import logging
+import os
+import threading
+import time
+
+from conary import dbstore
+from conary.dbstore import sqlerrors
+
+log = logging.getLogger(__name__)
+
+INDEX_NAME = 'cache-index.sqlite'
+
+# When the budget is exceeded, evict down to this fraction of it so pruning
+# does not run again on the very next write.
+LOW_WATER = 0.9
+
+# Access times are only rewritten when they are older than this many seconds;
+# this keeps very popular items from turning every hit into a write.
+TOUCH_GRANULARITY = 60
+
+# Temporary and lock files which live alongside cached items but are not
+# part of the cache proper.
+SKIP_SUFFIXES = ('.lck', '.new', '-new', '.tmp', '.partial')
+
+# Only one pruning thread runs per process at any time.
+_pruneLock = threading.Lock()
+
+
+class CacheIndex(object):
+    """
+    Tracks (path, size, atime) for every file stored in one or more cache
+    directories and evicts the least recently used files once their total
+    size exceeds C{sizeLimit} bytes.
+
+    Connections to the index are opened lazily, so constructing an instance
+    per request is cheap.
+    """
+
+    def __init__(self, indexPath, sizeLimit, topDirs=()):
+        self.indexPath = indexPath
+        self.sizeLimit = sizeLimit
+        self.topDirs = tuple(topDirs)
+        self._db = None
+
+    def _getDb(self):
+        if self._db is None:
+            db = dbstore.connect(self.indexPath, driver='sqlite')
+            db.loadSchema()
+            if 'CacheEntries' not in db.tables:
+                self._createSchema(db)
+            self._db = db
+        return self._db
+
+    def _createSchema(self, db):
+        cu = db.transaction()
+        try:
+            cu.execute("""
+                CREATE TABLE CacheEntries(
+                    path        %(PATHTYPE)s PRIMARY KEY,
+                    size        BIGINT NOT NULL,
+                    atime       INTEGER NOT NULL
+                )""" % db.keywords)
+            cu.execute("""
+                CREATE TABLE CacheTotals(
+                    total       BIGINT NOT NULL,
+                    needsScan   INTEGER NOT NULL
+                )""" % db.keywords)
+        except sqlerrors.CursorError:
+            # Another process created the schema first
+            db.rollback()
+            db.loadSchema()
+            return
+        cu.execute("INSERT INTO CacheTotals (total, needsScan) VALUES (0, 1)")
+        db.tables['CacheEntries'] = []
+        db.createIndex("CacheEntries", "CacheEntriesAtimeIdx", "atime")
+        db.commit()
+        db.loadSchema()
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def add(self, path, size=None):
+        """
+        Record that C{path} was written to the cache. If C{size} is not
+        given it is taken from the filesystem.
+        """
+        if size is None:
+            try:
+                size = os.stat(path).st_size
+            except OSError, e:
+                if e.errno != errno.ENOENT:
+                    raise
+                return
+        db = self._getDb()
+        cu = db.transaction()
+        cu.execute("SELECT size FROM CacheEntries WHERE path = ?", path)
+        row = cu.fetchone()
+        if row is None:
+            cu.execute("INSERT INTO CacheEntries (path, size, atime) "
+                    "VALUES (?, ?, ?)", path, size, int(time.time()))
+            delta = size
+        else:
+            cu.execute("UPDATE CacheEntries SET size = ?, atime = ? "
+                    "WHERE path = ?", size, int(time.time()), path)
+            delta = size - row[0]
+        cu.execute("UPDATE CacheTotals SET total = total + ?", delta)
+        db.commit()
+        self.maybePrune()
+
+    def touch(self, path):
+        """Record a cache hit on C{path}."""
+        now = int(time.time())
+        db = self._getDb()
+        cu = db.transaction()
+        cu.execute("UPDATE CacheEntries SET atime = ? "
+                "WHERE path = ? AND atime < ?",
+                now, path, now - TOUCH_GRANULARITY)
+        db.commit()
+
+    def remove(self, path):
+        """Forget about C{path}; the file itself is left alone."""
+        db = self._getDb()
+        cu = db.transaction()
+        self._removeEntry(cu, path)
+        db.commit()
+
+    def _removeEntry(self, cu, path):
+        cu.execute("SELECT size FROM CacheEntries WHERE path = ?", path)
+        row = cu.fetchone()
+        if row is None:
+            return 0
+        cu.execute("DELETE FROM CacheEntries WHERE path = ?", path)
+        cu.execute("UPDATE CacheTotals SET total = total - ?", row[0])
+        return row[0]
+
+    def totalSize(self):
+        cu = self._getDb().cursor()
+        cu.execute("SELECT total FROM CacheTotals")
+        return cu.fetchone()[0]
+
+    def _needsScan(self):
+        cu = self._getDb().cursor()
+        cu.execute("SELECT needsScan FROM CacheTotals")
+        return bool(cu.fetchone()[0])
+
+    def maybePrune(self):
+        """
+        Start a background eviction pass if the cache is over budget, or if
+        the index was just created and still has to learn about files that
+        were cached before it existed.
+        """
+        if not self.sizeLimit:
+            return
+        if not self._needsScan() and self.totalSize() <= self.sizeLimit:
+            return
+        if not _pruneLock.acquire(False):
+            # Already pruning in this process
+            return
+        try:
+            thread = threading.Thread(target=self._pruneThread,
+                    name='cache-prune')
+            thread.setDaemon(True)
+            thread.start()
+        except:
+            _pruneLock.release()
+            raise
+
+    def _pruneThread(self):
+        try:
+            # sqlite handles can not be shared between threads
+            index = self.__class__(self.indexPath, self.sizeLimit,
+                    self.topDirs)
+            try:
+                index.prune()
+            finally:
+                index.close()
+        except:
+            log.exception("Error pruning cache index %s", self.indexPath)
+        _pruneLock.release()
+
+    def prune(self):
+        """
+        Evict least recently used files until the cache is below the low
+        water mark. Returns the number of bytes freed.
+
+        A lock file next to the index keeps several processes sharing the
+        same cache from pruning at once.
+        """
+        lockFile = open(self.indexPath + '.prune-lock', 'w')
+        try:
+            try:
+                fcntl.lockf(lockFile.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError, e:
+                if e.errno not in (errno.EACCES, errno.EAGAIN):
+                    raise
+                return 0
+            if self._needsScan():
+                self.scan()
+            return self._evict()
+        finally:
+            lockFile.close()
+
+    def _evict(self):
+        target = int(self.sizeLimit * LOW_WATER)
+        db = self._getDb()
+        freed = 0
+        while True:
+            excess = self.totalSize() - target
+            if excess <= 0:
+                break
+            cu = db.cursor()
+            cu.execute("SELECT path, size FROM CacheEntries "
+                    "ORDER BY atime LIMIT 100")
+            victims = cu.fetchall()
+            if not victims:
+                break
+            cu = db.transaction()
+            for path, size in victims:
+                try:
+                    os.unlink(path)
+                except OSError, e:
+                    if e.errno != errno.ENOENT:
+                        raise
+                freed += self._removeEntry(cu, path)
+                excess -= size
+                if excess <= 0:
+                    break
+            db.commit()
+        return freed
+
+    def scan(self):
+        """
+        Import files already present in the cache directories. This walks
+        the directory tree, and so is only done once when a new index is
+        created for an existing cache.
+        """
+        now = int(time.time())
+        db = self._getDb()
+        cu = db.transaction()
+        for topDir in self.topDirs:
+            for dirPath, dirNames, fileNames in os.walk(topDir):
+                for name in fileNames:
+                    path = os.path.join(dirPath, name)
+                    if (path.startswith(self.indexPath)
+                            or name.endswith(SKIP_SUFFIXES)):
+                        continue
+                    try:
+                        sb = os.stat(path)
+                    except OSError, e:
+                        if e.errno != errno.ENOENT:
+                            raise
+                        continue
+                    cu.execute("SELECT COUNT(*) FROM CacheEntries "
+                            "WHERE path = ?", path)
+                    if cu.fetchone()[0]:
+                        continue
+                    cu.execute("INSERT INTO CacheEntries (path, size, atime) "
+                            "VALUES (?, ?, ?)", path, sb.st_size,
+                            min(int(sb.st_atime), now))
+                    cu.execute("UPDATE CacheTotals SET total = total + ?",
+                            sb.st_size)
+        cu.execute("UPDATE CacheTotals SET needsScan = 0")
+        db.commit()
@@ -0,0 +1,228 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Restores file contents from a changeset while it is still being uploaded.
+
+Committing a changeset normally waits for the whole upload before the
+contents are written to the repository's content store, and only then are
+the troves added to the database. ContentsSpooler sits between the upload
+and the temporary changeset file: every write is passed through to the file
+unchanged, and the file container is parsed on the fly so regular file
+contents can be stored while the rest of the upload is still arriving.
+
+The content store is addressed by sha1, and every file is checked against
+its sha1 before being renamed into place. Contents left behind by an upload
+which is never committed are therefore harmless; nothing refers to them.
+The commit itself is unchanged. It finds the contents already present,
+skips them, and adds the troves in a single transaction as before.
+"""
+
+import errno
+import logging
+import os
+import struct
+import tempfile
+import zlib
+
+from conary import files
+from conary.lib import digestlib
+from conary.repository import changeset
+from conary.repository import datastore
+from conary.repository import filecontainer
+
+log = logging.getLogger(__name__)
+
+# gzip framing for zlib
+_GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+# parser states
+_HEADER, _ENTRY, _NAME, _DATA, _DONE = range(5)
+
+
+class ContentsSpooler(object):
+    """
+    File-like object which writes an uploaded changeset to C{outF} and
+    restores its regular file contents into C{contentsStore} as they arrive.
+
+    Parsing problems never affect the upload. When the stream is not
+    understood (an unknown container version, a file larger than 4 GiB, a
+    content store spread across several directories), the remaining data is
+    only written to C{outF} and the commit restores the contents as usual.
+    """
+
+    def __init__(self, outF, contentsStore):
+        self.outF = outF
+        self.store = contentsStore
+        self.state = _HEADER
+        if not isinstance(contentsStore, datastore.DataStore):
+            self.state = _DONE
+        self.buf = ''
+        self.entry = None
+        self.need = 8
+        self.sha1s = None
+        self.csData = None
+        self.restored = 0
+
+    def write(self, data):
+        self.outF.write(data)
+        if self.state == _DONE:
+            return
+        try:
+            self._feed(data)
+        except Exception, e:
+            log.warning("unable to restore contents during upload: %s", e)
+            self._abortEntry()
+            self.state = _DONE
+
+    def close(self):
+        self._abortEntry()
+        self.state = _DONE
+        self.outF.close()
+
+    def _feed(self, data):
+        while data and self.state != _DONE:
+            if self.state == _DATA:
+                data = self._feedData(data)
+                continue
+
+            take = self.need - len(self.buf)
+            self.buf += data[:take]
+            data = data[take:]
+            if len(self.buf) < self.need:
+                return
+
+            buf, self.buf = self.buf, ''
+            if self.state == _HEADER:
+                self._parseHeader(buf)
+            elif self.state == _ENTRY:
+                self._parseEntry(buf)
+            elif self.state == _NAME:
+                self._parseName(buf)
+
+    def _parseHeader(self, buf):
+        version = struct.unpack("!I", buf[4:])[0]
+        if (buf[:4] != filecontainer.FILE_CONTAINER_MAGIC or
+                version not in filecontainer.READABLE_VERSIONS):
+            self.state = _DONE
+            return
+        self.state = _ENTRY
+        self.need = 10
+
+    def _parseEntry(self, buf):
+        magic, nameLen, size, tagLen = struct.unpack("!HHIH", buf)
+        if magic != filecontainer.SUBFILE_MAGIC:
+            # large files have their name after the data, and the offset
+            # index ends the container; either way we're done
+            self.state = _DONE
+            return
+        self.entry = dict(nameLen = nameLen, size = size)
+        self.state = _NAME
+        self.need = nameLen + tagLen
+
+    def _parseName(self, buf):
+        entry = self.entry
+        entry['name'] = buf[:entry['nameLen']]
+        entry['tag'] = buf[entry['nameLen']:]
+        entry['left'] = entry['size']
+        entry['out'] = None
+
+        if self.sha1s is None:
+            if entry['name'] != 'CONARYCHANGESET':
+                self.state = _DONE
+                return
+            self.csData = []
+        else:
+            self._startContents(entry)
+
+        self.state = _DATA
+
+    def _feedData(self, data):
+        entry = self.entry
+        chunk = data[:entry['left']]
+        entry['left'] -= len(chunk)
+
+        if self.csData is not None:
+            self.csData.append(chunk)
+        elif entry['out'] is not None:
+            os.write(entry['out'], chunk)
+            entry['sha1'].update(entry['decomp'].decompress(chunk))
+
+        if not entry['left']:
+            if self.csData is not None:
+                self._loadChangeSet()
+            elif entry['out'] is not None:
+                self._finishContents(entry)
+            self.entry = None
+            if self.state != _DONE:
+                self.state = _ENTRY
+                self.need = 10
+
+        return data[len(chunk):]
+
+    def _loadChangeSet(self):
+        data = zlib.decompress(''.join(self.csData), _GZIP_WBITS)
+        self.csData = None
+        cs = changeset.ChangeSet(data)
+
+        # same selection as ReadOnlyChangeSet.iterRegularFileContents
+        self.sha1s = {}
+        for (oldFileId, newFileId), stream in cs.files.iteritems():
+            if not files.frozenFileHasContents(stream):
+                continue
+            if files.frozenFileFlags(stream).isEncapsulatedContent():
+                continue
+            self.sha1s[newFileId] = \
+                    files.frozenFileContentInfo(stream).sha1()
+
+    def _startContents(self, entry):
+        if (len(entry['name']) != 36 or
+                entry['tag'] != '0 ' + changeset.ChangedFileTypes.file[4:]):
+            return
+        sha1 = self.sha1s.get(entry['name'][16:])
+        if sha1 is None or self.store.hasFile(sha1):
+            return
+
+        path = self.store.hashToPath(sha1)
+        self.store.makeDir(path)
+        fd, tmpPath = tempfile.mkstemp(suffix = '.new',
+                                       dir = os.path.dirname(path))
+        self.store._fchmod(fd)
+        entry.update(out = fd, path = path, tmpPath = tmpPath,
+                     expected = sha1, sha1 = digestlib.sha1(),
+                     decomp = zlib.decompressobj(_GZIP_WBITS))
+
+    def _finishContents(self, entry):
+        os.close(entry['out'])
+        entry['out'] = None
+        entry['sha1'].update(entry['decomp'].flush())
+        if entry['sha1'].digest() != entry['expected']:
+            # the commit will complain about this
+            os.unlink(entry['tmpPath'])
+            return
+        os.rename(entry['tmpPath'], entry['path'])
+        self.restored += 1
+
+    def _abortEntry(self):
+        entry = self.entry
+        self.entry = None
+        if entry and entry.get('out') is not None:
+            os.close(entry['out'])
+            try:
+                os.unlink(entry['tmpPath'])
+            except OSError, e:
+                if e.errno != errno.ENOENT:
+                    raise
@@ -117,3 +117,41 @@ def expandJobList(db, chgSetList, recurse):
         newJobList[idx] = None
 
     return newJobList
+
+def changeStamps(db, troveList):
+    """
+    Return a list parallel to troveList giving, for each (name, version,
+    flavor) tuple, a string which changes whenever the trove's instance or
+    any of its trove info is modified. Troves which are not in the
+    repository get an empty string.
+    """
+    stamps = [ '' ] * len(troveList)
+    if not troveList:
+        return stamps
+
+    cu = db.cursor()
+    schema.resetTable(cu, "tmpNVF")
+    db.bulkload("tmpNvf", [ (idx, ) + tuple(x)
+                            for idx, x in enumerate(troveList) ],
+                [ "idx", "name", "version", "flavor" ],
+                start_transaction = False)
+    db.analyze("tmpNVF")
+
+    cu.execute("""SELECT
+            tmpNVF.idx, Instances.changed, MAX(TroveInfo.changed)
+        FROM tmpNVF JOIN Items ON tmpNVF.name = Items.item
+        JOIN Versions ON (tmpNVF.version = Versions.version)
+        JOIN Flavors ON (tmpNVF.flavor = Flavors.flavor)
+        JOIN Instances ON
+            Items.itemId = Instances.itemId AND
+            Versions.versionId = Instances.versionId AND
+            Flavors.flavorId = Instances.flavorId
+        LEFT OUTER JOIN TroveInfo ON
+            Instances.instanceId = TroveInfo.instanceId
+        GROUP BY tmpNVF.idx, Instances.changed
+    """)
+
+    for (idx, instanceChanged, infoChanged) in cu:
+        stamps[idx] = "%d-%d" % (instanceChanged or 0, infoChanged or 0)
+
+    return stamps
@@ -0,0 +1,273 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Single writer, many reader access to cache files which are still being
+written.
+
+Only one thread in one process at a time gets a L{CacheWriter} for a given
+cache path. It writes to C{path + PARTIAL_SUFFIX} and renames that into
+place when it is done. Everybody else who wants the same item opens a
+L{GrowingFile}, which reads the partial file as it fills up instead of
+waiting for the rename or fetching the item a second time.
+
+Writers hold an exclusive lock on C{path + '.lck'} so other processes can
+tell whether a partial file is still being worked on. POSIX locks belong to
+the process and are dropped when any descriptor for the file is closed, so
+every lock file access in a process goes through this module and is
+serialized with the writers of that process.
+"""
+
+import errno
+import fcntl
+import os
+import threading
+import time
+
+from conary.lib import util
+
+PARTIAL_SUFFIX = '.partial'
+
+# How often readers look for more data
+POLL_INTERVAL = 0.05
+# How often readers make sure the writer is still there while no data arrives
+LIVENESS_INTERVAL = 1.0
+
+# Protects _writers and every lock file operation in this process
+_lock = threading.Lock()
+# Paths which have a writer in this process
+_writers = set()
+
+
+def _writerAlive(path):
+    """Return True if some thread or process holds the writer for C{path}."""
+    _lock.acquire()
+    try:
+        if path in _writers:
+            return True
+        try:
+            lockF = open(path + '.lck', 'r')
+        except IOError, e:
+            if e.errno != errno.ENOENT:
+                raise
+            return False
+        try:
+            try:
+                fcntl.lockf(lockF, fcntl.LOCK_SH | fcntl.LOCK_NB)
+            except IOError, e:
+                if e.errno not in (errno.EACCES, errno.EAGAIN):
+                    raise
+                return True
+            return False
+        finally:
+            lockF.close()
+    finally:
+        _lock.release()
+
+
+class CacheWriter(object):
+    """
+    Exclusive writer for the cache file at C{path}. Behaves like
+    L{util.AtomicFile}: data only appears at C{path} once C{commit()} is
+    called, and C{close()} without a commit throws it away.
+    """
+
+    def __init__(self, path, lockF):
+        self.path = path
+        self.partialPath = path + PARTIAL_SUFFIX
+        self._lockF = lockF
+        # Leftovers from a writer which died; readers which still have it
+        # open notice that nobody is writing it any more
+        util.removeIfExists(self.partialPath)
+        self.fObj = open(self.partialPath, 'w+b')
+
+    @classmethod
+    def acquire(cls, path):
+        """
+        Return a writer for C{path}, or None if another thread or process
+        is already writing it or it already exists.
+        """
+        _lock.acquire()
+        try:
+            if path in _writers:
+                return None
+            lockPath = path + '.lck'
+            lockF = open(lockPath, 'w')
+            try:
+                fcntl.lockf(lockF, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError, e:
+                lockF.close()
+                if e.errno not in (errno.EACCES, errno.EAGAIN):
+                    raise
+                return None
+            try:
+                lockSb = os.stat(lockPath)
+            except OSError, e:
+                if e.errno != errno.ENOENT:
+                    raise
+                lockSb = None
+            if (lockSb is None or
+                    lockSb.st_ino != os.fstat(lockF.fileno()).st_ino or
+                    os.path.exists(path)):
+                # Either the previous writer finished and removed the lock
+                # file after we opened it, or the file is complete already
+                lockF.close()
+                return None
+            try:
+                writer = cls(path, lockF)
+            except:
+                lockF.close()
+                raise
+            _writers.add(path)
+            return writer
+        finally:
+            _lock.release()
+
+    def __getattr__(self, name):
+        return getattr(self.fObj, name)
+
+    def commit(self):
+        self.fObj.flush()
+        os.chmod(self.partialPath, 0644)
+        os.fsync(self.fObj.fileno())
+        # Rename before unlocking so readers never see the writer gone
+        # without the complete file in place
+        os.rename(self.partialPath, self.path)
+        self.fObj.close()
+        self._release()
+
+    def close(self):
+        """Abandon the file unless it was committed."""
+        if self.fObj.closed:
+            return
+        self.fObj.close()
+        util.removeIfExists(self.partialPath)
+        self._release()
+
+    def _release(self):
+        _lock.acquire()
+        try:
+            util.removeIfExists(self.path + '.lck')
+            self._lockF.close()
+            _writers.discard(self.path)
+        finally:
+            _lock.release()
+
+
+class GrowingFile(object):
+    """
+    Read-only file object for the cache file at C{path}, starting C{start}
+    bytes in, which may still be being written by a L{CacheWriter}. Reads
+    past what has been written so far wait for more data. If the writer
+    gives up, they raise C{IOError}.
+
+    Only C{read}, C{pread}, C{seek} and C{tell} are provided. There is
+    deliberately no C{fileno}, so callers do not bypass the waiting.
+    """
+
+    def __init__(self, path, start=0):
+        self.path = path
+        self.partialPath = path + PARTIAL_SUFFIX
+        self.start = start
+        self.pos = 0
+        self.complete = False
+        self.file = None
+        for name in (self.partialPath, path):
+            try:
+                self.file = util.ExtendedFile(name, 'rb', buffering=False)
+            except IOError, e:
+                if e.errno != errno.ENOENT:
+                    raise
+                continue
+            self.complete = (name == path)
+            break
+        else:
+            raise IOError(errno.ENOENT, "No such file or directory", path)
+        self._ino = os.fstat(self.file.fileno()).st_ino
+
+    @classmethod
+    def open(cls, path, start=0):
+        """Like the constructor, but returns None if nothing is there yet."""
+        try:
+            return cls(path, start)
+        except IOError, e:
+            if e.errno != errno.ENOENT:
+                raise
+            return None
+
+    def _isComplete(self):
+        if not self.complete:
+            try:
+                self.complete = os.stat(self.path).st_ino == self._ino
+            except OSError, e:
+                if e.errno != errno.ENOENT:
+                    raise
+        return self.complete
+
+    def _size(self):
+        return os.fstat(self.file.fileno()).st_size - self.start
+
+    def _waitFor(self, end):
+        """
+        Wait until C{end} bytes are available (all of them if C{end} is
+        None) or the file is complete.
+        """
+        lastCheck = time.time()
+        while not self._isComplete() and (end is None or self._size() < end):
+            now = time.time()
+            if now - lastCheck >= LIVENESS_INTERVAL:
+                lastCheck = now
+                # check completion again; the writer renames the file into
+                # place before it lets go of the lock
+                if not _writerAlive(self.path) and not self._isComplete():
+                    raise IOError(errno.EIO,
+                            "Cache file was abandoned by its writer",
+                            self.path)
+            time.sleep(POLL_INTERVAL)
+
+    def waitForCompletion(self):
+        self._waitFor(None)
+
+    def pread(self, size, offset):
+        self._waitFor(offset + size)
+        return self.file.pread(size, self.start + offset)
+
+    def read(self, size=-1):
+        if size < 0:
+            self.waitForCompletion()
+            size = self._size() - self.pos
+        data = self.pread(size, self.pos)
+        self.pos += len(data)
+        return data
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self.pos
+        elif whence == 2:
+            # The end of a growing file is wherever the writer has got to,
+            # but an empty file would look like a new one
+            self._waitFor(1)
+            offset += self._size()
+        self.pos = offset
+        return self.pos
+
+    def tell(self):
+        return self.pos
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
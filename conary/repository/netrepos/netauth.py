@@ -28,7 +28,7 @@ from conary.repository import errors
 from conary.lib import digestlib, sha1helper, tracelog
 from conary.dbstore import sqlerrors
 from conary.server.schema import resetTable
-from . import items, accessmap, geoip
+from . import items, accessmap, cache, geoip
 from .auth_tokens import AuthToken, ValidUser, ValidPasswordToken
 
 log = logging.getLogger(__name__)
@@ -38,6 +38,17 @@ MAX_ENTITLEMENT_LENGTH = 255
 
 nameCharacterSet = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789._-\\@'
 
+# NetworkAuthorization objects usually live for a single request, so the
+# roles computed for a set of credentials are kept in caches shared by all
+# of them, one per cache location
+_roleCaches = {}
+
+def _getRoleCache(location):
+    roleCache = _roleCaches.get(location)
+    if roleCache is None:
+        roleCache = _roleCaches[location] = cache.getCache(location)
+    return roleCache
+
 class UserAuthorization:
 
     pwCache = {}
@@ -313,11 +324,17 @@ class EntitlementAuthorization:
 
 class NetworkAuthorization:
     def __init__(self, db, serverNameList, cacheTimeout = None, log = None,
-            passwordURL=None, entCheckURL=None, geoIpFiles=None):
+            passwordURL=None, entCheckURL=None, geoIpFiles=None,
+            cacheLocation=None, cachePrefix=None):
         """
         @param cacheTimeout: Timeout, in seconds, for authorization cache
         entries. If None, no cache is used.
         @type cacheTimeout: int
+        @param cacheLocation: memcached server holding the roles granted to
+        each set of credentials, shared by all repository processes. If
+        None, they are cached in this process only.
+        @param cachePrefix: Prepended to the names of the entries in
+        C{cacheLocation}.
         @param passwordURL: URL base to use for an http get request to
         externally validate user passwords. When this is specified, the
         passwords int the local database are ignored, and the changePassword()
@@ -335,16 +352,78 @@ class NetworkAuthorization:
         self.items = items.Items(db)
         self.ri = accessmap.RoleInstances(db)
         self.geoIp = geoip.GeoIPLookup(geoIpFiles or [])
+        self.cacheTimeout = cacheTimeout
+        self.passwordURL = passwordURL
+        self.entCheckURL = entCheckURL
+        if cacheTimeout:
+            self.roleCache = _getRoleCache(cacheLocation)
+        else:
+            self.roleCache = cache.EmptyCache()
+        self._roleCacheName = 'authroles:' + sha1helper.sha1ToString(
+                sha1helper.sha1String(str((cachePrefix, serverNameList,
+                    getattr(db, 'database', None)))))
+
+    def _getRoleGenerationKey(self):
+        return self._roleCacheName + ':generation'
+
+    def _getRoleGeneration(self):
+        # Cached roles are filed under a generation number which is bumped
+        # whenever users, roles or entitlements change (see
+        # invalidateRoleCache). A lost generation number restarts from the
+        # clock so older entries are not brought back to life.
+        name = self._getRoleGenerationKey()
+        generation = self.roleCache.get(name)
+        if generation is None:
+            generation = str(int(time.time()))
+            self.roleCache.set(name, generation)
+        return generation
+
+    def invalidateRoleCache(self):
+        """
+        Forget the roles cached for all credentials. Must be called after
+        committing any change to users, roles or entitlements.
+        """
+        if not self.cacheTimeout:
+            return
+        name = self._getRoleGenerationKey()
+        if not self.roleCache.incr(name, 1):
+            self.roleCache.set(name, str(int(time.time())))
 
-    def getAuthRoles(self, cu, authToken, allowAnonymous = True):
-        """Return the set of roleIds that the caller has access to.
-
-        If any role has an "accept flag" set that the auth token does not
-        satisfy, InsufficientPermission will be raised immediately.
+    def _getRoleCacheKey(self, authToken, allowAnonymous):
         """
-        self.log(4, authToken[0], authToken[2])
-        if not isinstance(authToken, AuthToken):
-            authToken = AuthToken(*authToken)
+        Return the key the roles for C{authToken} are cached under, or None
+        if they cannot be cached.
+        """
+        if not self.cacheTimeout:
+            return None
+        if (isinstance(authToken.user, ValidUser)
+                or authToken.password is ValidPasswordToken):
+            return None
+        if self.passwordURL:
+            # a failed password check may just mean the server behind it
+            # could not be reached
+            return None
+        if self.entCheckURL and authToken.entitlements:
+            # the entitlement lookup has timeouts and retries of its own
+            return None
+        # never put passwords or entitlements in the cache in the clear
+        return sha1helper.sha1ToString(sha1helper.sha1String(str((
+            authToken.user, str(authToken.password),
+            sorted(authToken.entitlements), bool(allowAnonymous)))))
+
+    def _getAuthorizedRoles(self, cu, authToken, allowAnonymous):
+        """
+        Return a dictionary mapping the roleIds C{authToken} is authorized
+        for to their accept flags.
+        """
+        key = self._getRoleCacheKey(authToken, allowAnonymous)
+        if key is not None:
+            keyPrefix = self._roleCacheName + ':' + self._getRoleGeneration()
+            cached = self.roleCache.get_multi([ key ],
+                    key_prefix = keyPrefix).get(key)
+            if cached is not None:
+                return dict((roleId, deps.ThawFlavor(flags))
+                            for roleId, flags in cached)
 
         roleSet = self.userAuth.getAuthorizedRoles(
             cu, authToken.user, authToken.password,
@@ -369,6 +448,25 @@ class NetworkAuthorization:
         if timedOut:
             raise errors.EntitlementTimeout(timedOut)
 
+        if key is not None:
+            self.roleCache.set_multi({ key : tuple(
+                        (roleId, flags.freeze())
+                        for roleId, flags in roleSet.iteritems()) },
+                    time = self.cacheTimeout, key_prefix = keyPrefix)
+        return roleSet
+
+    def getAuthRoles(self, cu, authToken, allowAnonymous = True):
+        """Return the set of roleIds that the caller has access to.
+
+        If any role has an "accept flag" set that the auth token does not
+        satisfy, InsufficientPermission will be raised immediately.
+        """
+        self.log(4, authToken[0], authToken[2])
+        if not isinstance(authToken, AuthToken):
+            authToken = AuthToken(*authToken)
+
+        roleSet = self._getAuthorizedRoles(cu, authToken, allowAnonymous)
+
         for roleId, acceptFlags in roleSet.items():
             if authToken.flags is None:
                 authToken.flags = self._getFlags(authToken)
@@ -757,6 +855,7 @@ class NetworkAuthorization:
         for role in roleList:
             self.addRoleMember(role, userName, commit = False)
         self.db.commit()
+        self.invalidateRoleCache()
 
     def setMirror(self, role, canMirror):
         self.log(3, role, canMirror)
@@ -764,6 +863,7 @@ class NetworkAuthorization:
         cu.execute("UPDATE userGroups SET canMirror=? WHERE userGroup=?",
                    (int(bool(canMirror)), role))
         self.db.commit()
+        self.invalidateRoleCache()
 
     def _checkValidName(self, name):
         for letter in name:
@@ -781,6 +881,7 @@ class NetworkAuthorization:
             raise
         else:
             self.db.commit()
+            self.invalidateRoleCache()
         return uid
 
     def deleteUserByName(self, user, deleteRole=True):
@@ -818,6 +919,7 @@ class NetworkAuthorization:
                     pass
         self.userAuth.deleteUser(cu, user)
         self.db.commit()
+        self.invalidateRoleCache()
 
     def changePassword(self, user, newPassword):
         self.log(3, user)
@@ -829,6 +931,7 @@ class NetworkAuthorization:
         cu = self.db.cursor()
         self.userAuth.changePassword(cu, user, salt, m.hexdigest())
         self.db.commit()
+        self.invalidateRoleCache()
 
     def getRoles(self, user):
         cu = self.db.cursor()
@@ -943,6 +1046,7 @@ class NetworkAuthorization:
         for userName in members:
             self.addRoleMember(role, userName, commit=False)
         self.db.commit()
+        self.invalidateRoleCache()
 
     def addRoleMember(self, role, userName, commit = True):
         cu = self.db.cursor()
@@ -956,6 +1060,7 @@ class NetworkAuthorization:
 
         if commit:
             self.db.commit()
+            self.invalidateRoleCache()
 
     def deleteRole(self, role, commit = True):
         self.deleteRoleById(self._getRoleIdByName(role), commit)
@@ -977,6 +1082,7 @@ class NetworkAuthorization:
         cu.execute("DELETE FROM UserGroups WHERE userGroupId=?", roleId)
         if commit:
             self.db.commit()
+            self.invalidateRoleCache()
 
     def getItemList(self):
         cu = self.db.cursor()
@@ -1051,6 +1157,7 @@ class NetworkAuthorization:
         cu.execute("DELETE FROM EntitlementGroups WHERE entGroupId=?",
                    entClassId)
         self.db.commit()
+        self.invalidateRoleCache()
 
     def addEntitlementKey(self, authToken, entClass, entKey):
         cu = self.db.cursor()
@@ -1077,6 +1184,7 @@ class NetworkAuthorization:
                    (entClassId, entKey))
 
         self.db.commit()
+        self.invalidateRoleCache()
 
     def deleteEntitlementKey(self, authToken, entClass, entKey):
         cu = self.db.cursor()
@@ -1100,6 +1208,7 @@ class NetworkAuthorization:
                    "entitlement=?", (entClassId, entKey))
 
         self.db.commit()
+        self.invalidateRoleCache()
 
     def addEntitlementClass(self, authToken, entClass, role):
         """
@@ -1125,6 +1234,7 @@ class NetworkAuthorization:
         cu.execute("INSERT INTO EntitlementAccessMap (entGroupId, userGroupId) "
                    "VALUES (?, ?)", entClassId, roleId)
         self.db.commit()
+        self.invalidateRoleCache()
 
     def getEntitlementClassOwner(self, authToken, entClass):
         """
@@ -1284,6 +1394,7 @@ class NetworkAuthorization:
                            entClassMap[entClass], roleMap[role])
 
         self.db.commit()
+        self.invalidateRoleCache()
 
     def getRoleFilters(self, roles):
         cu = self.db.cursor()
@@ -1308,6 +1419,7 @@ class NetworkAuthorization:
             cu.execute("""UPDATE UserGroups SET accept_flags = ?,
                     filter_flags = ? WHERE userGroup = ?""", args)
         self.db.commit()
+        self.invalidateRoleCache()
 
 
 class PasswordCheckParser(dict):
@@ -32,7 +32,7 @@ from conary.deps import deps
 from conary.lib import log, tracelog, sha1helper, util
 from conary.lib.cfg import ConfigFile
 from conary.lib.cfgtypes import (CfgInt, CfgString, CfgPath, CfgBool, CfgList,
-        CfgLineList)
+        CfgLineList, CfgBytes)
 from conary.repository import changeset, errors, xmlshims
 from conary.repository.netrepos import fsrepos, instances, trovestore
 from conary.repository.netrepos import accessmap, deptable, fingerprints
@@ -52,7 +52,10 @@ from conary.errors import InvalidRegex
 # one in the list is the lowest protocol version we support and th
 # last one is the current server protocol version. Remember that range stops
 # at MAX - 1
-SERVER_VERSIONS = range(36, 73 + 1)
+SERVER_VERSIONS = range(36, 75 + 1)
+
+# Most troves returned by one call of the paged mirroring calls
+MAX_PAGE_SIZE = 5000
 
 # We need to provide transitions from VALUE to KEY, we cache them as we go
 
@@ -135,8 +138,15 @@ class NetworkRepositoryServer(xmlshims.NetworkConvertors):
         self.requireSigs = cfg.requireSigs
         self.deadlockRetry = cfg.deadlockRetry
         self.repDB = cfg.repositoryDB
+        self.dbPool = None
+        if cfg.repositoryDBPoolSize and self.repDB:
+            self.dbPool = dbstore.getPool(self.repDB[1], driver = self.repDB[0],
+                                          maxIdle = cfg.repositoryDBPoolSize)
         self.contentsDir = cfg.contentsDir
         self.authCacheTimeout = cfg.authCacheTimeout
+        self.memCacheLocation = cfg.memCache
+        self.memCachePrefix = cfg.memCachePrefix
+        self.troveCacheSize = cfg.troveCacheSize
         self.externalPasswordURL = cfg.externalPasswordURL
         self.entitlementCheckURL = cfg.entitlementCheckURL
         self.readOnlyRepository = cfg.readOnlyRepository
@@ -150,6 +160,7 @@ class NetworkRepositoryServer(xmlshims.NetworkConvertors):
                         "implemented (%s)" % (key,))
 
         self.__delDB = False
+        self.__pooledDB = False
         self.log = tracelog.getLog(None)
         if cfg.traceLog:
             (l, f) = cfg.traceLog
@@ -174,20 +185,34 @@ class NetworkRepositoryServer(xmlshims.NetworkConvertors):
         self.repos.troveStore = None
         self.auth = self.ugo = None
         try:
-            if self.__delDB: self.db.close()
+            if self.__pooledDB:
+                self.dbPool.checkin(self.db)
+            elif self.__delDB:
+                self.db.close()
         except:
             pass
         self.troveStore = self.repos = self.deptable = self.db = None
 
     def open(self, connect = True):
         self.log(3, "connect=", connect)
-        if connect:
+        if connect and self.dbPool:
+            self.db = self.dbPool.checkout()
+            self.__delDB = self.__pooledDB = True
+        elif connect:
             self.db = dbstore.connect(self.repDB[1], driver = self.repDB[0])
             self.__delDB = True
-        schema.checkVersion(self.db)
+        # pooled connections keep the schema version and temporary tables
+        # set up by the requests which used them before
+        if not (self.__pooledDB and self.db.version):
+            schema.checkVersion(self.db)
         schema.setupTempTables(self.db)
         depSchema.setupTempDepTables(self.db)
-        self.troveStore = trovestore.TroveStore(self.db, self.log)
+        if self.__pooledDB and self.db.inTransaction():
+            # the pool rolls back what is left when the connection is given
+            # back, which must not include creating the temporary tables
+            self.db.commit()
+        self.troveStore = trovestore.TroveStore(self.db, self.log,
+                troveCacheSize = self.troveCacheSize)
         self.repos = fsrepos.FilesystemRepository(
             self.serverNameList, self.troveStore, self.contentsDir,
             self.map, requireSigs = self.requireSigs,
@@ -198,6 +223,8 @@ class NetworkRepositoryServer(xmlshims.NetworkConvertors):
             passwordURL = self.externalPasswordURL,
             entCheckURL = self.entitlementCheckURL,
             geoIpFiles=self.geoIpFiles,
+            cacheLocation=self.memCacheLocation,
+            cachePrefix=self.memCachePrefix,
             )
         self.ri = accessmap.RoleInstances(self.db)
         self.deptable = deptable.DependencyTables(self.db)
@@ -221,7 +248,11 @@ class NetworkRepositoryServer(xmlshims.NetworkConvertors):
             self.db.close()
 
     def close(self):
-        self.db.close()
+        if self.__pooledDB:
+            self.__delDB = self.__pooledDB = False
+            self.dbPool.checkin(self.db)
+        else:
+            self.db.close()
         self.log.close()
         if self.callLog:
             self.callLog.close()
@@ -390,6 +421,20 @@ class NetworkRepositoryServer(xmlshims.NetworkConvertors):
         self.log(2, authToken[0])
         return self.auth.getRoleList()
 
+    @accessReadOnly
+    @requireClientProtocol(75)
+    def getDatabasePoolStats(self, authToken, clientVersion):
+        """
+        Return the statistics of this server process's database connection
+        pool, or an empty dictionary if repositoryDBPoolSize is not set.
+        """
+        if not self.auth.authCheck(authToken, admin = True):
+            raise errors.InsufficientPermission
+        self.log(2, authToken[0])
+        if not self.dbPool:
+            return {}
+        return self.dbPool.stats()
+
     @accessReadWrite
     @deprecatedPermissionCall
     def updateAccessGroupMembers(self, authToken, clientVersion, groupName, members):
@@ -1648,16 +1693,25 @@ class NetworkRepositoryServer(xmlshims.NetworkConvertors):
         pureMetaList = self.getTroveInfo(authToken, SERVER_VERSIONS[-1],
                                         trove._TROVEINFO_TAG_METADATA,
                                         [ x for x in sigItems if x ])
+        # signatures and metadata can be compared directly, but any other
+        # change to a trove after it was committed (mirrored trove info,
+        # hidden troves being presented) is only visible in the changed
+        # stamps of its rows
+        pureStampList = fingerprints.changeStamps(self.db,
+                                        [ x for x in sigItems if x ])
         sigList = []
         metaList = []
+        stampList = []
         sigCount = 0
         for item in sigItems:
             if not item:
                 sigList.append(None)
                 metaList.append(None)
+                stampList.append('')
             else:
                 sigList.append(pureSigList[sigCount])
                 metaList.append(pureMetaList[sigCount])
+                stampList.append(pureStampList[sigCount])
                 sigCount += 1
 
         # 0 is a version number for this signature block; changing this will
@@ -1686,9 +1740,10 @@ class NetworkRepositoryServer(xmlshims.NetworkConvertors):
                 fp = fingerprints._troveFp(sigItems[sigCount],
                                         sigList[sigCount],
                                         metaList[sigCount])
-                sigCount += 1
-
                 fpList.append(fp)
+                if stampList[sigCount]:
+                    fpList.append(stampList[sigCount])
+                sigCount += 1
 
             fp = sha1helper.sha1String("\0".join(fpList))
             finalFingerprints.append(sha1helper.sha1ToString(fp))
@@ -2504,6 +2559,7 @@ class NetworkRepositoryServer(xmlshims.NetworkConvertors):
             VALUES (?, ?, ?)
             """, (instanceId, trove._TROVEINFO_TAG_SIGS,
                   cu.binary(trv.troveInfo.sigs.freeze())))
+        self.troveStore.invalidateTroveCache([ instanceId ])
         return True
 
     @accessReadWrite
@@ -2650,6 +2706,29 @@ class NetworkRepositoryServer(xmlshims.NetworkConvertors):
     @accessReadOnly
     def getNewTroveInfo(self, authToken, clientVersion, mark, infoTypes,
                         labels):
+        return self._getNewTroveInfo(authToken, clientVersion, mark,
+                                     infoTypes, labels)[0]
+
+    @accessReadOnly
+    @requireClientProtocol(75)
+    def getNewTroveInfoPage(self, authToken, clientVersion, mark, infoTypes,
+                            labels, instanceId, count):
+        """
+        Like getNewTroveInfo, but returns the trove info of at most C{count}
+        troves, starting after C{instanceId}, along with the instanceId to
+        pass in for the next page. Fewer than C{count} troves means there
+        are no more.
+        """
+        try:
+            instanceId = int(instanceId)
+            count = min(max(int(count), 1), MAX_PAGE_SIZE)
+        except (TypeError, ValueError):
+            raise errors.InsufficientPermission
+        return self._getNewTroveInfo(authToken, clientVersion, mark,
+                                     infoTypes, labels, instanceId, count)
+
+    def _getNewTroveInfo(self, authToken, clientVersion, mark, infoTypes,
+                         labels, instanceId=None, count=None):
 
         def freezeTroveInfo(returnList, mark, trove, troveInfo):
             if not trove: return
@@ -2666,11 +2745,11 @@ class NetworkRepositoryServer(xmlshims.NetworkConvertors):
             mark = long(mark)
         except: # deny invalid marks
             raise errors.InsufficientPermission
-        self.log(2, mark)
+        self.log(2, mark, instanceId, count)
         cu = self.db.cursor()
         roleIds = self.auth.getAuthRoles(cu, authToken)
         if not roleIds:
-            return []
+            return [], instanceId
         if infoTypes:
             try:
                 infoTypes = [int(x) for x in infoTypes]
@@ -2690,7 +2769,7 @@ class NetworkRepositoryServer(xmlshims.NetworkConvertors):
             labelIds = [ str(x[0]) for x in cu.fetchall() ]
             if not labelIds:
                 # no labels matched, short circuit
-                return []
+                return [], instanceId
             labelLimit = """
             JOIN Permissions ON
                 Permissions.userGroupId = ugi.userGroupId
@@ -2701,9 +2780,7 @@ class NetworkRepositoryServer(xmlshims.NetworkConvertors):
             """ % (','.join(labelIds))
         else:
             labelLimit = ''
-        query = """
-        SELECT item, version, flavor,
-               TroveInfo.infoType, TroveInfo.data, TroveInfo.changed
+        joins = """
         FROM Instances
         JOIN TroveInfo USING (instanceId)
         JOIN UserGroupInstancesCache as ugi ON
@@ -2712,21 +2789,44 @@ class NetworkRepositoryServer(xmlshims.NetworkConvertors):
             ugi.userGroupId = UserGroups.userGroupId
             AND UserGroups.canMirror = 1
         %(labelLimit)s
-        JOIN Items ON Instances.itemId = Items.itemId
-        JOIN Versions ON Instances.versionId = Versions.versionId
-        JOIN Flavors ON Instances.flavorId = flavors.flavorId
+        """ % { "labelLimit" : labelLimit }
+        where = """
         WHERE ugi.userGroupId IN (%(roleids)s)
           AND Instances.changed <= ?
           AND Instances.isPresent = %(present)d
           AND TroveInfo.changed >= ?
           %(infoType)s
-        ORDER BY Instances.instanceId, TroveInfo.changed
         """ % {
             "roleids" : ",".join("%d" % x for x in roleIds),
             "present" : instances.INSTANCE_PRESENT_NORMAL,
             "infoType" : infoTypeLimiter,
-            "labelLimit" : labelLimit,
             }
+        if count is not None:
+            # pick the troves for this page first; every trove has several
+            # rows below, repeated once per role and permission granting
+            # access to it
+            cu.execute("""
+            SELECT DISTINCT Instances.instanceId %s %s
+              AND Instances.instanceId > %d
+            ORDER BY Instances.instanceId
+            LIMIT %d""" % (joins, where, instanceId, count), (mark, mark))
+            instanceIds = [ x[0] for x in cu ]
+            if not instanceIds:
+                return [], instanceId
+            where += (" AND Instances.instanceId > %d"
+                      " AND Instances.instanceId <= %d"
+                      % (instanceId, instanceIds[-1]))
+            instanceId = instanceIds[-1]
+        query = """
+        SELECT item, version, flavor,
+               TroveInfo.infoType, TroveInfo.data, TroveInfo.changed
+        %(joins)s
+        JOIN Items ON Instances.itemId = Items.itemId
+        JOIN Versions ON Instances.versionId = Versions.versionId
+        JOIN Flavors ON Instances.flavorId = flavors.flavorId
+        %(where)s
+        ORDER BY Instances.instanceId, TroveInfo.changed
+        """ % { "joins" : joins, "where" : where }
         cu.execute(query, (mark, mark))
 
         l = set()
@@ -2752,7 +2852,8 @@ class NetworkRepositoryServer(xmlshims.NetworkConvertors):
 
         freezeTroveInfo(l, currentMark, currentTrove, currentTroveInfo)
 
-        return [ (x[0], x[1], base64.b64encode(x[2])) for x in l ]
+        return ([ (x[0], x[1], base64.b64encode(x[2])) for x in l ],
+                instanceId)
 
     @accessReadWrite
     def setTroveInfo(self, authToken, clientVersion, infoList):
@@ -2854,6 +2955,8 @@ class NetworkRepositoryServer(xmlshims.NetworkConvertors):
             and TroveInfo.infoType = uti.infoType
         where troveInfo.instanceId is NULL
         """)
+        self.troveStore.invalidateTroveCache(
+            set(x[1] for x in updateTroveInfo))
 
         self.log(3, "updated trove info for", len(updateTroveInfo), "troves")
         return len(updateTroveInfo)
@@ -3018,6 +3121,69 @@ class NetworkRepositoryServer(xmlshims.NetworkConvertors):
             return [ (x[0], x[1]) for x in ret ]
         return ret
 
+    @accessReadOnly
+    @requireClientProtocol(75)
+    def getNewTroveListPage(self, authToken, clientVersion, mark, instanceId,
+                            count):
+        """
+        Return up to C{count} of the troves getNewTroveList returns, in
+        C{(mark, instanceId)} order, starting after the trove with the given
+        C{mark} and C{instanceId}. Each entry is a C{(mark, (name, version,
+        flavor), troveType, instanceId)} tuple; the mark and instanceId of
+        the last one are where the next page starts. Fewer than C{count}
+        troves means there are no more.
+
+        An instanceId of 0 starts at the first trove with the given mark.
+        """
+        try:
+            mark = long(mark)
+            instanceId = int(instanceId)
+            count = min(max(int(count), 1), MAX_PAGE_SIZE)
+        except (TypeError, ValueError): # deny invalid marks
+            raise errors.InsufficientPermission
+        if not self.auth.authCheck(authToken, mirror = True):
+            raise errors.InsufficientPermission
+        self.log(2, authToken[0], mark, instanceId, count)
+        cu = self.db.cursor()
+        roleIds = self.auth.getAuthRoles(cu, authToken)
+        if not roleIds:
+            return []
+        # Walks the (changed, instanceId) index from the cursor onward; the
+        # first condition is the one the index can seek on
+        query = """
+        SELECT Instances.instanceId, item, version, flavor,
+            Nodes.timeStamps, Instances.changed, Instances.troveType
+        FROM Instances
+        JOIN Items ON Items.itemId = Instances.itemId
+        JOIN Versions ON Versions.versionId = Instances.versionId
+        JOIN Flavors ON Flavors.flavorId = Instances.flavorId
+        JOIN Nodes ON
+            Instances.itemId = Nodes.itemId AND
+            Instances.versionId = Nodes.versionId
+        WHERE Instances.changed >= ?
+          AND ( Instances.changed > ? OR Instances.instanceId > ? )
+          AND Instances.isPresent = %d
+          AND EXISTS (
+            SELECT 1 FROM UserGroupInstancesCache as ugi
+            JOIN UserGroups ON
+                ugi.userGroupId = UserGroups.userGroupId AND
+                UserGroups.canMirror = 1
+            WHERE ugi.instanceId = Instances.instanceId
+              AND ugi.userGroupId in (%s) )
+        ORDER BY Instances.changed, Instances.instanceId
+        LIMIT %d
+        """ % ( instances.INSTANCE_PRESENT_NORMAL,
+                ",".join("%d" % x for x in roleIds),
+                count)
+        cu.execute(query, (mark, mark, instanceId))
+        ret = []
+        for instanceId, name, version, flavor, timeStamps, mark, troveType \
+                in cu:
+            version = self.versionStringToFrozen(version, timeStamps)
+            ret.append( (float(mark), (name, version, flavor), troveType,
+                         instanceId) )
+        return ret
+
     @accessReadOnly
     def getTimestamps(self, authToken, clientVersion, nameVersionList):
         """
@@ -3403,9 +3569,10 @@ class ManifestWriter(object):
         if resumeOffset:
             self.fobj.write('resumeOffset=%d\n' % resumeOffset)
 
-    def append(self, path, expandedSize, isChangeset, preserveFile, offset):
-        print >> self.fobj, "%s %d %d %d %d" % (path, expandedSize,
-                isChangeset, preserveFile, offset)
+    def append(self, path, expandedSize, isChangeset, preserveFile, offset,
+            growing=False):
+        print >> self.fobj, "%s %d %d %d %d %d" % (path, expandedSize,
+                isChangeset, preserveFile, offset, growing)
 
     def close(self):
         name = os.path.basename(self.fobj.name)[:-4]
@@ -3432,8 +3599,13 @@ class ServerConfig(ConfigFile):
     memCacheUserAuth        = (CfgBool, True)
     memCacheTimeout         = (CfgInt, -1)
     memCachePrefix          = CfgString
+    # Byte budget for the in-process cache used when memCache is not set
+    memCacheLocalSize       = (CfgBytes('M'), 64000000)
     changesetCacheDir       = CfgPath
     changesetCacheLogFile   = CfgPath
+    # Byte budget for changesetCacheDir (and proxyContentsDir on a caching
+    # proxy); 0 means unlimited
+    changesetCacheSize      = (CfgBytes('M'), 0)
     commitAction            = CfgString
     contentsDir             = CfgContentStore
     deadlockRetry           = (CfgInt, 5)
@@ -3450,13 +3622,21 @@ class ServerConfig(ConfigFile):
     proxyContentsDir        = CfgPath
     readOnlyRepository      = CfgBool
     repositoryDB            = dbstore.CfgDriver
+    # Idle connections to repositoryDB each process keeps open for later
+    # requests; 0 opens a new connection for every request
+    repositoryDBPoolSize    = (CfgInt, 0)
     repositoryMap           = CfgRepoMap
     requireSigs             = CfgBool
     serverName              = CfgLineList(CfgString, listType = GlobListType)
     staticPath              = (CfgString, '/conary-static')
     serializeCommits        = (CfgBool, False)
+    # Restore file contents while changesets are being uploaded for commit
+    streamCommitContents    = (CfgBool, False)
     tmpDir                  = (CfgPath, '/var/tmp')
     traceLog                = tracelog.CfgTraceLog
+    # Byte budget for the in-process cache of troves read from the
+    # repository; 0 disables it
+    troveCacheSize          = (CfgBytes('M'), 0)
     user                    = CfgUserInfo
     webEnabled              = (CfgBool, True)
 
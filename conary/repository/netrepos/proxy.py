@@ -21,6 +21,7 @@ import os
 import resource
 import struct
 import tempfile
+import threading
 import time
 
 from conary import constants, conarycfg, trove
@@ -29,7 +30,8 @@ from conary.lib.http import http_error
 from conary.lib.http import request as req_mod
 from conary.repository import changeset, datastore, errors, netclient
 from conary.repository import filecontainer, transport, xmlshims
-from conary.repository.netrepos import cache, netserver, reposlog
+from conary.repository.netrepos import cache, cacheindex, inflight, netserver
+from conary.repository.netrepos import reposlog
 from conary.repository.netrepos.auth_tokens import AuthToken
 
 # A list of changeset versions we support
@@ -102,7 +104,8 @@ class ProxyCaller:
         """Call a remote server method using request/response objects."""
         rawRequest = request.toWire()
         try:
-            rawResponse = self.proxy._request(methodname, rawRequest)
+            rawResponse = self.proxy._request(methodname, rawRequest,
+                    binary=request.version >= xmlshims.BINARY_RPC_VERSION)
         except IOError, e:
             raise errors.ProxyError(e.strerror)
         except http_error.ResponseError, e:
@@ -112,7 +115,7 @@ class ProxyCaller:
             raise
         self._lastProxy = self._transport.usedProxy
 
-        # XMLRPC responses are a 1-tuple
+        # RPC responses are a 1-tuple
         rawResponse, = rawResponse
         return xmlshims.ResponseArgs.fromWire(request.version, rawResponse,
                 self._transport.responseHeaders)
@@ -290,6 +293,17 @@ class BaseProxy(xmlshims.NetworkConvertors):
 
     repositoryVersionCache = RepositoryVersionCache()
 
+    # calls which can change what goes into the changeset fingerprints of
+    # troves which are already in the repository
+    fingerprintInvalidatingCalls = frozenset([
+        'addDigitalSignature',
+        'addMetadataItems',
+        'commitChangeSet',
+        'presentHiddenTroves',
+        'setTroveInfo',
+        'setTroveSigs',
+        ])
+
     def __init__(self, cfg, basicUrl):
         self.cfg = cfg
         self.basicUrl = basicUrl
@@ -375,6 +389,9 @@ class BaseProxy(xmlshims.NetworkConvertors):
                 # This is incredibly silly.
                 r = caller.callByName(methodname, *args, **kwargs)
 
+            if methodname in self.fingerprintInvalidatingCalls:
+                self.invalidateFingerprints()
+
             response = self.responseFilter.newResult(r)
             extraInfo = caller.getExtraInfo()
         except ProxyRepositoryError, e:
@@ -476,6 +493,10 @@ class BaseProxy(xmlshims.NetworkConvertors):
     def pokeCounter(self, name, delta):
         pass
 
+    # mixins which remember fingerprints override this to forget them
+    def invalidateFingerprints(self):
+        pass
+
 
 class ChangeSetInfo(object):
 
@@ -488,6 +509,7 @@ class ChangeSetInfo(object):
         # Transient fields that are filled out by the caching layer
         'cached',
         'fingerprint',
+        'growing',
         'offset',
         'path',
         'rawSize',
@@ -500,6 +522,12 @@ class ChangeSetInfo(object):
 
     def open(self):
         """Return file-like object of the changeset pointed to by this info"""
+        if self.growing:
+            # Still being fetched by another request; wait for all of it
+            growing = inflight.GrowingFile(self.path)
+            growing.waitForCompletion()
+            growing.close()
+            self.growing = False
         container = util.ExtendedFile(self.path, 'rb', buffering=False)
         rawSize = os.fstat(container.fileno()).st_size - self.offset
         fobj = util.SeekableNestedFile(container, rawSize, self.offset)
@@ -512,6 +540,7 @@ class ChangeSetInfo(object):
         self.offset = 4 + len(pickled)
 
     def __init__(self, pickled=None, cacheObj=None):
+        self.growing = False
         if cacheObj is not None:
             # Cached changeset file with pickled csInfo header
             infoSize = struct.unpack('>I', cacheObj.read(4))[0]
@@ -688,6 +717,7 @@ class ChangesetFilter(BaseProxy):
                         isChangeset=True,
                         preserveFile=csInfo.cached,
                         offset=csInfo.offset,
+                        growing=csInfo.growing,
                         )
             name = manifest.close()
             url = os.path.join(self.urlBase(), "changeset?%s" % name)
@@ -1032,15 +1062,34 @@ class ChangesetFilter(BaseProxy):
         return tmpFile
 
 
+def getCacheIndex(cfg):
+    """
+    Return the LRU index which holds the changeset cache and (on a caching
+    proxy) the file contents cache to cfg.changesetCacheSize bytes, or None
+    if the caches are unbounded.
+    """
+    if not cfg.changesetCacheSize:
+        return None
+    topDirs = [ x for x in (cfg.changesetCacheDir, cfg.proxyContentsDir)
+                if x ]
+    if not topDirs:
+        return None
+    util.mkdirChain(topDirs[0])
+    return cacheindex.CacheIndex(
+            os.path.join(topDirs[0], cacheindex.INDEX_NAME),
+            cfg.changesetCacheSize, topDirs)
+
+
 class BaseCachingChangesetFilter(ChangesetFilter):
     # Changeset filter which uses a directory to create a ChangesetCache
     # instance for the cache
     def __init__(self, cfg, basicUrl):
+        self.cacheIndex = getCacheIndex(cfg)
         if cfg.changesetCacheDir:
             util.mkdirChain(cfg.changesetCacheDir)
             csCache = ChangesetCache(
                     datastore.ShallowDataStore(cfg.changesetCacheDir),
-                    cfg.changesetCacheLogFile)
+                    cfg.changesetCacheLogFile, index=self.cacheIndex)
         else:
             csCache = None
         ChangesetFilter.__init__(self, cfg, basicUrl, csCache)
@@ -1071,7 +1120,8 @@ class Memcache(object):
         self.memCachePrefix = cfg.memCachePrefix
 
         if self.memCacheTimeout >= 0:
-            self.memCache = cache.getCache(self.memCacheLocation)
+            self.memCache = cache.getCache(self.memCacheLocation,
+                                           cfg.memCacheLocalSize)
         else:
             self.memCache = cache.EmptyCache()
 
@@ -1138,7 +1188,31 @@ class Memcache(object):
                                     caller, *args),
                 chgSetList,
                 recurse, withFiles, withFileContents, excludeAutoSource,
-                mirrorMode, key_prefix = "FPRINT")
+                mirrorMode,
+                key_prefix = "FPRINT%s" % self._getFingerprintGeneration())
+
+    def _getFingerprintGenerationKey(self):
+        name = 'fprint_generation'
+        if self.memCachePrefix:
+            name = self.memCachePrefix + ':' + name
+        return name
+
+    def _getFingerprintGeneration(self):
+        # Cached fingerprints are filed under a generation number which is
+        # bumped whenever they may have gone stale, so they never have to
+        # be found and deleted one by one. A lost generation number restarts
+        # from the clock so older entries are not brought back to life.
+        name = self._getFingerprintGenerationKey()
+        generation = self.memCache.get(name)
+        if generation is None:
+            generation = str(int(time.time()))
+            self.memCache.set(name, generation)
+        return '-' + generation
+
+    def invalidateFingerprints(self):
+        name = self._getFingerprintGenerationKey()
+        if not self.memCache.incr(name, 1):
+            self.memCache.set(name, str(int(time.time())))
 
     def getDepsForTroveList(self, caller, authToken, clientVersion, troveList,
                             provides = True, requires = True):
@@ -1213,6 +1287,8 @@ class FileCachingChangesetFilter(BaseCachingChangesetFilter):
                         # by a cleanup job when we need it
                         pathfd = os.open(path, os.O_RDONLY)
                         hasFiles.append((encFileId, encVersion))
+                        if self.cacheIndex:
+                            self.cacheIndex.touch(path)
                         continue
                     except OSError:
                         pass
@@ -1315,6 +1391,8 @@ class FileCachingChangesetFilter(BaseCachingChangesetFilter):
         self.contents.addFile(fileObj, fileId + '-c',
                                       precompressed = True,
                                       integrityCheck = False)
+        if self.cacheIndex:
+            self.cacheIndex.add(self.contents.hashToPath(fileId + '-c'))
 
 
 class ProxyRepositoryServer(Memcache, FileCachingChangesetFilter):
@@ -1431,14 +1509,25 @@ class ChangesetCache(object):
     # Provides a place to cache changeset; uses a directory for them
     # all indexed by fingerprint
 
-    def __init__(self, dataStore, logPath=None):
+    def __init__(self, dataStore, logPath=None, index=None):
         self.dataStore = dataStore
         self.logPath = logPath
-        self.locksMap = {}
+        # cacheindex.CacheIndex enforcing the size budget, if any
+        self.index = index
+        # Cache writers held by the request being handled in each thread
+        self._local = threading.local()
         # Use only 1/4 our file descriptor limit for locks
         limit = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
         self.maxLocks = limit / 4
 
+    @property
+    def locksMap(self):
+        try:
+            return self._local.locksMap
+        except AttributeError:
+            self._local.locksMap = {}
+            return self._local.locksMap
+
     def hashKey(self, key):
         (fingerPrint, csVersion) = key
         return self.dataStore.hashToPath(fingerPrint + '-%d.%d' % (
@@ -1452,11 +1541,14 @@ class ChangesetCache(object):
 
         csObj = self.locksMap.get(csPath)
         if csObj is None:
-            # We did not get a lock for it
+            # We are not the designated writer for it
             csObj = util.AtomicFile(csPath, tmpsuffix = '.ccs-new')
 
         csInfo.path = csPath
         csInfo.write(csObj)
+        # Requests waiting for this changeset can answer their callers as
+        # soon as they see the header
+        csObj.flush()
         try:
             written = util.copyfileobj(inF, csObj, sizeLimit=sizeLimit)
         except transport.MultipartDecodeError:
@@ -1470,34 +1562,86 @@ class ChangesetCache(object):
         # If we locked the cache file, we need to no longer track it
         self.locksMap.pop(csPath, None)
 
+        if self.index:
+            self.index.add(csPath)
+
         self._log('WRITE', key, size=sizeLimit)
 
     def get(self, key, shouldLock = True):
+        """
+        Look up a cached changeset. If it is missing and C{shouldLock} is
+        set, the caller becomes the only one fetching it and must pass it
+        to L{set}. If someone else is already fetching it, a changeset
+        which is still growing is returned rather than fetching it again.
+        """
         csPath = self.hashKey(key)
         csVersion = key[1]
-        if len(self.locksMap) >= self.maxLocks:
+        if len(self.locksMap) >= self.maxLocks or csPath in self.locksMap:
+            # Either out of locks, or this request already asked for the
+            # same changeset and is fetching it
             shouldLock = False
-        lockfile = util.LockedFile(csPath)
         util.mkdirChain(os.path.dirname(csPath))
-        fileObj = lockfile.open(shouldLock=shouldLock)
 
-        if fileObj is None:
-            if shouldLock:
-                # We got the lock on csPath
-                self.locksMap[csPath] = lockfile
+        csInfo = None
+        while True:
+            fileObj = util.fopenIfExists(csPath, "r")
+            if fileObj is not None:
+                csInfo = ChangeSetInfo(cacheObj=fileObj)
+                break
+            if not shouldLock:
+                break
+            writer = inflight.CacheWriter.acquire(csPath)
+            if writer is not None:
+                # We are the one fetching csPath
+                self.locksMap[csPath] = writer
+                break
+            csInfo = self._join(csPath)
+            if csInfo is not None:
+                break
+
+        if csInfo is None:
             self._log('MISS', key)
             return None
 
-        csInfo = ChangeSetInfo(cacheObj=fileObj)
         csInfo.path = csPath
         csInfo.cached = True
         csInfo.version = csVersion
 
-        self._log('HIT', key)
+        if self.index:
+            self.index.touch(csPath)
+
+        if csInfo.growing:
+            self._log('JOIN', key)
+        else:
+            self._log('HIT', key)
+
+        return csInfo
 
+    def _join(self, csPath):
+        """
+        Return the info for a changeset which another request is fetching
+        right now, or None if it is not there (any more).
+        """
+        fileObj = inflight.GrowingFile.open(csPath)
+        if fileObj is None:
+            # The writer has not created the file yet, or just gave up
+            time.sleep(inflight.POLL_INTERVAL)
+            return None
+        try:
+            try:
+                csInfo = ChangeSetInfo(cacheObj=fileObj)
+            except IOError:
+                # The writer gave up before writing the header
+                return None
+        finally:
+            fileObj.close()
+        csInfo.growing = not fileObj.complete
         return csInfo
 
     def resetLocks(self):
+        # Throw away anything which was not fetched completely
+        for writer in self.locksMap.values():
+            writer.close()
         self.locksMap.clear()
 
     def _log(self, status, key, **kwargs):
@@ -1574,11 +1718,14 @@ class ChangesetProducer(object):
                     else:
                         raise RuntimeError("invalid key in changeset manifest")
                     continue
+                if len(line) == 5:
+                    # written before cache files could still be growing
+                    line.append('0')
                 (path, expandedSize, isChangeset, preserveFile, offset,
-                        ) = line
+                        growing) = line
                 expandedSize = long(expandedSize)
                 self.items.append((path, expandedSize, int(isChangeset),
-                    int(preserveFile), int(offset)))
+                    int(preserveFile), int(offset), int(growing)))
                 self.totalSize += expandedSize
             util.removeIfExists(manifestPath)
         else:
@@ -1587,17 +1734,22 @@ class ChangesetProducer(object):
                 expandedSize = os.stat(manifestPath).st_size
             except OSError as err:
                 raise IOError(*err.args)
-            self.items.append((manifestPath, expandedSize, 0, 0, 0))
+            self.items.append((manifestPath, expandedSize, 0, 0, 0, 0))
 
     def getSize(self):
         return self.totalSize - (self.resumeOffset or 0)
 
     def __iter__(self):
         for (path, expandedSize, isChangeset, preserveFile, offset,
-                ) in self.items:
-            container = util.ExtendedFile(path, 'rb', buffering=False)
-            rawSize = os.fstat(container.fileno()).st_size - offset
-            fobj = util.SeekableNestedFile(container, rawSize, offset)
+                growing) in self.items:
+            if growing:
+                # Another request is still fetching this changeset into the
+                # cache; follow it as it is written
+                container = fobj = inflight.GrowingFile(path, offset)
+            else:
+                container = util.ExtendedFile(path, 'rb', buffering=False)
+                rawSize = os.fstat(container.fileno()).st_size - offset
+                fobj = util.SeekableNestedFile(container, rawSize, offset)
             if self.resumeOffset:
                 self.resumeOffset -= expandedSize
                 if self.resumeOffset >= 0:
@@ -1615,7 +1767,8 @@ class ChangesetProducer(object):
                 # Skipped
                 pass
             elif isChangeset:
-                changeSet = filecontainer.FileContainer(fobj)
+                changeSet = filecontainer.FileContainer(fobj,
+                        readIndex=not growing)
                 for data in changeSet.dumpIter(self._readNestedFile,
                         offset=additionalOffset):
                     yield data
@@ -28,9 +28,21 @@ from conary.local.sqldb import VersionCache, FlavorCache
 from conary.local import versiontable
 from conary.repository import errors
 from conary.repository.netrepos import instances, items, keytable, flavors,\
-     troveinfo, versionops, cltable, accessmap
+     troveinfo, versionops, cltable, accessmap, cache
 from conary.server import schema
 
+# TroveStore objects usually live for a single request, so troves built by
+# iterTroves are kept in caches shared by all of them, one per database
+_troveCaches = {}
+
+def _getTroveCache(db, sizeLimit):
+    location = getattr(db, 'database', None)
+    troveCache = _troveCaches.get(location)
+    if troveCache is None:
+        troveCache = _troveCaches[location] = cache.LRUCache(
+            limit = 0, sizeLimit = sizeLimit)
+    return troveCache
+
 
 class TroveAdder:
 
@@ -104,7 +116,7 @@ class TroveAdder:
 
 
 class TroveStore:
-    def __init__(self, db, log = None):
+    def __init__(self, db, log = None, troveCacheSize = 0):
         self.db = db
 
         self.items = items.Items(self.db)
@@ -130,6 +142,11 @@ class TroveStore:
         self.versionIdCache = {}
         self.itemIdCache = {}
 
+        if troveCacheSize:
+            self.troveCache = _getTroveCache(self.db, troveCacheSize)
+        else:
+            self.troveCache = None
+
     def __del__(self):
         self.db = self.log = None
 
@@ -912,6 +929,10 @@ class TroveStore:
                    hidden = False, permCheckFilter = None):
         self.log(3, troveInfoList, "withFiles=%s withFileStreams=%s hidden=%s" % (
                         withFiles, withFileStreams, hidden))
+        # file streams are not cached along with the troves
+        troveCache = self.troveCache
+        if withFileStreams:
+            troveCache = None
 
         cu = self.db.cursor()
         schema.resetTable(cu, 'tmpNVF')
@@ -931,10 +952,18 @@ class TroveStore:
             args.append(instances.INSTANCE_PRESENT_HIDDEN)
             d = dict(presence = "Instances.isPresent in (?,?)")
         d.update(self.db.keywords)
+        d['stamp'] = ''
+        if troveCache is not None:
+            # a cached trove is only used while neither the instance nor
+            # its trove info have changed since it was cached
+            d['stamp'] = """, Instances.changed,
+               ( SELECT MAX(TroveInfo.changed) FROM TroveInfo
+                 WHERE TroveInfo.instanceId = Instances.instanceId )"""
         cu.execute("""
         SELECT %(STRAIGHTJOIN)s tmpNVF.idx, Instances.instanceId, Instances.troveType,
                Nodes.timeStamps,
                Changelogs.name, ChangeLogs.contact, ChangeLogs.message
+               %(stamp)s
         FROM tmpNVF
         JOIN Items on tmpNVF.name = Items.item
         JOIN Versions on tmpNVF.version = Versions.version
@@ -970,6 +999,18 @@ class TroveStore:
             validIndexes = set(x[0] for x in cu)
             troveIdList = [ x for x in troveIdList if x[0] in validIndexes ]
 
+        cached = {}
+        if troveCache is not None:
+            for row in troveIdList:
+                entry = troveCache.get((row[1], bool(withFiles)))
+                if entry is not None and entry[0] == tuple(row[7:9]):
+                    cached[row[0]] = entry[1]
+            if cached:
+                # the queries below only need to look at the other troves
+                cu.executemany("DELETE FROM tmpInstanceId WHERE idx = ?",
+                               [ (x,) for x in cached ],
+                               start_transaction = False)
+
         # unfortunately most cost-based optimizers will get the
         # following troveTrovesCursor queries wrong. Details in CNY-2695
 
@@ -1038,8 +1079,9 @@ class TroveStore:
         versionCache = VersionCache()
         flavorCache = FlavorCache()
         while troveIdList:
+            row = troveIdList.pop(0)
             (idx, troveInstanceId, troveType, timeStamps,
-             clName, clVersion, clMessage) =  troveIdList.pop(0)
+             clName, clVersion, clMessage) = row[:7]
 
             # make sure we've returned something for everything up to this
             # point
@@ -1050,6 +1092,11 @@ class TroveStore:
             # we need the one after this next time through
             neededIdx += 1
 
+            if idx in cached:
+                yield trove.Trove(trove.ThawTroveChangeSet(cached.pop(idx)),
+                                  skipIntegrityChecks = True)
+                continue
+
             singleTroveInfo = troveInfoList[idx]
 
             if clName is not None:
@@ -1126,6 +1173,11 @@ class TroveStore:
             self.depTables.get(cu, trv, troveInstanceId)
             self.troveInfoTable.getInfo(cu, trv, troveInstanceId)
 
+            if troveCache is not None:
+                troveCache.set((troveInstanceId, bool(withFiles)),
+                        (tuple(row[7:9]),
+                         trv.diff(None, absolute = True)[0].freeze()))
+
             if withFileStreams:
                 yield trv, fileContents
             else:
@@ -1136,6 +1188,17 @@ class TroveStore:
             neededIdx += 1
             yield None
 
+    def invalidateTroveCache(self, instanceIds):
+        """
+        Drop the cached copies of the troves with the given instanceIds.
+        Must be called whenever a trove or its trove info is changed.
+        """
+        if self.troveCache is None:
+            return
+        for instanceId in instanceIds:
+            for withFiles in (False, True):
+                self.troveCache.delete((instanceId, withFiles))
+
     def findFileVersion(self, fileId):
         cu = self.db.cursor()
         cu.execute("SELECT stream FROM FileStreams WHERE fileId=?", (fileId,))
@@ -1255,6 +1318,8 @@ class TroveStore:
             # double removes are okay; they just get ignored
             return []
 
+        self.invalidateTroveCache([ instanceId ])
+
         assert(troveType == trove.TROVE_TYPE_NORMAL or
                troveType == trove.TROVE_TYPE_REDIRECT)
 
@@ -28,6 +28,7 @@ import xmlrpclib
 import zlib
 
 from conary import constants
+from conary.lib import binrpc
 from conary.lib import timeutil
 from conary.lib import util
 from conary.lib.http import connection
@@ -148,11 +149,13 @@ class Transport(xmlrpclib.Transport):
     def setAbortCheck(self, abortCheck):
         self.abortCheck = abortCheck
 
-    def request(self, url, body, verbose=0):
+    def request(self, url, body, verbose=0, contentType=None):
         self.verbose = verbose
 
         req = self.opener.newRequest(url, method='POST',
                 headers=self.extraHeaders)
+        if contentType:
+            req.headers['Content-Type'] = contentType
 
         req.setAbortCheck(self.abortCheck)
         req.setData(body, compress=self.compress)
@@ -161,7 +164,8 @@ class Transport(xmlrpclib.Transport):
         if self.serverName:
             req.headers['X-Conary-Servername'] = self.serverName
         req.headers['User-agent'] = self.user_agent
-        req.headers['Accept'] = ','.join(self.contentTypes + [self.mixedType])
+        req.headers['Accept'] = ','.join(self.contentTypes +
+                [binrpc.CONTENT_TYPE, self.mixedType])
 
         # Make sure we capture some useful information from the
         # opener, even if we failed
@@ -229,24 +233,31 @@ class Transport(xmlrpclib.Transport):
                 clen = int(value)
         return ctype, cenc, clen
 
+    def _parse_rpc(self, ctype, response):
+        if ctype == binrpc.CONTENT_TYPE:
+            try:
+                return binrpc.load(response)[0]
+            except binrpc.DecodeError, err:
+                raise xmlrpclib.ResponseError(
+                        "Response body is corrupted: %s" % (err,))
+        elif ctype in self.contentTypes:
+            return xmlrpclib.Transport.parse_response(self, response)
+        raise xmlrpclib.ResponseError(
+                "Response has invalid or missing Content-Type")
+
     def parse_response(self, response):
         ctype = response.headers.get('content-type', '')
         ctype, pdict = cgi.parse_header(ctype)
-        if ctype in self.contentTypes:
-            return xmlrpclib.Transport.parse_response(self, response)
-        elif ctype != self.mixedType:
-            raise xmlrpclib.ResponseError(
-                    "Response has invalid or missing Content-Type")
+        if ctype != self.mixedType:
+            return self._parse_rpc(ctype, response)
         decoder = MultipartDecoder(response, pdict['boundary'])
 
-        # Read XMLRPC response
+        # Read RPC response
         rpcHeaders, rpcBody = decoder.get()
-        if (cgi.parse_header(rpcHeaders.get('content-type'))[0]
-                not in self.contentTypes):
-            raise xmlrpclib.ResponseError(
-                    "Response has invalid or missing Content-Type")
         rpcBody = StringIO.StringIO(rpcBody)
-        result = xmlrpclib.Transport.parse_response(self, rpcBody)
+        result = self._parse_rpc(
+                cgi.parse_header(rpcHeaders.get('content-type', ''))[0],
+                rpcBody)
 
         # Replace the URL in the XMLRPC response with a file-like object that
         # reads out the second part of the multipart response
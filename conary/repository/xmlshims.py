@@ -241,6 +241,11 @@ class NetworkConvertors(object):
         return new
 
 
+# Protocol version from which calls and responses use the compact encoding in
+# conary.lib.binrpc instead of XML-RPC
+BINARY_RPC_VERSION = 74
+
+
 class RequestArgs(compat.namedtuple('RequestArgs',
         'version args kwargs')):
 
@@ -1181,6 +1181,19 @@ def setupTempTables(db):
         db.tempTables["tmpUGI"] = True
         db.createIndex("tmpUGI", "tmpUGIIdx", "instanceId,userGroupId",
                        unique=True, check=False)
+    # UserGroupAllPermissions entries computed for comparison with the
+    # existing ones
+    if "tmpUGAP" not in db.tempTables:
+        cu.execute("""
+        CREATE TEMPORARY TABLE tmpUGAP(
+            permissionId  INTEGER,
+            userGroupId   INTEGER,
+            instanceId    INTEGER,
+            canWrite      INTEGER
+        ) %(TABLEOPTS)s""" % db.keywords)
+        db.tempTables["tmpUGAP"] = True
+        db.createIndex("tmpUGAP", "tmpUGAPIdx", "permissionId,instanceId",
+                       check=False)
     if "tmpTroves" not in db.tempTables:
         cu.execute("""
         CREATE TEMPORARY TABLE tmpTroves(
@@ -46,13 +46,14 @@ sys.path.insert(0, mainPath)
 from conary.lib import coveragehook
 
 from conary import dbstore
+from conary.lib import binrpc
 from conary.lib import options
 from conary.lib import util
 from conary.lib.cfg import CfgBool, CfgInt, CfgPath
 from conary.lib.tracelog import initLog, logMe
 from conary.repository import errors, netclient
 from conary.repository import xmlshims
-from conary.repository.netrepos import netserver, proxy
+from conary.repository.netrepos import contentspool, netserver, proxy
 from conary.repository.netrepos.proxy import ProxyRepositoryServer, ChangesetProducer
 from conary.repository.netrepos.netserver import NetworkRepositoryServer
 from conary.server import schema
@@ -134,7 +135,8 @@ class HttpRequests(SimpleHTTPRequestHandler):
             self.send_error(501)
 
     def do_POST(self):
-        if self.headers.get('Content-Type', '') == 'text/xml':
+        if self.headers.get('Content-Type', '') in ('text/xml',
+                binrpc.CONTENT_TYPE):
             authToken = self.getAuth()
             if authToken is None:
                 return
@@ -205,8 +207,15 @@ class HttpRequests(SimpleHTTPRequestHandler):
             sio = util.decompressStream(sio)
             sio.seek(0)
 
-        (params, method) = util.xmlrpcLoad(sio)
-        logMe(3, "decoded xml-rpc call %s from %d bytes request" %(method, contentLength))
+        contentType = self.headers.get('Content-Type')
+        if contentType == binrpc.CONTENT_TYPE:
+            load, dump = binrpc.load, binrpc.dump
+        else:
+            load, dump = util.xmlrpcLoad, util.xmlrpcDump
+
+        (params, method) = load(sio)
+        logMe(3, "decoded %s call %s from %d bytes request" % (contentType,
+            method, contentLength))
 
         if self.netProxy:
             repos = self.netProxy
@@ -251,9 +260,9 @@ class HttpRequests(SimpleHTTPRequestHandler):
         rawResponse, headers = response.toWire(request.version)
 
         sio = util.BoundedStringIO()
-        util.xmlrpcDump((rawResponse,), stream = sio, methodresponse=1)
+        dump((rawResponse,), stream = sio, methodresponse=1)
         respLen = sio.tell()
-        logMe(3, "encoded xml-rpc response to %d bytes" % respLen)
+        logMe(3, "encoded %s response to %d bytes" % (contentType, respLen))
 
         self.send_response(200)
         encoding = self.headers.get('Accept-encoding', '')
@@ -262,7 +271,7 @@ class HttpRequests(SimpleHTTPRequestHandler):
             sio = util.compressStream(sio, level = 5)
             respLen = sio.tell()
             self.send_header('Content-encoding', 'deflate')
-        self.send_header("Content-type", "text/xml")
+        self.send_header("Content-type", contentType)
         self.send_header("Content-length", str(respLen))
         for key, value in sorted(headers.items()):
             self.send_header(key, value)
@@ -310,6 +319,9 @@ class HttpRequests(SimpleHTTPRequestHandler):
             return
 
         out = open(path, "w")
+        if self.cfg.streamCommitContents:
+            out = contentspool.ContentsSpooler(out,
+                                        self.netRepos.getContentsStore())
         try:
             if chunked:
                 while 1:
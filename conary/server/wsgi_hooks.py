@@ -30,6 +30,7 @@ import zlib
 from email import MIMEText
 from webob import exc as web_exc
 
+from conary.lib import binrpc
 from conary.lib import log as cny_log
 from conary.lib import util
 from conary.lib.formattrace import formatTrace
@@ -38,6 +39,7 @@ from conary.repository import errors
 from conary.repository import netclient
 from conary.repository import shimclient
 from conary.repository import xmlshims
+from conary.repository.netrepos import contentspool
 from conary.repository.netrepos import netserver
 from conary.repository.netrepos import proxy
 from conary.repository.netrepos.auth_tokens import AuthToken
@@ -410,7 +412,8 @@ class ConaryHandler(object):
         elif self.request.method == 'POST':
             # Only check content-type because of proxying considerations; as
             # above, the full URL will vary.
-            if self.request.content_type == 'text/xml':
+            if self.request.content_type in ('text/xml',
+                    binrpc.CONTENT_TYPE):
                 return self.postRpc()
             # Fall through to web handler
         elif self.request.method == 'PUT':
@@ -430,7 +433,12 @@ class ConaryHandler(object):
         return web._handleRequest(request)
 
     def postRpc(self):
-        if self.request.content_type != 'text/xml':
+        contentType = self.request.content_type
+        if contentType == binrpc.CONTENT_TYPE:
+            load, dump = binrpc.load, binrpc.dump
+        elif contentType == 'text/xml':
+            load, dump = util.xmlrpcLoad, util.xmlrpcDump
+        else:
             return self._makeError('400 Bad Request',
                     "Unrecognized Content-Type")
         stream = self.request.body_file
@@ -443,10 +451,10 @@ class ConaryHandler(object):
                     "Unrecognized Content-Encoding")
 
         try:
-            params, method = util.xmlrpcLoad(stream)
+            params, method = load(stream)
         except:
             return self._makeError('400 Bad Request',
-                    "Malformed XMLRPC request")
+                    "Malformed RPC request")
 
         localAddr = '%s:%s' % (socket.gethostname(), self.getLocalPort())
         try:
@@ -482,10 +490,11 @@ class ConaryHandler(object):
             headers['Via'] = proxy.formatViaHeader(localAddr,
                     self.request.http_version, prefix=extraInfo.getVia())
         response = self.responseFactory(headerlist=headers.items())
-        response.content_type = 'text/xml'
+        response.content_type = contentType
 
-        # Output phase -- serialize and write the response
-        body = util.xmlrpcDump((rawResponse,), methodresponse=1)
+        # Output phase -- serialize and write the response, using the same
+        # encoding as the request
+        body = dump((rawResponse,), methodresponse=1)
         accept = self.request.accept_encoding
         if len(body) > 200 and 'deflate' in accept:
             response.content_encoding = 'deflate'
@@ -588,6 +597,9 @@ class ConaryHandler(object):
         if out is None:
             # File already exists or is in an illegal location.
             return self._makeError('403 Forbidden', "Illegal changeset upload")
+        if self.cfg.streamCommitContents:
+            out = contentspool.ContentsSpooler(out,
+                    self.repositoryServer.getContentsStore())
 
         util.copyfileobj(stream, out)
         out.close()
@@ -3319,15 +3319,38 @@ class Trove(streams.StreamSet):
 
 class TroveWithFileObjects(Trove):
 
+    """
+    Trove which also carries the file objects for its files. Files added
+    with addFileStream are kept frozen and only thawed when asked for, so
+    a trove with a large number of files doesn't keep an object graph
+    alive for each of them.
+    """
+
     def addFileObject(self, fileId, obj):
         self.fileObjs[fileId] = obj
 
+    def addFileStream(self, fileId, pathId, stream):
+        self.fileStreams[fileId] = (pathId, stream)
+
     def getFileObject(self, fileId):
-        return self.fileObjs[fileId]
+        fileObj = self.fileObjs.get(fileId)
+        if fileObj is None:
+            pathId, stream = self.fileStreams[fileId]
+            fileObj = files.ThawFile(stream, pathId)
+
+        return fileObj
+
+    def getFileStream(self, fileId):
+        if fileId in self.fileStreams:
+            return self.fileStreams[fileId][1]
+
+        return self.fileObjs[fileId].freeze()
 
     def __init__(self, *args, **kwargs):
         # indexed by fileId
         self.fileObjs = {}
+        # indexed by fileId, (pathId, frozen file) tuples
+        self.fileStreams = {}
         Trove.__init__(self, *args, **kwargs)
 
 class ReferencedTroveSet(dict, streams.InfoStream):
@@ -32,6 +32,7 @@ from conary.lib.sha1helper import (md5FromString, sha1FromString, md5String,
         md5ToString)
 from conary.repository import changeset, filecontents, filecontainer
 from conary.conaryclient import update, cml, systemmodel
+from conary.local import database
 
 class CapsuleTest(rephelp.RepositoryHelper):
 
@@ -389,6 +390,29 @@ class CapsuleTest(rephelp.RepositoryHelper):
         self.updatePkg('simple:rpm=1.0-1-1')
         self.updatePkg('simple:rpm=1.0.1-1-1')
 
+    @conary_test.rpm
+    def testPathReferencesOnlyForPathsInWay(self):
+        simple10  = self.addRPMComponent("simple:rpm=1.0-1-1",
+                                         'simple-1.0-1.i386.rpm')
+        simple101 = self.addRPMComponent("simple:rpm=1.0.1-1-1",
+                                         'simple-1.0.1-1.i386.rpm',
+                                         versus = simple10)
+        lookups = []
+        findPathReferences = database.Database.findPathReferences
+        def _findPathReferences(db, pathList, *args, **kwargs):
+            # owners are only looked up for paths which are in the way
+            for path in pathList:
+                assert(os.path.lexists(self.rootDir + path))
+            lookups.append(pathList)
+            return findPathReferences(db, pathList, *args, **kwargs)
+        self.mock(database.Database, 'findPathReferences',
+                  _findPathReferences)
+
+        self.updatePkg('simple:rpm=1.0-1-1')
+        self.updatePkg('simple:rpm=1.0.1-1-1')
+        # the files of the old version are in the way of the update
+        assert(lookups)
+
     @conary_test.rpm
     def test_unchangedFileid(self):
         # CNY-3719
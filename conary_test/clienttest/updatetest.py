@@ -3385,6 +3385,93 @@ conary erase 'test:runtime=/localhost@rpl:linux/2.0-1-1[]'
 #
 ######################################################
 
+    def testPooledDownload(self):
+        for i, name in enumerate([ 'foo', 'bar', 'baz', 'qux' ]):
+            self.addComponent('%s:run' % name, '1', filePrimer = i)
+        self.cfg.updateThreshold = 1
+        self.cfg.downloadThreads = 3
+        self.cfg.downloadPrefetch = 2
+        self.updatePkg([ 'foo:run', 'bar:run', 'baz:run', 'qux:run' ])
+        db = self.openDatabase()
+        self.assertEqual(sorted(db.iterAllTroveNames()),
+                         [ 'bar:run', 'baz:run', 'foo:run', 'qux:run' ])
+
+        # download failures are reported in job order and stop the update
+        self.resetRoot()
+        try:
+            self.updatePkg([ 'foo:run', 'bar:run', 'baz:run', 'qux:run' ],
+                       callback = FailureUpdateCallback('downloadingChangeSet'))
+        except Exception, e:
+            self.assertEqual(e.args[0], 'downloadingChangeSet')
+        else:
+            self.fail("Exception expected but not raised")
+
+        db = self.openDatabase()
+        assert(len([ x for x in db.iterAllTroveNames() ]) == 0)
+
+    def testResumeInterruptedUpdate(self):
+        from conary.repository import errors as repoErrors, netclient
+        import random
+        rng = random.Random(0)
+        contents = ''.join(chr(rng.randrange(256)) for x in range(20000))
+        self.addComponent('foo:run', '1',
+                          fileContents = [ ('/foo', contents) ])
+        self.cfg.downloadAttempts = 1
+        self.cfg.downloadRetryTrim = 10
+
+        # the download stops halfway through, which fails the update
+        def _copyHalf(inF, outF, **kwargs):
+            outF.write(inF.read(5000))
+            return 5000
+        self.mock(util, 'copyfileobj', _copyHalf)
+        self.assertRaises(repoErrors.TruncatedResponseError,
+                          self.updatePkg, 'foo:run')
+        self.unmock()
+        db = self.openDatabase()
+        self.assertEqual(list(db.iterAllTroveNames()), [])
+        partial = [ x for x in os.listdir(db.downloadCheckpointPath)
+                    if not x.endswith('.sizes') ]
+        self.assertEqual(len(partial), 1)
+
+        # running it again resumes the download, less the trimmed bytes
+        calls = []
+        origCall = netclient.ServerProxyMethod.__call__
+        def _call(method, *args, **kwargs):
+            if method._name == 'getChangeSet':
+                calls.append(kwargs.copy())
+            return origCall(method, *args, **kwargs)
+        self.mock(netclient.ServerProxyMethod, '__call__', _call)
+        self.updatePkg('foo:run')
+        self.unmock()
+        self.assertEqual(calls, [ { 'resumeOffset' : 4990 } ])
+        self.verifyFile(self.rootDir + '/foo', contents)
+        self.assertFalse(os.path.exists(db.downloadCheckpointPath))
+
+    def testPrefetchState(self):
+        import threading
+        stop = threading.Event()
+        state = update._PrefetchState(4, 2, 100)
+        self.assertEqual(state.claim(stop), 0)
+        self.assertEqual(state.claim(stop), 1)
+        # job 1 finishes first, but is delivered after job 0
+        state.put(1, 'one', 10)
+        state.put(0, 'zero', 10)
+        self.assertEqual(state.take(0, stop), 'zero')
+        self.assertEqual(state.take(1, stop), 'one')
+        self.assertEqual(state.pendingSize, 0)
+
+        # job 2 puts the downloads over the size budget, so claiming job 3
+        # waits until it has been taken (or the download is stopped)
+        self.assertEqual(state.claim(stop), 2)
+        state.put(2, 'two', 1000)
+        stop.set()
+        self.assertEqual(state.claim(stop), None)
+        stop.clear()
+        self.assertEqual(state.take(2, stop), 'two')
+        self.assertEqual(state.claim(stop), 3)
+        state.stop()
+        self.assertEqual(state.take(3, stop), None)
+
     def testCallbackFailure(self):
         self.addComponent('foo:run', '1', filePrimer = 0)
         self.addComponent('bar:run', '1', filePrimer = 1)
@@ -453,6 +453,58 @@ class DBStoreTest(DBStoreTestBase):
             cu.execute("insert into foo(val) values (?)", x)
             assert(cu.lastrowid == x-100)
 
+class DBStorePoolTest(unittest.TestCase):
+    def setUp(self):
+        fd, self.dbPath = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        os.unlink(self.dbPath)
+
+    def testCheckoutCheckin(self):
+        pool = dbstore.ConnectionPool(self.dbPath, driver = "sqlite",
+                                      maxIdle = 1)
+        db1 = pool.checkout()
+        db2 = pool.checkout()
+        self.assertNotEqual(db1, db2)
+        cu = db1.cursor()
+        cu.execute("create table foo (id integer)")
+        db1.commit()
+        cu.execute("insert into foo values (1)")
+        pool.checkin(db1)
+        # only one idle connection is kept
+        pool.checkin(db2)
+        self.assertEqual(pool.stats(), dict(idle = 1, active = 0,
+            created = 2, reused = 0, discarded = 1, failedChecks = 0))
+        self.assertTrue(db2.closed)
+
+        # the same connection comes back, without what was left uncommitted
+        db = pool.checkout()
+        self.assertTrue(db is db1)
+        cu = db.cursor()
+        cu.execute("select count(*) from foo")
+        self.assertEqual(cu.fetchall(), [(0,)])
+        self.assertEqual(pool.stats()['reused'], 1)
+
+        # closed connections are not kept
+        db.close()
+        pool.checkin(db)
+        self.assertEqual(pool.stats()['idle'], 0)
+        self.assertEqual(pool.stats()['discarded'], 2)
+
+        # connections past maxAge are not reused
+        pool.maxAge = -1
+        db = pool.checkout()
+        pool.checkin(db)
+        self.assertTrue(db.closed)
+        pool.close()
+
+    def testGetPool(self):
+        pool = dbstore.getPool(self.dbPath, driver = "sqlite")
+        self.assertTrue(dbstore.getPool(self.dbPath, driver = "sqlite")
+                        is pool)
+        self.assertFalse(dbstore.getPool(self.dbPath) is pool)
+
 class DBStoreSQLTest(DBStoreTestBase):
     def testSQL(self):
         db = self.getDB()
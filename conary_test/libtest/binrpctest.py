@@ -0,0 +1,74 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+from testrunner import testhelp
+
+import StringIO
+
+from conary.lib import binrpc
+from conary.lib import util
+
+
+class BinRpcTest(testhelp.TestCase):
+
+    params = (74, ['foo:runtime', '/conary.rpath.com@rpl:linux/1.0-1-1',
+                   '1#x86\x00\xff', None, True, False, 1 << 40, 1 << 70,
+                   -5, 2.5, u'caf\xe9', u'ascii', ()],
+              {'troveList': [('foo', 'bar')], u'key': {'nested': []}})
+
+    def testRoundTrip(self):
+        data = binrpc.dumps(self.params, 'getNewTroveList')
+        params, method = binrpc.loads(data)
+        self.assertEqual(method, 'getNewTroveList')
+
+        # Same types as the XML-RPC encoding
+        xmlParams, xmlMethod = util.xmlrpcLoad(util.xmlrpcDump(
+            (74, self.params[1][:6] + self.params[1][8:], self.params[2]),
+            'getNewTroveList', allow_none=True))
+        self.assertEqual(params[0], xmlParams[0])
+        self.assertEqual(params[1][:6] + params[1][8:], xmlParams[1])
+        self.assertEqual(params[2], xmlParams[2])
+        for a, b in zip(params[1][:6] + params[1][8:], xmlParams[1]):
+            self.assertEqual(type(a), type(b))
+        self.assertEqual(params[1][6:8], [1 << 40, 1 << 70])
+
+        sio = StringIO.StringIO()
+        binrpc.dump(((True, ['x']),), methodresponse=1, stream=sio)
+        sio.seek(0)
+        self.assertEqual(binrpc.load(sio), (([True, ['x']],), None))
+
+    def testSubclasses(self):
+        data = binrpc.dumps((util.ProtectedString('secret'),), 'm')
+        params, method = binrpc.loads(data)
+        self.assertEqual(params, ('secret',))
+        self.assertEqual(type(params[0]), str)
+        self.assertRaises(TypeError, binrpc.dumps, (object(),))
+        self.assertRaises(TypeError, binrpc.dumps, ({1: 2},))
+
+    def testMalformed(self):
+        data = binrpc.dumps(self.params, 'getNewTroveList')
+        for i in range(len(data)):
+            self.assertRaises(binrpc.DecodeError, binrpc.loads, data[:i])
+        self.assertRaises(binrpc.DecodeError, binrpc.loads, data + 'x')
+        self.assertRaises(binrpc.DecodeError, binrpc.loads,
+                '<?xml version="1.0"?>')
+
+        nested = ()
+        for i in range(binrpc.MAX_DEPTH + 1):
+            nested = (nested,)
+        self.assertRaises(binrpc.DecodeError, binrpc.loads,
+                binrpc.dumps(nested))
@@ -208,6 +208,175 @@ class Database(testhelp.TestCase):
         finally:
             shutil.rmtree(d)
 
+    def testCompactRollbacks(self):
+        from conary.local.journal import NoopJobJournal
+        from conary.repository import changeset, filecontents
+        d = tempfile.mkdtemp()
+        try:
+            stack = database.RollbackStack(d, '/', None, None)
+            def _cs(pathId, fileId, contents):
+                cs = changeset.ChangeSet()
+                cs.addFileContents(pathId, fileId,
+                                   changeset.ChangedFileTypes.file,
+                                   filecontents.FromString(contents), False)
+                return cs
+
+            for i in range(2):
+                rb = stack.new()
+                rb.add(NoopJobJournal(),
+                       _cs('1' * 16, '1' * 20, 'repos contents'),
+                       _cs('2' * 16, '2' * 20, 'local contents'), None,
+                       compact = True)
+
+            def _stored():
+                return sorted(x for x in os.listdir(d + '/contents/')
+                              if not x.startswith('.'))
+            # each of the contents is stored just once
+            self.assertEqual(len(_stored()), 2)
+
+            rb = stack.getRollback('r.1')
+            reposCs, localCs = rb.getLast()
+            self.assertEqual(
+                reposCs.getFileContents('1' * 16, '1' * 20)[0],
+                changeset.ChangedFileTypes.refr)
+            reposCs, localCs = rb.getLast(materialize = True)
+            tag, cont = reposCs.getFileContents('1' * 16, '1' * 20)
+            self.assertEqual(tag, changeset.ChangedFileTypes.file)
+            self.assertEqual(cont.get().read(), 'repos contents')
+            tag, cont = localCs.getFileContents('2' * 16, '2' * 20)
+            self.assertEqual(cont.get().read(), 'local contents')
+
+            # so does iterChangeSets() unless told otherwise
+            csList = list(rb.iterChangeSets())
+            self.assertEqual(len(csList), 2)
+            tag, cont = csList[0].getFileContents('1' * 16, '1' * 20)
+            self.assertEqual(tag, changeset.ChangedFileTypes.file)
+            self.assertEqual(cont.get().read(), 'repos contents')
+            tag, cont = csList[1].getFileContents('2' * 16, '2' * 20)
+            self.assertEqual(cont.get().read(), 'local contents')
+            csList = list(rb.iterChangeSets(materialize = False))
+            self.assertEqual(csList[0].getFileContents('1' * 16, '1' * 20)[0],
+                             changeset.ChangedFileTypes.refr)
+            self.assertTrue(rb.isLocal())
+
+            stack.remove('r.0')
+            self.assertEqual(len(_stored()), 2)
+            stack.remove('r.1')
+            self.assertEqual(_stored(), [])
+        finally:
+            shutil.rmtree(d)
+
+    def testRollbackOffsetIndex(self):
+        from conary.local.journal import NoopJobJournal
+        from conary.repository import changeset, filecontents
+        d = tempfile.mkdtemp()
+        try:
+            stack = database.RollbackStack(d, '/', None, None)
+            contents = [ (str(i) * 16, str(i) * 20, 'contents %d' % i)
+                         for i in range(5) ]
+            cs = changeset.ChangeSet()
+            for pathId, fileId, data in contents:
+                cs.addFileContents(pathId, fileId,
+                                   changeset.ChangedFileTypes.file,
+                                   filecontents.FromString(data), False)
+            for compact in (False, True):
+                rb = stack.new()
+                rb.add(NoopJobJournal(), cs, changeset.ChangeSet(), None,
+                       compact = compact)
+
+            # rollbacks are written with an offset index, so their contents
+            # can be read in any order
+            for name in ('r.0', 'r.1'):
+                reposCs, localCs = stack.getRollback(name).getLast(
+                                                        materialize = True)
+                assert(reposCs.fileContainers[0].hasIndex())
+                for pathId, fileId, data in reversed(contents):
+                    tag, cont = reposCs.getFileContents(pathId, fileId)
+                    self.assertEqual(tag, changeset.ChangedFileTypes.file)
+                    self.assertEqual(cont.get().read(), data)
+        finally:
+            shutil.rmtree(d)
+
+    def testDurableJournal(self):
+        from conary.lib import util
+        from conary.local import journal
+        d = tempfile.mkdtemp()
+        synced = []
+        def _fdatasync(fd):
+            synced.append('fdatasync')
+            realFdatasync(fd)
+        def _syncfs(fd):
+            synced.append('syncfs')
+            return True
+        def _write(path, contents):
+            f = open(path, 'w')
+            f.write(contents)
+            f.close()
+        realFdatasync = os.fdatasync
+        realSyncfs = util.syncfs
+        os.fdatasync = _fdatasync
+        util.syncfs = _syncfs
+        try:
+            root = d + '/root'
+            os.mkdir(root)
+            _write(root + '/a', 'old')
+
+            j = journal.JobJournal(d + '/journal', root, create = True,
+                                   durable = True)
+            j.backup(root + '/a')
+            j.barrier()
+            self.assertEqual(synced, [ 'fdatasync' ])
+            # nothing new to make durable
+            j.barrier()
+            self.assertEqual(synced, [ 'fdatasync' ])
+
+            _write(root + '/.new', 'new')
+            os.rename(root + '/.new', root + '/a')
+            j.create(root + '/a')
+            _write(root + '/b', 'b')
+            j.create(root + '/b')
+            # created files are only synced by sync()
+            j.barrier()
+            self.assertEqual(synced, [ 'fdatasync' ])
+            j.sync()
+            self.assertEqual(synced, [ 'fdatasync', 'syncfs', 'fdatasync' ])
+
+            j.revert()
+            self.assertEqual(open(root + '/a').read(), 'old')
+            self.assertFalse(os.path.exists(root + '/b'))
+
+            # a backup of a file written earlier in the job is synced by
+            # the barrier; without syncfs, sync() syncs the files which were
+            # created or moved one at a time
+            del synced[:]
+            util.syncfs = lambda fd: False
+            j = journal.JobJournal(d + '/journal', root, create = True,
+                                   durable = True)
+            _write(root + '/b', 'b')
+            j.create(root + '/b')
+            j.backup(root + '/b')
+            j.barrier()
+            self.assertEqual(synced, [ 'fdatasync', 'fdatasync' ])
+            del synced[:]
+            j.rename(root + '/b', root + '/c')
+            os.rename(root + '/b', root + '/c')
+            j.sync()
+            # the moved file, then the journal
+            self.assertEqual(synced, [ 'fdatasync', 'fdatasync' ])
+            j.close()
+
+            del synced[:]
+            j = journal.JobJournal(d + '/journal', root, create = True)
+            j.backup(root + '/a')
+            j.barrier()
+            j.sync()
+            self.assertEqual(synced, [])
+            j.close()
+        finally:
+            os.fdatasync = realFdatasync
+            util.syncfs = realSyncfs
+            shutil.rmtree(d)
+
     def testGetCapsulesTroveList(self):
         # make sure that getCapsulesTroveList is at least not removed...
         from conary.lib import util
@@ -274,6 +274,92 @@ class DepTableTest(testhelp.TestCase):
         assert(len(order) == 1)
 
 
+    def testUpdateKeepsProvides(self):
+        dt, db, cu = self.init()
+        dep = parseDep("soname: ELF32/libtest.so.1(flag1 flag2)")
+        less = parseDep("soname: ELF32/libtest.so.1(flag1)")
+        prvTrv1 = self.prvTrove("test-prov", dep, version="1.0-1-1")
+        troveInfo = db.addTrove(prvTrv1)
+        db.addTroveDone(troveInfo)
+        for i in range(5):
+            troveInfo = db.addTrove(self.reqTrove("test-req%d" % i, dep,
+                                                  version="1.0-1-1"))
+            db.addTroveDone(troveInfo)
+        db.commit()
+
+        # the new version still provides everything, so the troves which
+        # require it do not need to be checked again
+        prvTrv2 = self.prvTrove("test-prov", dep, version="2.0-1-1")
+        dbDb, jobs, src = self.createJobInfo(db, (prvTrv1, prvTrv2))
+        checker = dbDb.dependencyChecker(src)
+        checker.addJobs(jobs)
+        cu.execute("SELECT COUNT(*) FROM TmpRequires")
+        self.assertEqual(cu.next()[0], 0)
+        result = checker.check()
+        checker.done()
+        self.assertEqual(result.unresolveableList, [])
+
+        # losing a flag breaks all of them
+        prvTrv2 = self.prvTrove("test-prov", less, version="2.0-1-1")
+        (broken, byErase, order) = self.check(
+                *self.createJobInfo(db, (prvTrv1, prvTrv2)))
+        self.assertEqual(broken, [])
+        self.assertEqual(sorted(x[0][0] for x in byErase),
+                         [ "test-req%d" % i for i in range(5) ])
+
+    def testSnapshot(self):
+        dt, db, cu = self.init()
+        dep = parseDep("soname: ELF32/libtest.so.1(flag1 flag2)")
+        prvTrv = self.prvTrove("test-prov", dep, version="1.0-1-1")
+        troveInfo = db.addTrove(prvTrv)
+        db.addTroveDone(troveInfo)
+        db.commit()
+
+        # requirements installed troves provide stay out of the work tables
+        reqTrv = self.reqTrove("test-req", dep, version="1.0-1-1")
+        dbDb, jobs, src = self.createJobInfo(db, reqTrv)
+        checker = dbDb.dependencyChecker(src)
+        checker.addJobs(jobs)
+        cu.execute("SELECT COUNT(*) FROM TmpRequires")
+        self.assertEqual(cu.next()[0], 0)
+        result = checker.check()
+        checker.done()
+        self.assertEqual(result.unsatisfiedList, [])
+        snapshot = dt.snapshot
+        self.assertEqual(snapshot.transactionCounter,
+                         dbDb.getTransactionCounter())
+
+        # but are checked if the job removes what provides them
+        (broken, byErase, order) = self.check(
+                *self.createJobInfo(db, reqTrv, (prvTrv, None)))
+        self.assertEqual(broken, [])
+        self.assertEqual([ x[0][0] for x in byErase ], [ "test-req" ])
+
+        # committing an update changes the snapshot in place
+        db.eraseTrove("test-prov", prvTrv.getVersion(), prvTrv.getFlavor())
+        db.commit()
+        self.assertEqual(snapshot.transactionCounter,
+                         dbDb.getTransactionCounter())
+        self.assertEqual(snapshot.providers, {})
+        (broken, byErase, order) = self.check(*self.createJobInfo(db, reqTrv))
+        self.assertEqual(broken, [ (("test-req", reqTrv.getVersion(),
+                                     self.flv), dep) ])
+        self.assertTrue(dt.snapshot is snapshot)
+
+        # a rolled back change leaves it alone
+        troveInfo = db.addTrove(prvTrv)
+        db.addTroveDone(troveInfo)
+        dbDb.rollback()
+        self.assertEqual(snapshot.providers, {})
+
+        # while one made elsewhere means reading it again
+        cu.execute("UPDATE DatabaseAttributes SET value = value + 1 "
+                   "WHERE name = 'transaction counter'")
+        dbDb.commit()
+        self.assertEqual(self.check(*self.createJobInfo(db, reqTrv))[0],
+                         broken)
+        self.assertFalse(dt.snapshot is snapshot)
+
 class DepTableTestWithHelper(rephelp.RepositoryHelper):
     def testGetLocalProvides(self):
         db = self.openDatabase()
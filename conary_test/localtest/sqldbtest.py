@@ -23,9 +23,10 @@ import shutil
 
 from conary import dbstore 
 from conary.deps import deps
-from conary.local import sqldb
+from conary.local import schema, sqldb
 from conary.versions import ThawVersion
 from conary.versions import VersionFromString
+from conary import errors
 from conary import files
 from conary import trove
 from conary.lib.sha1helper import md5FromString, sha1FromString, md5String
@@ -197,6 +198,11 @@ class SqlDB(rephelp.RepositoryHelper):
         assert(dbTrv.__class__ == trove.TroveWithFileObjects)
         for f in (f1, f2, f3):
             assert(dbTrv.getFileObject(f.fileId()) == f)
+            assert(dbTrv.getFileStream(f.fileId()) == f.freeze())
+        # files are kept frozen until they are asked for
+        assert(not dbTrv.fileObjs)
+        # and all of them share one version object
+        assert(len(set(id(x[3]) for x in dbTrv.iterFileList())) == 1)
 
         trv2 = trove.Trove("testpkg", self.v10, self.emptyFlavor, None)
         ti = trv2.addTrove(trv.getName(), self.v10, trv.getFlavor())
@@ -307,6 +313,133 @@ class SqlDB(rephelp.RepositoryHelper):
         cu.execute("SELECT count(*) FROM TroveInfo")
         assert(cu.next()[0] == 0)
 
+    def testPathConflicts(self):
+        db = sqldb.Database(':memory:')
+
+        f1 = files.FileFromFilesystem("/etc/passwd", self.id1)
+        f2 = files.FileFromFilesystem("/etc/services", self.id2)
+        f3 = files.FileFromFilesystem("/etc/group", self.id3)
+        f4 = files.FileFromFilesystem("/etc/group", self.id4)
+
+        def _add(name, fileList):
+            trv = trove.Trove(name, self.v10, self.emptyFlavor, None)
+            for f, path in fileList:
+                trv.addFile(f.pathId(), path, self.v10, f.fileId())
+            trvInfo = db.addTrove(trv)
+            for f, path in fileList:
+                db.addFile(trvInfo, f.pathId(), path, f.fileId(), self.v10,
+                           fileStream = f.freeze())
+            return db.addTroveDone(trvInfo)
+
+        _add("first", [ (f1, "/bin/1"), (f3, "/bin/3") ])
+        # /bin/3 has the same contents in both, so it is shared
+        secondId = _add("second", [ (f2, "/bin/1"), (f4, "/bin/3") ])
+        self.assertTrue('DBTroveFilesPresentPathIdx' in
+                        db.db.tables['DBTroveFiles'])
+
+        try:
+            db.checkPathConflicts([ secondId ], lambda x: False, {})
+        except errors.DatabasePathConflicts, e:
+            self.assertEqual([ x[0] for x in e.getConflicts() ], [ "/bin/1" ])
+        else:
+            self.fail("path conflict not detected")
+
+        replaced = db.checkPathConflicts([ secondId ],
+                                         lambda x: x == "/bin/1", {})
+        self.assertEqual(replaced,
+                { ("first", self.v10, self.emptyFlavor) :
+                        [ (self.id1, None, None) ] })
+        self.assertEqual(
+                [ x for x in db.iterFindByPath("/bin/1") ][0].getName(),
+                "second")
+        self.assertEqual(db.checkPathConflicts([ secondId ],
+                                               lambda x: False, {}), {})
+
+    def testPathConflictsOldSqlite(self):
+        # sqlite before 3.8.0 gets an index which is not partial
+        self.mock(schema, '_hasPartialIndexes', lambda: False)
+        self.testPathConflicts()
+        db = sqldb.Database(':memory:')
+        cu = db.db.cursor()
+        cu.execute("SELECT sql FROM sqlite_master WHERE "
+                   "name = 'DBTroveFilesPresentPathIdx'")
+        self.assertFalse('WHERE' in cu.next()[0].upper())
+
+    def testPathReferences(self):
+        db = sqldb.Database(':memory:')
+
+        f1 = files.FileFromFilesystem("/etc/passwd", self.id1)
+        f2 = files.FileFromFilesystem("/etc/services", self.id2)
+
+        for name, f in (("first", f1), ("second", f2)):
+            trv = trove.Trove(name, self.v10, self.emptyFlavor, None)
+            trv.addFile(f.pathId(), "/bin/1", self.v10, f.fileId())
+            trvInfo = db.addTrove(trv)
+            db.addFile(trvInfo, f.pathId(), "/bin/1", f.fileId(), self.v10,
+                       fileStream = f.freeze())
+            db.addTroveDone(trvInfo)
+        db.removeFileFromTrove(trv, "/bin/1")
+
+        pathList = [ "/bin/1", "/bin/2", "/bin/1" ]
+        self.assertEqual(db.pathsOwned(pathList), [ True, False, True ])
+
+        refs = db.findPathReferences(pathList)
+        self.assertEqual(refs.keys(), [ "/bin/1" ])
+        self.assertEqual(sorted(refs["/bin/1"]),
+                sorted(db.iterFindPathReferences("/bin/1")))
+        self.assertEqual(sorted(x[0] for x in refs["/bin/1"]),
+                         [ "first", "second" ])
+
+        refs = db.findPathReferences(pathList, justPresent = True,
+                                     withStream = True)
+        self.assertEqual(refs, { "/bin/1" :
+                [ ("first", self.v10, self.emptyFlavor, f1.pathId(),
+                   f1.fileId(), f1.freeze()) ] })
+        self.assertEqual(refs["/bin/1"],
+                list(db.iterFindPathReferences("/bin/1", justPresent = True,
+                                               withStream = True)))
+        self.assertEqual(db.findPathReferences([]), {})
+
+    def testTroveSet(self):
+        db = sqldb.Database(':memory:')
+
+        f1 = files.FileFromFilesystem("/etc/passwd", self.id1)
+        f1.tags.set("tag1")
+        f2 = files.FileFromFilesystem("/etc/services", self.id2)
+
+        prov = deps.parseDep(
+                    'trove: first:runtime soname: ELF32/libfirst.so.1(SysV)')
+        req = deps.parseDep(
+                    'file: /bin/sh soname: ELF32/libfirst.so.1(SysV)')
+
+        db.addTroveSetStart()
+        troveList = []
+        for name, f in (("first:runtime", f1), ("second:runtime", f2)):
+            trv = trove.Trove(name, self.v10, self.emptyFlavor, None)
+            trv.addFile(f.pathId(), "/bin/" + name, self.v10, f.fileId())
+            trv.setProvides(prov)
+            trv.setRequires(req)
+            trv.troveInfo.sourceName.set(name.split(':')[0] + ':source')
+            trvInfo = db.addTrove(trv)
+            db.addFile(trvInfo, f.pathId(), "/bin/" + name, f.fileId(),
+                       self.v10, fileStream = f.freeze())
+            db.addTroveDone(trvInfo)
+            troveList.append(trv)
+
+        # nothing is merged until the set is done
+        self.assertEqual(list(db.iterFindByPath("/bin/first:runtime")), [])
+        db.addTroveSetDone()
+
+        dbTroves = db.getTroves([ x.getNameVersionFlavor()
+                                  for x in troveList ])
+        self.assertEqual(dbTroves, troveList)
+        self.assertEqual(
+                [ x.getName() for x in
+                        db.iterFindByPath("/bin/second:runtime") ],
+                [ "second:runtime" ])
+        self.assertEqual(list(db.iterFilesWithTag("tag1")),
+                         [ "/bin/first:runtime" ])
+
     def testDatabase2(self):
         db = sqldb.Database(':memory:')
 
@@ -512,6 +645,87 @@ class SqlDB(rephelp.RepositoryHelper):
         assert(weakMissing == set([ ("subcomp3", self.v10, flavor1) ]))
         assert(instRefed == set([ ("subcomp2", self.v10, flavor1) ]))
 
+    def testTuning(self):
+        fd, fn = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            def pragma(db, name):
+                cu = db.db.cursor()
+                cu.execute("PRAGMA %s" % name, start_transaction = False)
+                return cu.next()[0]
+
+            db = sqldb.Database(fn, tuning = dict(journalMode = 'wal',
+                                                  cacheSize = 8192000))
+            self.assertEqual(pragma(db, 'journal_mode'), 'wal')
+            self.assertEqual(pragma(db, 'synchronous'), 1)
+            self.assertEqual(pragma(db, 'cache_size'), -8000)
+            db.commit(durable = True)
+
+            # the journal mode is left alone unless one is asked for, and
+            # can't be changed while someone else has the database open
+            db2 = sqldb.Database(fn)
+            self.assertEqual(db2.journalMode, 'wal')
+            db2.close()
+            db2 = sqldb.Database(fn, tuning = dict(journalMode = 'delete'))
+            self.assertEqual(db2.journalMode, 'wal')
+            db2.close()
+            db.close()
+
+            db = sqldb.Database(fn, tuning = dict(journalMode = 'delete',
+                                                  synchronous = 'normal'))
+            self.assertEqual(pragma(db, 'journal_mode'), 'delete')
+            # only WAL mode is safe with less than a full sync
+            self.assertEqual(pragma(db, 'synchronous'), 2)
+            db.close()
+        finally:
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(fn + suffix):
+                    os.unlink(fn + suffix)
+
+    def testDurableCommit(self):
+        fd, fn = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            def pragma(db, name):
+                cu = db.db.cursor()
+                cu.execute("PRAGMA %s" % name, start_transaction = False)
+                return cu.next()[0]
+
+            db = sqldb.Database(fn, tuning = dict(journalMode = 'wal',
+                                                  synchronous = 'normal'))
+            self.assertEqual(pragma(db, 'synchronous'), 1)
+
+            # durable transactions run at FULL, and the configured level
+            # is restored once they are done
+            db.begin(durable = True)
+            self.assertEqual(pragma(db, 'synchronous'), 2)
+            ti = db.addTrove(trove.Trove("testcomp", self.v10,
+                                         deps.Flavor(), None))
+            db.addTroveDone(ti)
+            db.commit(durable = True)
+            self.assertEqual(pragma(db, 'synchronous'), 1)
+            db.begin(durable = True)
+            db.rollback()
+            self.assertEqual(pragma(db, 'synchronous'), 1)
+
+            # a durable commit of a transaction which was not started
+            # that way syncs the log instead
+            synced = []
+            fsync = os.fsync
+            def _fsync(fd):
+                synced.append(os.readlink('/proc/self/fd/%d' % fd))
+                return fsync(fd)
+            self.mock(os, 'fsync', _fsync)
+            db.addTroveDone(db.addTrove(trove.Trove("testcomp2", self.v10,
+                                                    deps.Flavor(), None)))
+            db.commit(durable = True)
+            self.assertEqual(synced, [ os.path.realpath(fn) + '-wal' ])
+            db.close()
+        finally:
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(fn + suffix):
+                    os.unlink(fn + suffix)
+
     def testVersion2Migration(self):
         dbfile = os.path.join(resources.get_archive(), 'conarydbs',
                               'conarydb-version-2')
@@ -1080,6 +1080,63 @@ class Foo(PackageRecipe):
         assert(os.stat(self.rootDir + '/b').st_ino ==
                os.stat(self.rootDir + '/d').st_ino)
 
+    @testhelp.context('rollback')
+    def testParallelRestore(self):
+        def _contents(ver):
+            fileList = [ ('/dir%d/file%d' % (i % 3, i),
+                          rephelp.RegularFile(contents = '%s %d\n' % (ver, i),
+                                              pathId = str(i)))
+                         for i in range(20) ]
+            # shared contents and hardlinks are restored in order around
+            # the files which go through the pool
+            fileList += [
+                ('/shared1', rephelp.RegularFile(contents = 'shared ' + ver,
+                                                  pathId = '21')),
+                ('/shared2', rephelp.RegularFile(contents = 'shared ' + ver,
+                                                  pathId = '22')),
+                ('/link1', rephelp.RegularFile(contents = 'link ' + ver,
+                                  pathId = '23', linkGroup = '\1' * 16)),
+                ('/link2', rephelp.RegularFile(contents = 'link ' + ver,
+                                  pathId = '24', linkGroup = '\1' * 16)),
+                ('/etc/config', rephelp.RegularFile(contents = ver + '\n',
+                                  pathId = '25')),
+                ]
+            return fileList
+
+        def _tempFiles():
+            # restoreFile() extracts into .ct* files next to the target
+            return [ os.path.join(dirName, x)
+                     for dirName, dirs, fileNames in os.walk(self.rootDir)
+                     for x in fileNames if x.startswith('.ct') ]
+
+        self.addComponent('foo:runtime', '1.0', fileContents = _contents('1'))
+        self.addComponent('foo:runtime', '2.0', fileContents = _contents('2'))
+        self.cfg.restoreThreads = 4
+
+        self.updatePkg('foo:runtime=1.0')
+        self.verifyFile(self.rootDir + '/dir1/file7', '1 7\n')
+        self.updatePkg('foo:runtime=2.0')
+        for i in range(20):
+            self.verifyFile(self.rootDir + '/dir%d/file%d' % (i % 3, i),
+                            '2 %d\n' % i)
+        self.verifyFile(self.rootDir + '/shared2', 'shared 2')
+        self.verifyFile(self.rootDir + '/etc/config', '2\n')
+        assert(os.stat(self.rootDir + '/link1').st_ino ==
+               os.stat(self.rootDir + '/link2').st_ino)
+        # no temporary files are left behind
+        self.assertEqual(sorted(os.listdir(self.rootDir + '/dir0')),
+                         [ 'file%d' % i for i in sorted(
+                             range(0, 20, 3), key = str) ])
+        self.assertEqual(_tempFiles(), [])
+
+        self.rollback(1)
+        for i in range(20):
+            self.verifyFile(self.rootDir + '/dir%d/file%d' % (i % 3, i),
+                            '1 %d\n' % i)
+        self.verifyFile(self.rootDir + '/link2', 'link 1')
+        self.verifyFile(self.rootDir + '/etc/config', '1\n')
+        self.assertEqual(_tempFiles(), [])
+
     @testhelp.context('rollback')
     def testConfigFilesWithoutNewline(self):
         # CNY-1979
@@ -1102,6 +1159,33 @@ class Foo(PackageRecipe):
         self.verifyFile(self.rootDir + '/etc/foo',
                         'first contents\nnew contents')
 
+    def testPathReferencesOnlyForPathsInWay(self):
+        self.addComponent('foo:runtime', '1.0',
+                          fileContents = [ ('/shared', 'shared\n') ])
+        self.addComponent('bar:runtime', '1.0',
+                          fileContents = [ ('/shared', 'shared\n'),
+                                           ('/unowned', 'unowned\n'),
+                                           ('/new', 'new\n') ])
+        self.updatePkg('foo:runtime')
+        self.writeFile(self.rootDir + '/unowned', 'unowned\n')
+
+        lookups = []
+        findPathReferences = database.Database.findPathReferences
+        def _findPathReferences(db, pathList, *args, **kwargs):
+            lookups.append(sorted(pathList))
+            return findPathReferences(db, pathList, *args, **kwargs)
+        self.mock(database.Database, 'findPathReferences',
+                  _findPathReferences)
+
+        self.updatePkg('bar:runtime')
+        # /new is not on disk, so nobody is asked who owns it
+        self.assertEqual(lookups, [ [ '/shared', '/unowned' ] ])
+        self.verifyFile(self.rootDir + '/new', 'new\n')
+        db = self.openDatabase()
+        self.assertEqual(sorted(x[0] for x in
+                                db.iterFindPathReferences('/shared')),
+                         [ 'bar:runtime', 'foo:runtime' ])
+
     def testUpdateFileToDirectoryReplaceFiles(self):
         self.addComponent('foo:runtime=1', [('/foo/1', 'hello\n')])
         os.symlink(self.rootDir + '/foo.1', self.rootDir + '/foo')
@@ -94,6 +94,65 @@ class ChangesetTest(rephelp.RepositoryHelper):
         ctype, contents = cs3.getFileContents(pathId, f.fileId())
         assert(ctype == changeset.ChangedFileTypes.file)
 
+    def testOffsetIndexedChangeSet(self):
+        # contents of indexed changesets can be read in any order
+        cs = changeset.ChangeSet()
+        contents = []
+        for i in range(10):
+            pathId = sha1helper.md5String('path%d' % i)
+            fileId = sha1helper.sha1String('file%d' % i)
+            cs.addFileContents(pathId, fileId,
+                               changeset.ChangedFileTypes.file,
+                               filecontents.FromString('contents %d' % i),
+                               False)
+            contents.append((pathId, fileId, 'contents %d' % i))
+
+        csPath = self.workDir + '/indexed.ccs'
+        cs.writeToFile(csPath, versionOverride =
+                            filecontainer.FILE_CONTAINER_VERSION_OFFSET_IDX)
+        cs2 = changeset.ChangeSetFromFile(csPath)
+        assert(cs2.fileContainers[0].hasIndex())
+        for pathId, fileId, data in reversed(contents):
+            ctype, cont = cs2.getFileContents(pathId, fileId)
+            self.assertEqual(ctype, changeset.ChangedFileTypes.file)
+            self.assertEqual(cont.get().read(), data)
+
+        # in order reads still work, compressed or not
+        for pathId, fileId, data in contents:
+            ctype, cont = cs2.getFileContents(pathId, fileId,
+                                              compressed = True)
+            self.assertEqual(
+                gzip.GzipFile(None, 'r', fileobj = cont.get()).read(), data)
+
+    def testChangeSetFileOffsetIndex(self):
+        trv = self.addComponent('foo:runtime', fileContents = [
+                    ('/%d' % i, rephelp.RegularFile(contents = 'c%d\n' % i,
+                                                    pathId = str(i)))
+                    for i in range(5) ])
+        csPath = self.workDir + '/foo.ccs'
+        client = self.getConaryClient()
+        client.createChangeSetFile(csPath, [ ('foo:runtime', (None, None),
+                        (trv.getVersion(), trv.getFlavor()), True) ])
+
+        # files written by "conary changeset" are indexed, so the contents
+        # can be read out of order
+        cs = changeset.ChangeSetFromFile(csPath)
+        self.assertEqual([ x.version for x in cs.fileContainers ],
+                         [ filecontainer.FILE_CONTAINER_VERSION_OFFSET_IDX ])
+        trvCs = cs.iterNewTroveList().next()
+        for pathId, path, fileId, version in \
+                                    reversed(trvCs.getNewFileList()):
+            tag, cont = cs.getFileContents(pathId, fileId)
+            self.assertEqual(cont.get().read(), 'c%s\n' % path[1:])
+
+        # they are converted back to a version repositories accept when
+        # they are committed
+        self.resetRepository()
+        repos = self.openRepository()
+        repos.commitChangeSetFile(csPath)
+        self.assertEqual(repos.hasTrove('foo:runtime', trv.getVersion(),
+                                        trv.getFlavor()), True)
+
     def testIndexByPathIdConversion(self):
         def _testCs(repos, troves, idxLength, fileCount):
             job = [ (x.getName(), (None, None),
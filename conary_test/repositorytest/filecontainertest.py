@@ -188,5 +188,98 @@ class FilecontainerTest(unittest.TestCase):
         s = f.read()
         assert(s == 'endcontents')
 
+    def testOffsetIndex(self):
+        version = filecontainer.FILE_CONTAINER_VERSION_OFFSET_IDX
+        names = [ 'file%d' % i for i in range(5) ]
+        data = [ 'contents of %s' % x for x in names ]
+        tags = [ 'tag %s' % x for x in names ]
+
+        f = util.ExtendedFile(self.fn, "w+", buffering = False)
+        c = FileContainer(f, version = version)
+        for name, contents, tag in zip(names, data, tags):
+            c.addFile(name, FromString(contents), tag)
+        c.close()
+
+        c = FileContainer(f)
+        assert(c.version == version)
+        assert(c.hasIndex())
+        # sequential readers stop at the index
+        checkFiles(c, names, data, tags)
+
+        # random access, in reverse order, leaves the sequential position
+        # alone
+        c.reset()
+        c.getNextFile()
+        for i in reversed(range(len(names))):
+            name, tag, subf = c.getFile(names[i])
+            assert(name == names[i])
+            assert(tag == tags[i])
+            s = gzip.GzipFile(None, "r", fileobj = subf).read()
+            assert(s == data[i])
+        assert(c.getFile('missing') is None)
+        assert(c.getNextFile()[0] == names[1])
+
+        # dumping the container rebuilds an equivalent index
+        c.reset()
+        dumped = ''.join(c.dumpIter(
+            lambda name, tag, size, subf: (tag, size, subf)))
+        f.seek(0)
+        assert(dumped == f.read())
+        skip = 40
+        c.reset()
+        dumped = ''.join(c.dumpIter(
+            lambda name, tag, size, subf: (tag, size, subf), offset = skip))
+        f.seek(skip)
+        assert(dumped == f.read())
+
+        # without the trailer the container is still readable in order
+        f.truncate(os.fstat(f.fileno()).st_size - 12)
+        c = FileContainer(f)
+        assert(not c.hasIndex())
+        checkFiles(c, names, data, tags)
+        name, tag, subf = c.getFile(names[3])
+        assert(tag == tags[3])
+
+    def testUnindexedGetFile(self):
+        f = util.ExtendedFile(self.fn, "w+", buffering = False)
+        c = FileContainer(f)
+        c.addFile('one', FromString('1'), 'tag1')
+        c.addFile('two', FromString('2'), 'tag2')
+        c.close()
+
+        c = FileContainer(f)
+        assert(not c.hasIndex())
+        name, tag, subf = c.getFile('two')
+        assert(tag == 'tag2')
+        assert(gzip.GzipFile(None, "r", fileobj = subf).read() == '2')
+        assert(c.getFile('three') is None)
+        assert(c.getNextFile()[0] == 'one')
+
+    def testVerify(self):
+        for version in (filecontainer.FILE_CONTAINER_VERSION_FILEID_IDX,
+                        filecontainer.FILE_CONTAINER_VERSION_OFFSET_IDX):
+            f = util.ExtendedFile(self.fn, "w+", buffering = False)
+            c = FileContainer(f, version = version)
+            c.addFile('one', FromString('1' * 100), 'tag1')
+            c.addFile('two', FromString('2' * 100), 'tag2')
+            c.close()
+            size = os.fstat(f.fileno()).st_size
+
+            c = FileContainer(f)
+            c.getNextFile()
+            c.verify()
+            # the sequential position is left alone
+            assert(c.getNextFile()[0] == 'two')
+
+            f.seek(0, 2)
+            f.write('trailing')
+            self.assertRaises(filecontainer.BadContainer,
+                              FileContainer(f).verify)
+
+            f.truncate(size - 20)
+            self.assertRaises(filecontainer.BadContainer,
+                              FileContainer(f).verify)
+            f.close()
+
     def tearDown(self):
         os.unlink(self.fn)
@@ -20,6 +20,7 @@ from testutils import sock_utils
 import copy
 import itertools
 import os
+import random
 import shutil
 import tempfile
 import time
@@ -87,6 +88,32 @@ class NetclientTest(rephelp.RepositoryHelper):
         assert(recipe.get().read() == recipes.testRecipe1)
         os.chdir(origDir)
 
+    def testGetFileContentsParallel(self):
+        contents = [ str(i) * (1000 + i * 100) for i in range(6) ]
+        t = self.addComponent('foo:runtime', '1.0',
+                fileContents = [ ('/foo%d' % i, x)
+                                 for i, x in enumerate(contents) ])
+        repos = self.openRepository()
+        fileList = []
+        for pathId, path, fileId, version, fileObj in \
+                repos.iterFilesInTrove(t.getName(), t.getVersion(),
+                                       t.getFlavor(), withFiles = True):
+            fileList.append((path, (fileId, version, fileObj)))
+        fileList.sort()
+
+        self.mock(repos.cfg, 'downloadStreamsPerHost', 3)
+        self.mock(repos.cfg, 'downloadStreamSize', 1)
+        calls = []
+        origGetFileContents = repos.c['localhost'].getFileContents
+        def _getFileContents(*args, **kwargs):
+            calls.append(args)
+            return origGetFileContents(*args, **kwargs)
+        self.mock(repos.c['localhost'], 'getFileContents', _getFileContents)
+
+        f = repos.getFileContents([ x[1] for x in fileList ])
+        self.assertEqual(len(calls), 3)
+        self.assertEqual([ x.get().read() for x in f ], contents)
+
     def testFileContentsErrors(self):
         # set up two repositores. create a shadow of test:runtime from
         # the localhost repository into the localhost1 repository.
@@ -251,6 +278,58 @@ class NetclientTest(rephelp.RepositoryHelper):
         cs = changeset.ChangeSetFromFile(csfile)
         assert(cs.getPrimaryTroveList() == [('test:runtime', version, flavor)])
 
+    def testCreateChangesetCheckpoint(self):
+        rng = random.Random(0)
+        contents = ''.join(chr(rng.randrange(256)) for x in range(20000))
+        t = self.addComponent('foo:runtime', '1.0',
+                fileContents = [ ('/foo', contents) ])
+        repos = self.openRepository()
+        job = [ (t.getName(), (None, None),
+                 (t.getVersion(), t.getFlavor()), True) ]
+        checkpointDir = os.path.join(self.workDir, 'checkpoint')
+        os.mkdir(checkpointDir)
+        self.mock(repos.cfg, 'downloadAttempts', 1)
+        self.mock(repos.cfg, 'downloadRetryTrim', 10)
+
+        # the first download stops halfway through
+        origCopy = util.copyfileobj
+        def _copyHalf(inF, outF, **kwargs):
+            outF.write(inF.read(5000))
+            return 5000
+        self.mock(util, 'copyfileobj', _copyHalf)
+        self.assertRaises(errors.TruncatedResponseError,
+                repos.createChangeSet, job, checkpointDir = checkpointDir)
+        partial = [ x for x in os.listdir(checkpointDir)
+                    if not x.endswith('.sizes') ]
+        self.assertEqual(len(partial), 1)
+        self.assertEqual(os.stat(
+            os.path.join(checkpointDir, partial[0])).st_size, 5000)
+
+        # the next one picks up where it left off, less the trimmed bytes
+        self.mock(util, 'copyfileobj', origCopy)
+        kwargsList = []
+        origGetChangeSet = repos.c['localhost'].getChangeSet
+        def _getChangeSet(*args, **kwargs):
+            kwargsList.append(kwargs.copy())
+            return origGetChangeSet(*args, **kwargs)
+        self.mock(repos.c['localhost'], 'getChangeSet', _getChangeSet)
+        cs = repos.createChangeSet(job, checkpointDir = checkpointDir)
+        self.assertEqual(kwargsList, [ { 'resumeOffset' : 4990 } ])
+        self.assertEqual(cs.getJobSet(), set(job))
+        self.assertEqual(os.listdir(checkpointDir), [])
+
+        # garbage which survives the trim is caught before it is used
+        def _copyGarbage(inF, outF, **kwargs):
+            outF.write(inF.read(5000) + 'garbage' * 3)
+            return 5021
+        self.mock(util, 'copyfileobj', _copyGarbage)
+        self.assertRaises(errors.TruncatedResponseError,
+                repos.createChangeSet, job, checkpointDir = checkpointDir)
+        self.mock(util, 'copyfileobj', origCopy)
+        self.assertRaises(errors.RepositoryError,
+                repos.createChangeSet, job, checkpointDir = checkpointDir)
+        self.assertEqual(os.listdir(checkpointDir), [])
+
     def testCreateChangeset2(self):
         self.openRepository()
         repos = self.openRepository(1)
@@ -0,0 +1,91 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from testrunner import testcase
+
+import os
+
+from conary.repository.netrepos import cacheindex
+
+
+class CacheIndexTest(testcase.TestCaseWithWorkDir):
+
+    def _write(self, name, size):
+        path = os.path.join(self.workDir, 'cache', name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        f = open(path, 'w')
+        f.write('x' * size)
+        f.close()
+        return path
+
+    def _index(self, sizeLimit):
+        topDir = os.path.join(self.workDir, 'cache')
+        if not os.path.isdir(topDir):
+            os.makedirs(topDir)
+        return cacheindex.CacheIndex(
+                os.path.join(topDir, cacheindex.INDEX_NAME), sizeLimit,
+                [topDir])
+
+    def testEvictLeastRecentlyUsed(self):
+        index = self._index(1000)
+        index.scan()
+        # prune in the foreground instead
+        self.mock(index, 'maybePrune', lambda: None)
+        paths = [ self._write('aa/%d' % i, 300) for i in range(3) ]
+        for i, path in enumerate(paths):
+            index.add(path)
+            # make access order deterministic
+            cu = index._getDb().transaction()
+            cu.execute("UPDATE CacheEntries SET atime = ? WHERE path = ?",
+                    i, path)
+            index._getDb().commit()
+        self.assertEqual(index.totalSize(), 900)
+        index.touch(paths[0])
+
+        newPath = self._write('bb/new', 300)
+        index.add(newPath)
+        # touch() moved the first entry to the front, so the second one
+        # goes first
+        index.prune()
+        self.assertEqual(index.totalSize(), 900)
+        self.assertTrue(os.path.exists(paths[0]))
+        self.assertFalse(os.path.exists(paths[1]))
+        self.assertTrue(os.path.exists(paths[2]))
+        self.assertTrue(os.path.exists(newPath))
+
+    def testPersistence(self):
+        index = self._index(1000)
+        index.scan()
+        path = self._write('aa/1', 100)
+        index.add(path)
+        index.close()
+
+        index = self._index(1000)
+        self.assertEqual(index.totalSize(), 100)
+        index.remove(path)
+        self.assertEqual(index.totalSize(), 0)
+        self.assertTrue(os.path.exists(path))
+
+    def testScanExistingCache(self):
+        self._write('aa/1', 100)
+        self._write('bb/2', 200)
+        self._write('bb/2.lck', 0)
+        index = self._index(1000)
+        self.assertTrue(index._needsScan())
+        index.scan()
+        self.assertFalse(index._needsScan())
+        self.assertEqual(index.totalSize(), 300)
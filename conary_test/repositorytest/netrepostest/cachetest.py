@@ -0,0 +1,76 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from testrunner import testhelp
+
+from conary.repository.netrepos import cache
+
+
+class LRUCacheTest(testhelp.TestCase):
+
+    def testEvictLeastRecentlyUsed(self):
+        c = cache.LRUCache(limit = 3, sizeLimit = 0)
+        c.set('a', 1)
+        c.set('b', 2)
+        c.set('c', 3)
+        self.assertEqual(c.get('a'), 1)
+        c.set('d', 4)
+        # 'b' was the least recently used
+        self.assertEqual(c.get('b'), None)
+        self.assertEqual(c.get_multi(['a', 'c', 'd']),
+                         dict(a = 1, c = 3, d = 4))
+        self.assertEqual(len(c), 3)
+        self.assertEqual(c.stats()['evictions'], 1)
+        self.assertEqual(c.stats()['hits'], 4)
+        self.assertEqual(c.stats()['misses'], 1)
+
+    def testByteLimit(self):
+        value = 'x' * 1000
+        entrySize = cache.approximateSize(value) + cache.ENTRY_OVERHEAD
+        c = cache.LRUCache(limit = 0, sizeLimit = entrySize * 3)
+        for i in range(5):
+            c.set(i, value)
+        self.assertEqual(len(c), 3)
+        self.assertEqual(c.size, entrySize * 3)
+        self.assertEqual(sorted(c.get_multi(range(5))), [ 2, 3, 4 ])
+
+        # too large to store at all, and replaces the old value
+        c.set(4, 'x' * (entrySize * 4))
+        self.assertEqual(c.get(4), None)
+        self.assertEqual(c.size, entrySize * 2)
+
+    def testExpiration(self):
+        now = [ 1000.0 ]
+        self.mock(cache.pytime, 'time', lambda: now[0])
+        c = cache.LRUCache()
+        c.set('a', 'foo', time = 10, key_prefix = 'P')
+        c.set('b', 'bar')
+        self.assertEqual(c.get('a'), None)
+        self.assertEqual(c.get('a', key_prefix = 'P'), 'foo')
+        now[0] += 11
+        self.assertEqual(c.get('a', key_prefix = 'P'), None)
+        self.assertEqual(c.get('b'), 'bar')
+        self.assertEqual(c.stats()['expirations'], 1)
+        self.assertEqual(len(c), 1)
+
+    def testIncr(self):
+        c = cache.LRUCache()
+        self.assertEqual(c.incr('count'), None)
+        c.set('count', '5')
+        self.assertEqual(c.incr('count', 3), '8')
+        self.assertEqual(c.get('count'), '8')
+        c.set('name', 'foo')
+        self.assertEqual(c.incr('name'), None)
@@ -0,0 +1,88 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from testrunner import testcase
+
+import os
+
+from conary import files
+from conary.lib import sha1helper
+from conary.repository import changeset, datastore, filecontents
+from conary.repository.netrepos import contentspool
+
+
+class ContentsSpoolerTest(testcase.TestCaseWithWorkDir):
+
+    def _makeChangeSet(self, items):
+        cs = changeset.ChangeSet()
+        fileObjs = []
+        for i, (data, sentData) in enumerate(items):
+            path = os.path.join(self.workDir, 'file%d' % i)
+            open(path, 'w').write(data)
+            pathId = sha1helper.md5String(path)
+            f = files.FileFromFilesystem(path, pathId)
+            cs.addFile(None, f.fileId(), f.freeze())
+            cs.addFileContents(pathId, f.fileId(),
+                               changeset.ChangedFileTypes.file,
+                               filecontents.FromString(sentData), False)
+            fileObjs.append(f)
+        csPath = os.path.join(self.workDir, 'upload.ccs')
+        cs.writeToFile(csPath)
+        return csPath, fileObjs
+
+    def _upload(self, csPath, chunkSize):
+        storeDir = os.path.join(self.workDir, 'contents')
+        os.mkdir(storeDir)
+        store = datastore.ShallowDataStore(storeDir)
+        outPath = os.path.join(self.workDir, 'upload.ccs-in')
+        spooler = contentspool.ContentsSpooler(open(outPath, 'w'), store)
+        inF = open(csPath)
+        while True:
+            data = inF.read(chunkSize)
+            if not data:
+                break
+            spooler.write(data)
+        spooler.close()
+        self.assertEqual(open(outPath).read(), open(csPath).read())
+        return store, spooler
+
+    def testRestoreDuringUpload(self):
+        csPath, fileObjs = self._makeChangeSet(
+                [ ('first file\n' * 100, 'first file\n' * 100),
+                  ('second file\n', 'second file\n') ])
+        store, spooler = self._upload(csPath, 7)
+        self.assertEqual(spooler.restored, 2)
+        for f, data in zip(fileObjs, ('first file\n' * 100, 'second file\n')):
+            sha1 = f.contents.sha1()
+            self.assertEqual(store.openFile(sha1).read(), data)
+
+    def testBadContents(self):
+        csPath, fileObjs = self._makeChangeSet(
+                [ ('right\n', 'wrong\n'), ('other\n', 'other\n') ])
+        store, spooler = self._upload(csPath, 4096)
+        self.assertEqual(spooler.restored, 1)
+        self.assertFalse(store.hasFile(fileObjs[0].contents.sha1()))
+        self.assertTrue(store.hasFile(fileObjs[1].contents.sha1()))
+        # nothing is left behind
+        leftovers = [ x for x in os.walk(store.top) for x in x[2]
+                      if x.endswith('.new') ]
+        self.assertEqual(leftovers, [])
+
+    def testNotAChangeSet(self):
+        csPath = os.path.join(self.workDir, 'junk')
+        open(csPath, 'w').write('this is not a changeset' * 10)
+        store, spooler = self._upload(csPath, 5)
+        self.assertEqual(spooler.restored, 0)
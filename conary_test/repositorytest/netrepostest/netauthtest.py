@@ -21,7 +21,7 @@ from conary_test import rephelp
 from conary_test import dbstoretest
 
 from conary.repository import errors
-from conary.repository.netrepos import netauth
+from conary.repository.netrepos import accessmap, netauth
 from conary.repository.netrepos.auth_tokens import AuthToken
 from conary.repository.netrepos.trovestore import TroveStore
 from conary.server import schema
@@ -517,6 +517,41 @@ class NetAuthTest(dbstoretest.DBStoreTestBase):
         finally:
             netauth.log.setLevel(level)
 
+    def testRoleCache(self):
+        db = self._setupDB()
+        na = netauth.NetworkAuthorization(db, "conary.rpath.com",
+                                          cacheTimeout = 60)
+        self._addUserRole(na, "testuser", "testpass")
+        na.addRole("other")
+        roleId = na._getRoleIdByName('testuser')
+        otherId = na._getRoleIdByName('other')
+        userId = na.userAuth.getUserIdByName('testuser')
+        token = AuthToken('testuser', 'testpass')
+        self.assertEqual(na.getAuthRoles(db.cursor(), token), set([roleId]))
+
+        # changes made behind its back are not seen until the cache is
+        # invalidated, also by other instances for the same repository
+        cu = db.transaction()
+        cu.execute("INSERT INTO UserGroupMembers (userGroupId, userId) "
+                   "VALUES (?, ?)", otherId, userId)
+        db.commit()
+        na2 = netauth.NetworkAuthorization(db, "conary.rpath.com",
+                                           cacheTimeout = 60)
+        self.assertEqual(na2.getAuthRoles(db.cursor(), token), set([roleId]))
+        self.assertEqual(na.getAuthRoles(db.cursor(),
+                                         AuthToken('testuser', 'bad')), set())
+        uncached = netauth.NetworkAuthorization(db, "conary.rpath.com")
+        self.assertEqual(uncached.getAuthRoles(db.cursor(), token),
+                         set([roleId, otherId]))
+
+        na.updateRoleMembers('other', [])
+        self.assertEqual(na2.getAuthRoles(db.cursor(), token), set([roleId]))
+        na.addRoleMember('other', 'testuser')
+        self.assertEqual(na2.getAuthRoles(db.cursor(), token),
+                         set([roleId, otherId]))
+        na.deleteUserByName('testuser')
+        self.assertEqual(na2.getAuthRoles(db.cursor(), token), set())
+
 class NetAuthTest2(rephelp.RepositoryHelper):
     def _setupDB(self):
         self.openRepository()
@@ -563,3 +598,75 @@ class NetAuthTest2(rephelp.RepositoryHelper):
         self.assertEqual(na.batchCheck(rw, troveList, write=True), [True,True])
         self.assertEqual(na.batchCheck(mixed, troveList), [True,True])
         self.assertEqual(na.batchCheck(mixed, troveList, write=True), [True,False])
+
+    def _getAccessTables(self, db):
+        cu = db.cursor()
+        ret = []
+        for query in [
+                "SELECT userGroupId, instanceId, canWrite"
+                " FROM UserGroupInstancesCache",
+                "SELECT permissionId, userGroupId, instanceId, canWrite"
+                " FROM UserGroupAllPermissions",
+                "SELECT userGroupId, itemId, branchId, flavorId, versionId,"
+                " latestType FROM LatestCache"]:
+            cu.execute(query)
+            ret.append(sorted(cu.fetchall()))
+        return ret
+
+    def _checkAccessTables(self, db):
+        # incremental updates have to end up where a full rebuild does
+        tables = self._getAccessTables(db)
+        db.transaction()
+        accessmap.RoleInstances(db).rebuild()
+        db.commit()
+        self.assertEqual(tables, self._getAccessTables(db))
+
+    def testAclChangeDelta(self):
+        db = self._setupDB()
+        na = netauth.NetworkAuthorization(db, "localhost")
+        for name in ('foo:runtime', 'foo:devel', 'bar:runtime'):
+            self.addComponent(name + '=1.0')
+            self.addComponent(name + '=/localhost@rpl:branch/1.0-1-1')
+        label = 'localhost@rpl:linux'
+        branchLabel = 'localhost@rpl:branch'
+        na.addRole('limited')
+        na.addAcl('limited', 'foo:.*', label)
+        self._checkAccessTables(db)
+        na.addAcl('limited', 'ALL', branchLabel, write = True)
+        self._checkAccessTables(db)
+
+        cu = db.cursor()
+        cu.execute("SELECT itemId FROM Items WHERE item = 'foo:.*'")
+        fooId = cu.fetchone()[0]
+        cu.execute("SELECT labelId FROM Labels WHERE label = ?", label)
+        labelId = cu.fetchone()[0]
+        cu.execute("SELECT labelId FROM Labels WHERE label = ?", branchLabel)
+        branchLabelId = cu.fetchone()[0]
+        na.editAcl('limited', fooId, labelId, 0, labelId, write = True)
+        self._checkAccessTables(db)
+        na.editAcl('limited', 0, labelId, fooId, branchLabelId)
+        self._checkAccessTables(db)
+        na.deleteAcl('limited', branchLabel, 'ALL')
+        self._checkAccessTables(db)
+
+    def testOnlineRebuild(self):
+        db = self._setupDB()
+        na = netauth.NetworkAuthorization(db, "localhost")
+        for name in ('foo:runtime', 'foo:devel', 'bar:runtime'):
+            self.addComponent(name + '=1.0')
+            self.addComponent(name + '=1.1')
+        na.addRole('limited')
+        na.addAcl('limited', 'foo:.*', None, write = True)
+        tables = self._getAccessTables(db)
+
+        cu = db.transaction()
+        cu.execute("DELETE FROM UserGroupInstancesCache")
+        cu.execute("UPDATE UserGroupAllPermissions SET canWrite = 0")
+        db.commit()
+        ri = accessmap.RoleInstances(db)
+        position = ri.iterRebuild(batchSize = 2).next()
+        self.assertNotEqual(self._getAccessTables(db), tables)
+        # resuming after an interruption finishes the job
+        for position in ri.iterRebuild(start = position, batchSize = 2):
+            pass
+        self.assertEqual(self._getAccessTables(db), tables)
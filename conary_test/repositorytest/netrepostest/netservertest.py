@@ -636,6 +636,48 @@ class NetServerTest(rephelp.RepositoryHelper):
                           labels=['garblygook'],
                           thaw=False)
 
+    def testPagedNewTroves(self):
+        repos = self.openRepository()
+        self.addUserAndRole(repos, self.cfg.buildLabel, "mirror", "m")
+        repos.addAcl(self.cfg.buildLabel, "mirror", None, None)
+        repos.setRoleCanMirror(self.cfg.buildLabel, "mirror", True)
+        mirrorRepos = self.getRepositoryClient(user = 'mirror', password = 'm')
+
+        for name in ('foo', 'bar', 'baz'):
+            self.addComponent(name + ':runtime', '1')
+            self.addComponent(name + ':lib', '1')
+        # small pages which end in the middle of a mark
+        allTroves = mirrorRepos.getNewTroveList('localhost', 0)
+        self.assertEqual(len(allTroves), 6)
+        for pageSize in (1, 2, 5, 6, 100):
+            paged = list(mirrorRepos.iterNewTroveList('localhost', 0,
+                                                      pageSize = pageSize))
+            self.assertEqual(sorted(paged), sorted(allTroves))
+            marks = [ x[0] for x in paged ]
+            self.assertEqual(marks, sorted(marks))
+
+        mark = min(x[0] for x in allTroves)
+        info = mirrorRepos.getNewTroveInfo('localhost', mark, thaw=False)
+        for pageSize in (1, 4, 100):
+            paged = list(mirrorRepos.iterNewTroveInfo('localhost', mark,
+                                                      thaw=False,
+                                                      pageSize = pageSize))
+            self.assertEqual(sorted(paged), sorted(info))
+
+        # past the newest trove there is nothing
+        mark = max(x[0] for x in allTroves) + 1
+        self.assertEqual(
+            list(mirrorRepos.iterNewTroveList('localhost', mark)), [])
+        self.assertEqual(
+            list(mirrorRepos.iterNewTroveInfo('localhost', mark)), [])
+
+        # and users who cannot mirror get nothing either
+        anonRepos = self.getRepositoryClient(user = 'anonymous',
+                                             password = 'anonymous')
+        self.assertRaises(errors.InsufficientPermission, list,
+                          anonRepos.iterNewTroveList('localhost', 0))
+        self.assertEqual(list(anonRepos.iterNewTroveInfo('localhost', 0)), [])
+
     def testSetTroveInfo(self):
         repos = self.openRepository()
         trv1 = self.addComponent('foo:runtime', '1')
@@ -20,13 +20,17 @@ from testutils import mock
 from testutils.servers import memcache_server
 import copy
 import os
+import threading
+import time
 
 from conary_test import rephelp
 
 from conary import conaryclient
 from conary import trove
 from conary.files import ThawFile
+from conary.repository import datastore
 from conary.repository import errors
+from conary.repository.netrepos import inflight
 from conary.repository.netrepos import proxy as netreposproxy
 from conary.repository.netrepos import netserver
 from conary.repository.netrepos.auth_tokens import AuthToken
@@ -181,6 +185,99 @@ class ProxyUnitTest(testcase.TestCaseWithWorkDir):
         # We're not releasing locks we didn't close
         self.assertEqual(len(contents), 2 * len(fingerprints))
 
+    def testChangesetCacheJoin(self):
+        self.mock(inflight, 'LIVENESS_INTERVAL', 0)
+        cacheDir = os.path.join(self.workDir, "changesetCache")
+        os.mkdir(cacheDir)
+        cache = netreposproxy.ChangesetCache(
+                datastore.ShallowDataStore(cacheDir))
+        key = ('aaa1aaa1' + 'x' * 32, 2007022001)
+        csPath = cache.hashKey(key)
+        results = []
+
+        def follow():
+            try:
+                csInfo = cache.get(key)
+                results.append((csInfo.growing, csInfo.size))
+                fobj = inflight.GrowingFile(csInfo.path, csInfo.offset)
+                results.append(fobj.read())
+            except IOError, e:
+                results.append(e)
+
+        # The first request fetches the changeset
+        self.assertEqual(cache.get(key), None)
+        writer = cache.locksMap[csPath]
+        csInfo = netreposproxy.ChangeSetInfo()
+        csInfo.size = 12
+        csInfo.trovesNeeded = csInfo.filesNeeded = csInfo.removedTroves = []
+        csInfo.write(writer)
+        writer.write('first')
+        writer.flush()
+
+        # The next one streams it from the partial file instead
+        thread = threading.Thread(target=follow)
+        thread.start()
+        while len(results) < 1:
+            time.sleep(0.01)
+        self.assertEqual(results[0], (True, 12))
+        writer.write('second')
+        writer.commit()
+        cache.locksMap.pop(csPath)
+        thread.join()
+        self.assertEqual(results[1], 'firstsecond')
+        self.assertFalse(os.path.exists(csPath + inflight.PARTIAL_SUFFIX))
+        self.assertFalse(os.path.exists(csPath + '.lck'))
+        self.assertEqual(cache.get(key).growing, False)
+
+        # Followers find out when the writer gives up
+        del results[:]
+        key = ('aab2aab2' + 'x' * 32, 2007022001)
+        csPath = cache.hashKey(key)
+        self.assertEqual(cache.get(key), None)
+        writer = cache.locksMap[csPath]
+        csInfo.write(writer)
+        writer.flush()
+        thread = threading.Thread(target=follow)
+        thread.start()
+        while len(results) < 1:
+            time.sleep(0.01)
+        cache.resetLocks()
+        thread.join()
+        self.assertTrue(isinstance(results[1], IOError))
+        self.assertFalse(os.path.exists(csPath + inflight.PARTIAL_SUFFIX))
+        self.assertEqual(cache.get(key), None)
+        cache.resetLocks()
+
+    def testFingerprintInvalidation(self):
+        cfg = netserver.ServerConfig()
+        cfg.changesetCacheDir = os.path.join(self.workDir, "changesetCache")
+        cfg.proxyContentsDir = os.path.join(self.workDir, "proxyContents")
+        cfg.memCacheTimeout = 0
+        prs = netreposproxy.ProxyRepositoryServer(cfg, "/someUrl")
+
+        calls = []
+        class Caller(object):
+            def getChangeSetFingerprints(slf, version, chgSetList, *args):
+                calls.append(chgSetList)
+                return [ 'fp%d' % len(calls) ] * len(chgSetList)
+
+        authToken = AuthToken('user', 'pass', [], '')
+        job = ('foo:runtime', (None, None), ('/localhost@rpl:1/1.0-1-1', ''),
+               True)
+        lookup = lambda: prs.lookupFingerprints(Caller(), authToken, [ job ],
+                                                False, True, False, True,
+                                                False)
+        self.assertEqual(lookup(), [ 'fp1' ])
+        self.assertEqual(lookup(), [ 'fp1' ])
+        self.assertEqual(len(calls), 1)
+
+        # adding a signature can change the fingerprint
+        prs.invalidateFingerprints()
+        self.assertEqual(lookup(), [ 'fp2' ])
+        self.assertEqual(lookup(), [ 'fp2' ])
+        self.assertEqual(len(calls), 2)
+
+
 class ProxyTest(rephelp.RepositoryHelper):
 
     def _getRepos(self, proxyRepos):
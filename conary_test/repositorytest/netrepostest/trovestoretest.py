@@ -30,6 +30,7 @@ from conary_test import dbstoretest
 
 from conary import changelog
 from conary import files
+from conary import streams
 from conary import trove
 
 from conary.deps import deps
@@ -778,6 +779,68 @@ Some changes just are.
         assert(cu.execute("select isPresent from instances").fetchall()[0][0]
                                         == instances.INSTANCE_PRESENT_NORMAL)
 
+    def testTroveCache(self):
+        store = self._connect()
+        cu = store.db.cursor()
+        trovestore._troveCaches.clear()
+
+        v = ThawVersion("/conary.rpath.com@test:trunk/10:1.2-10")
+        x86 = deps.parseFlavor("is:x86")
+        comp = trove.Trove("foo:runtime", v, x86, None)
+        comp.computeDigests()
+        grp = trove.Trove("group-foo", v, x86, None)
+        grp.addTrove("foo:runtime", v, x86)
+        grp.troveInfo.size.set(10)
+        grp.computeDigests()
+
+        store.addTroveSetStart([], [], [])
+        for trv in (comp, grp):
+            ti = store.addTrove(trv, trv.diff(None)[0])
+            store.addTroveDone(ti)
+        store.addTroveSetDone()
+        store.db.commit()
+
+        tl = [ ("foo:runtime", v, x86), ("group-foo", v, x86),
+               ("missing", v, x86) ]
+        cached = trovestore.TroveStore(store.db, troveCacheSize = 1000000)
+        troveCache = cached.troveCache
+        for i in range(2):
+            self.assertEqual(list(cached.iterTroves(tl)), [comp, grp, None])
+        self.assertEqual(troveCache.hits, 2)
+        self.assertEqual(len(troveCache), 2)
+        # the cache is shared by later requests, and troves with and
+        # without files are cached separately
+        other = trovestore.TroveStore(store.db, troveCacheSize = 1000000)
+        self.assertTrue(other.troveCache is troveCache)
+        self.assertEqual(list(other.iterTroves(tl[1:], withFiles = False)),
+                         [grp, None])
+        self.assertEqual(len(troveCache), 3)
+        # file streams are never cached
+        self.assertEqual(list(cached.iterTroves(tl[:1],
+                                                withFileStreams = True)),
+                         [(comp, {})])
+        self.assertEqual(troveCache.hits, 2)
+
+        # trove info changed behind the cache's back shows up
+        time.sleep(1.1)
+        cu.execute("""
+        UPDATE TroveInfo SET data = ?
+        WHERE infoType = ? AND instanceId IN
+            (SELECT instanceId FROM Instances
+             JOIN Items USING (itemId) WHERE item = 'group-foo')
+        """, cu.binary(streams.LongLongStream(20).freeze()),
+             trove._TROVEINFO_TAG_SIZE)
+        store.db.commit()
+        self.assertEqual(cached.getTrove(*tl[1]).troveInfo.size(), 20)
+
+        cu.execute("SELECT instanceId FROM Instances JOIN Items USING (itemId)"
+                   " WHERE item = 'foo:runtime'")
+        instanceId = cu.fetchall()[0][0]
+        self.assertTrue((instanceId, True) in troveCache)
+        cached.markTroveRemoved(*tl[0])
+        self.assertFalse((instanceId, True) in troveCache)
+        trovestore._troveCaches.clear()
+
     def testDistributedRedirect(self):
         store = self._connect()
         cu = store.db.cursor()
@@ -116,6 +116,34 @@ class ShimNetClientTest(rephelp.RepositoryHelper):
         t = self.addComponent('test:source', '/localhost1@foo:bar/1.0-1')
         shim.getFileContents([ (x[2], x[3]) for x in t.iterFileList() ])
 
+    def testShimClientFileContentsParallel(self):
+        # contents from the shim server and a network one are fetched at
+        # once, and split requests to the shim server still go through it
+        self.openRepository(1)
+        shim = self._setupShim()[0]
+
+        contents = [ str(i) * (1000 + i * 100) for i in range(4) ]
+        t = self.addComponent('foo:runtime', '1.0',
+                fileContents = [ ('/foo%d' % i, x)
+                                 for i, x in enumerate(contents) ])
+        t1 = self.addComponent('bar:runtime', '/localhost1@rpl:linux/1.0-1-1',
+                fileContents = [ ('/bar', 'remote\n') ])
+
+        fileList = []
+        for pathId, path, fileId, version, fileObj in \
+                shim.iterFilesInTrove(t.getName(), t.getVersion(),
+                                      t.getFlavor(), withFiles = True):
+            fileList.append((path, (fileId, version, fileObj)))
+        fileList.sort()
+        fileList = [ x[1] for x in fileList ]
+        fileList += [ (x[2], x[3]) for x in t1.iterFileList() ]
+
+        self.mock(shim.cfg, 'downloadStreamsPerHost', 3)
+        self.mock(shim.cfg, 'downloadStreamSize', 1)
+        f = shim.getFileContents(fileList)
+        self.assertEqual([ x.get().read() for x in f ],
+                         contents + [ 'remote\n' ])
+
     def testShimLog(self):
         p = self.workDir + '/client.log'
         shim = self._setupShim(p)[0]
@@ -18,6 +18,7 @@
 import grp, os, pwd
 from conary_test import recipes
 
+from conary import files
 from conary.local import database
 from conary.cmds import verify
 from conary.repository import changeset
@@ -197,6 +198,91 @@ class VerifyTest(rephelp.RepositoryHelper):
         cs = changeset.ChangeSetFromFile('foo.ccs')
         assert(cs.files)
 
+    def testParallelHashCache(self):
+        db = database.Database(self.rootDir, self.cfg.dbPath)
+        os.chdir(self.workDir)
+
+        user, group = self._getUserGroup()
+        self.addComponent('foo:runtime', '1.0',
+                  fileContents = [ ('/foo%d' % i,
+                                    rephelp.RegularFile(contents = str(i),
+                                                        owner = user,
+                                                        group = group))
+                                   for i in range(10) ])
+        self.updatePkg('foo:runtime')
+        for i in range(0, 10, 2):
+            f = open(self.rootDir + '/foo%d' % i, "a")
+            f.write("mod")
+            f.close()
+
+        self.cfg.verifyThreads = 3
+        self.cfg.verifyHashCache = True
+        verify.verify(['foo:runtime'], db, self.cfg,
+                      changesetPath = 'foo.ccs')
+        cs = changeset.ChangeSetFromFile('foo.ccs')
+        assert(len(cs.files) == 5)
+        assert(os.path.exists(db.hashCachePath))
+
+        # unchanged files are not read again
+        def _noHash(*args, **kwargs):
+            raise AssertionError("file contents should not be read")
+        self.mock(files, 'contentsFromFilesystem', _noHash)
+        verify.verify(['foo:runtime'], db, self.cfg,
+                      changesetPath = 'foo.ccs')
+        cs = changeset.ChangeSetFromFile('foo.ccs')
+        assert(len(cs.files) == 5)
+
+        # unless --hash is used
+        self.assertRaises(AssertionError, verify.verify, ['foo:runtime'],
+                          db, self.cfg, forceHashCheck = True,
+                          changesetPath = 'foo.ccs')
+        self.unmock()
+
+        # or the file changes
+        f = open(self.rootDir + '/foo1', "a")
+        f.write("mod")
+        f.close()
+        verify.verify(['foo:runtime'], db, self.cfg,
+                      changesetPath = 'foo.ccs')
+        cs = changeset.ChangeSetFromFile('foo.ccs')
+        assert(len(cs.files) == 6)
+
+    def testParallelInodeCheck(self):
+        db = database.Database(self.rootDir, self.cfg.dbPath)
+        os.chdir(self.workDir)
+
+        user, group = self._getUserGroup()
+        self.addComponent('foo:runtime', '1.0',
+                  fileContents = [ ('/foo%d' % i,
+                                    rephelp.RegularFile(contents = str(i),
+                                                        owner = user,
+                                                        group = group,
+                                                        mtime = 1000))
+                                   for i in range(4) ])
+        self.updatePkg('foo:runtime')
+        for i in range(4):
+            os.utime(self.rootDir + '/foo%d' % i, (1000, 1000))
+        f = open(self.rootDir + '/foo0', "a")
+        f.write("mod")
+        f.close()
+
+        # only the file whose size changed is checksummed in the pool
+        hashed = []
+        realContents = files.contentsFromFilesystem
+        def _contents(path, *args, **kwargs):
+            hashed.append(path)
+            return realContents(path, *args, **kwargs)
+        self.mock(files, 'contentsFromFilesystem', _contents)
+
+        self.cfg.verifyThreads = 2
+        self.cfg.verifyHashCache = False
+        verify.verify(['foo:runtime'], db, self.cfg,
+                      changesetPath = 'foo.ccs')
+        self.unmock()
+        self.assertEqual(set(hashed), set([ self.rootDir + '/foo0' ]))
+        cs = changeset.ChangeSetFromFile('foo.ccs')
+        assert(len(cs.files) == 1)
+
     def testNewFiles(self):
         userDict = {}
         userDict['user'], userDict['group'] = self._getUserGroup()